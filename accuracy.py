@@ -0,0 +1,264 @@
+# Checks the cost model's predictions against measured runtimes.
+"""
+Joins the runtimes measured by the benchmarks (the raw.out logs their test.sh
+scripts write, e.g. data/ec2/raw/q1_bench/raw.out) with the costs the model
+predicts at the same points, and scores the model per workload:
+
+    - rank: the Spearman rank correlation between predicted costs and measured
+      runtimes, over every (point, plan) pair,
+    - pairwise: the fraction of pairs of plans at the same point the model
+      orders the same way as the measurements. Pairs whose runtimes are within
+      tolerance of each other are too close to call and are skipped,
+    - choice: the fraction of points where the plan the model picks runs within
+      tolerance of the fastest one,
+    - regret: how much slower, on average, the picked plans run than the
+      fastest ones (0.1 is 10% slower).
+
+Picking the right plan is what the model is for, so a model change must not
+lower pairwise or choice accuracy. --save writes the scores to a baseline file
+and --check compares against one, exiting with an error if any workload got
+worse:
+
+    $ python accuracy.py --check data/ec2/accuracy.json
+
+Runtimes are read from the results files benchmarks.py writes
+(<raw directory>/<benchmark>/results.bin, using the medians) if there are any,
+and from the raw.out logs otherwise, averaging repeated measurements.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import matrix_multiplication_cost
+import q1_cost
+import q3_cost
+import q6_cost
+import randlookup_cost
+import swapped_loops_cost
+from benchmarks import STATISTICS
+from machine import MachineProfile
+from results import read_results
+from sweep import sweep
+
+RAW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ec2", "raw")
+
+# The workloads: (name, directory of the benchmark log under the raw directory,
+# plan builder, benchmark parameters renamed to builder parameters, builder
+# parameters the benchmark doesn't print).
+WORKLOADS = [
+    ("q1", "q1_bench", q1_cost.costs, {}, {}),
+    ("q3", "q3_bench", q3_cost.costs, {}, {}),
+    ("q6", "q6", q6_cost.costs, {"vs": "v", "sel": "s"}, {"n": q6_cost.iterations}),
+    ("randlookup", "randlookup", randlookup_cost.costs, {}, {}),
+    ("matrix_multiplication", "matrix_multiplication", matrix_multiplication_cost.costs,
+        {"block_size": "b"}, {}),
+    ("swapped_loops", "swapped_loops", swapped_loops_cost.costs, {"p": "s"}, {}),
+]
+
+# Scores that must not drop.
+CHECKED = ("pairwise", "choice")
+
+def _number(s):
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+def read_bench(path):
+    # Returns [(point, {label: mean runtime})] from a benchmark log, in the
+    # order the points first appear. Points are lines like "n=10, b=2, p=0.5"
+    # and runtimes lines like "Local: 0.035 (result=...)".
+    points = []
+    times = {}
+    key = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith((">>>", "-----")) or line[:1].isspace():
+                continue
+            line = line.strip()
+            if ":" in line:
+                label, value = line.split(":", 1)
+                try:
+                    time = float(value.split()[0])
+                except (IndexError, ValueError):
+                    continue
+                if key is not None:
+                    times[key].setdefault(label, []).append(time)
+            elif "=" in line:
+                point = dict((name.strip(), _number(value))
+                             for name, value in (field.split("=", 1) for field in line.split(",")))
+                key = tuple(sorted(point.items()))
+                if key not in times:
+                    points.append((key, point))
+                    times[key] = {}
+    return [(point, dict((label, sum(t) / len(t)) for label, t in times[key].iteritems()))
+            for key, point in points]
+
+def read_results_file(path):
+    # Returns [(point, {label: median runtime})] from a results file written by
+    # benchmarks.py, in the order the points first appear.
+    rows = read_results(path)
+    names = [n for n in rows.dtype.names if n not in STATISTICS]
+    points = []
+    times = {}
+    for row in rows.tolist():
+        row = dict(zip(rows.dtype.names, row))
+        key = tuple((n, row[n]) for n in names)
+        if key not in times:
+            points.append(key)
+            times[key] = {}
+        times[key][row["plan"].rstrip("\0")] = row["median"]
+    return [(dict(key), times[key]) for key in points]
+
+def measurements(raw_dir, bench, renames, fixed):
+    # Returns [(builder parameters, {label: runtime})] for a workload, or None
+    # if there are no measurements in raw_dir.
+    path = os.path.join(raw_dir, bench, "results.bin")
+    if os.path.exists(path):
+        measured = read_results_file(path)
+    elif os.path.exists(os.path.join(raw_dir, bench, "raw.out")):
+        measured = read_bench(os.path.join(raw_dir, bench, "raw.out"))
+    else:
+        return None
+    result = []
+    for point, times in measured:
+        point = dict((renames.get(k, k), v) for k, v in point.iteritems())
+        point.update(fixed)
+        result.append((point, times))
+    return result
+
+def ranks(values):
+    # The ranks of values from 0, with ties getting their average rank.
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    result = [0.0] * len(values)
+    start = 0
+    while start < len(order):
+        end = start
+        while end + 1 < len(order) and values[order[end + 1]] == values[order[start]]:
+            end += 1
+        for i in order[start:end + 1]:
+            result[i] = (start + end) / 2.0
+        start = end + 1
+    return result
+
+def spearman(xs, ys):
+    # The Spearman rank correlation of two sequences, or None if either is
+    # constant.
+    rx, ry = ranks(xs), ranks(ys)
+    n = float(len(xs))
+    mx, my = sum(rx) / n, sum(ry) / n
+    cov = sum((a - mx) * (b - my) for a, b in zip(rx, ry))
+    vx = sum((a - mx) ** 2 for a in rx)
+    vy = sum((b - my) ** 2 for b in ry)
+    if vx == 0 or vy == 0:
+        return None
+    return cov / (vx * vy) ** 0.5
+
+def score(rows, tolerance=0.05):
+    # Scores a workload. rows is a list of {label: (predicted cost, measured
+    # runtime)} dicts, one per point. Scores that don't apply (e.g. pairwise
+    # accuracy for a workload with a single plan) are None.
+    predicted = [c for row in rows for c, _ in row.itervalues()]
+    measured = [t for row in rows for _, t in row.itervalues()]
+    pairs = correct = 0
+    choices = good = 0
+    regret = 0.0
+    for row in rows:
+        labels = sorted(row)
+        for i, a in enumerate(labels):
+            for b in labels[i + 1:]:
+                (ca, ta), (cb, tb) = row[a], row[b]
+                if abs(ta - tb) <= tolerance * min(ta, tb):
+                    continue
+                pairs += 1
+                correct += (ca < cb) == (ta < tb)
+        if len(labels) > 1:
+            chosen = min(labels, key=lambda label: row[label][0])
+            fastest = min(t for _, t in row.itervalues())
+            choices += 1
+            good += row[chosen][1] <= fastest * (1.0 + tolerance)
+            regret += row[chosen][1] / fastest - 1.0
+    return {
+        "points": len(rows),
+        "rank": spearman(predicted, measured) if len(predicted) > 1 else None,
+        "pairwise": float(correct) / pairs if pairs else None,
+        "choice": float(good) / choices if choices else None,
+        "regret": regret / choices if choices else None,
+    }
+
+def evaluate(raw_dir=RAW_DIR, profile=None, processes=1, tolerance=0.05, workloads=None):
+    # Returns {workload: scores} for the workloads with measurements in
+    # raw_dir.
+    scores = {}
+    for name, bench, builder, renames, fixed in WORKLOADS:
+        if workloads and name not in workloads:
+            continue
+        measured = measurements(raw_dir, bench, renames, fixed)
+        if not measured:
+            continue
+        points = [point for point, _ in measured]
+        rows = []
+        for (_, times), (_, costs) in zip(measured, sweep(builder, points, processes, profile=profile)):
+            rows.append(dict((label, (c, times[label])) for label, c in costs if label in times))
+        scores[name] = score(rows, tolerance)
+    return scores
+
+def regressions(scores, baseline, slack=1e-9):
+    # Returns a message for each checked score that dropped below its baseline.
+    messages = []
+    for name in sorted(baseline):
+        if name not in scores:
+            continue
+        for key in CHECKED:
+            old, new = baseline[name].get(key), scores[name].get(key)
+            if old is not None and new is not None and new < old - slack:
+                messages.append("{0}: {1} accuracy dropped from {2:.3f} to {3:.3f}".format(name, key, old, new))
+    return messages
+
+def _format(value):
+    return "-" if value is None else "{0:.3f}".format(value)
+
+def report(scores):
+    # Returns the scores as a table.
+    lines = ["{0:<24}{1:>8}{2:>8}{3:>10}{4:>8}{5:>8}".format(
+        "workload", "points", "rank", "pairwise", "choice", "regret")]
+    for name in sorted(scores):
+        s = scores[name]
+        lines.append("{0:<24}{1:>8}{2:>8}{3:>10}{4:>8}{5:>8}".format(
+            name, s["points"], _format(s["rank"]), _format(s["pairwise"]),
+            _format(s["choice"]), _format(s["regret"])))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the cost model against measured runtimes")
+    parser.add_argument("-d", "--raw-dir", default=RAW_DIR,
+        help="Directory holding the benchmark logs (defaults to data/ec2/raw)")
+    parser.add_argument("-p", "--profile", default=None,
+        help="Machine profile to cost the plans for")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+        help="Number of worker processes")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.05,
+        help="Relative runtime difference below which two plans are a tie")
+    parser.add_argument("-w", "--workload", action="append", default=None,
+        help="Only score this workload (may be repeated)")
+    parser.add_argument("--save", default=None,
+        help="Write the scores to this baseline file")
+    parser.add_argument("--check", default=None,
+        help="Fail if the scores are worse than in this baseline file")
+    args = parser.parse_args()
+
+    profile = MachineProfile.load(args.profile) if args.profile else None
+    scores = evaluate(args.raw_dir, profile, args.processes, args.tolerance, args.workload)
+    print report(scores)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(scores, f, indent=2, sort_keys=True)
+    if args.check:
+        with open(args.check) as f:
+            messages = regressions(scores, json.load(f))
+        for message in messages:
+            print >>sys.stderr, message
+        if messages:
+            sys.exit(1)
@@ -0,0 +1,119 @@
+# Arithmetic helpers shared by the cost model.
+"""
+The cost model is written against plain Python floats, but every annotation it
+reads (If.selectivity, For.iters, Vector.length) may also be bound to a NumPy
+array to cost a whole parameter grid in one pass. The helpers below replace the
+few places where the model branches on a value (min, comparisons, int
+truncation) with element-wise equivalents. For scalars they behave exactly like
+the builtins they replace, so the scalar path is unchanged.
+
+Values that are neither numbers nor arrays (for instance the symbols recorded
+by compiler.py) subclass Value and implement the helpers themselves.
+
+NumPy is only required when arrays are actually passed in.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class Value(object):
+    # Base class for non-numeric values flowing through the cost model.
+    def apply(self, op, *args):
+        # Implements the helper named op, called with args (which include
+        # self). Subclasses override this.
+        raise NotImplementedError
+
+def _value(*args):
+    # Returns the first argument that is a Value, or None.
+    for a in args:
+        if isinstance(a, Value):
+            return a
+    return None
+
+def is_array(x):
+    # Returns whether x is a NumPy array.
+    return np is not None and isinstance(x, np.ndarray)
+
+def to_float(x):
+    # float(x), applied element-wise for arrays.
+    v = _value(x)
+    if v is not None:
+        return v.apply('to_float', x)
+    if is_array(x):
+        return x.astype(float)
+    return float(x)
+
+def trunc(x):
+    # int(x), applied element-wise for arrays. Arrays stay floating point so
+    # they can be combined with other floats without a copy.
+    v = _value(x)
+    if v is not None:
+        return v.apply('trunc', x)
+    if is_array(x):
+        return np.trunc(x)
+    return int(x)
+
+def minimum(x, y):
+    # min(x, y), applied element-wise for arrays. Ties return x, like min().
+    v = _value(x, y)
+    if v is not None:
+        return v.apply('minimum', x, y)
+    if is_array(x) or is_array(y):
+        return np.where(y < x, y, x)
+    return min(x, y)
+
+def maximum(x, y):
+    # max(x, y), applied element-wise for arrays.
+    v = _value(x, y)
+    if v is not None:
+        return v.apply('maximum', x, y)
+    if is_array(x) or is_array(y):
+        return np.maximum(x, y)
+    return max(x, y)
+
+def clip(x, lo, hi):
+    # min(hi, max(x, lo)), applied element-wise for arrays.
+    v = _value(x, lo, hi)
+    if v is not None:
+        return v.apply('clip', x, lo, hi)
+    if is_array(x):
+        return np.minimum(hi, np.maximum(x, lo))
+    return min(hi, max(x, lo))
+
+def where(cond, x, y):
+    # x if cond else y, applied element-wise for arrays.
+    v = _value(cond, x, y)
+    if v is not None:
+        return v.apply('where', cond, x, y)
+    if is_array(cond):
+        return np.where(cond, x, y)
+    return x if cond else y
+
+def logical_or(x, y):
+    # x or y, applied element-wise for arrays.
+    v = _value(x, y)
+    if v is not None:
+        return v.apply('logical_or', x, y)
+    if is_array(x) or is_array(y):
+        return np.logical_or(x, y)
+    return x or y
+
+def logical_and(x, y):
+    # x and y, applied element-wise for arrays.
+    v = _value(x, y)
+    if v is not None:
+        return v.apply('logical_and', x, y)
+    if is_array(x) or is_array(y):
+        return np.logical_and(x, y)
+    return x and y
+
+def all_true(x):
+    # Returns whether x holds (for every element, if x is an array).
+    v = _value(x)
+    if v is not None:
+        return v.apply('all_true', x)
+    if is_array(x):
+        return bool(np.all(x))
+    return bool(x)
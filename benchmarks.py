@@ -0,0 +1,269 @@
+# Runs the native benchmarks and records robust statistics of their runtimes.
+"""
+Replaces the per-benchmark test.sh loops (five back-to-back runs of every point,
+averaged by the parse scripts) with a single runner:
+
+    $ python benchmarks.py -o raw q1 q6
+
+For each point of a benchmark's grid, the runner
+
+    - runs the benchmark --warmup times and discards the results,
+    - then repeats it until the 95% confidence interval of the mean runtime of
+      every plan is within --precision of the mean (at least --min-runs and at
+      most --max-runs times),
+    - and records, per plan, the median, the 95th percentile, the mean, the
+      half-width of the confidence interval and the number of runs.
+
+Noisy points are repeated more and quiet ones less. The median and 95th
+percentile, unlike the mean, aren't thrown off by an occasional outlier.
+
+The rows go to a results file (see results.py) per benchmark, e.g.
+<output>/q1_bench/results.bin (the directories the plot scripts use under raw/),
+with the grid parameters as columns and "plan", "median", "p95", "mean", "ci"
+and "runs". accuracy.py and fitting.py read these files in preference to the
+raw logs, using the medians. The machine profile the runs are for (--profile,
+or params.py by default) is saved next to them as <output>/machine.profile.
+
+Benchmarks run with OpenMP threads bound to cores (OMP_PROC_BIND, OMP_PLACES).
+--cpus also pins them to a list of CPUs with taskset, e.g. --cpus 0-7.
+
+With --counters, the q1, q3, q6 and randlookup benchmarks also read hardware
+performance counters around each timed region (see include/perf_counters.h),
+and the median count of each per plan is recorded in the columns "cycles",
+"instructions", "llc_misses", "branch_misses" and "l1d_misses", or -1 where
+the counter isn't available (e.g. in a container).
+"""
+
+import argparse
+import math
+import os
+import re
+import subprocess
+import sys
+
+from machine import DEFAULT, MachineProfile
+from results import ResultsWriter, column_type
+from sweep import grid
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# The benchmarks: (name, directory, directory of the results under the output
+# directory, grid of command line flags, plans the benchmark prints). The
+# results directories are those the plot scripts use under raw/, and the grids
+# the ones the test.sh scripts run.
+BENCHMARKS = [
+    ("q1", "q1_bench", "q1_bench", [("b", [10, 1000, 10000, 100000, 1000000, 10000000, 100000000]),
+                                    ("p", [0.01, 0.1, 0.5, 0.75, 1.0]),
+                                    ("n", [25000000])],
+        ["Local", "Global"]),
+    ("q3", "q3_bench", "q3_bench", [("b", [10, 1000, 10000, 100000, 1000000, 10000000, 100000000]),
+                                    ("p", [0.01, 0.1, 0.5, 0.75, 1.0]),
+                                    ("n", [25000000])],
+        ["Local", "Global"]),
+    ("q6", "q6_bench", "q6", [("v", [1, 5, 10]),
+                              ("s", [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]),
+                              ("n", [25000000])],
+        ["Branched", "No Branch", "Vector"]),
+    ("randlookup", "randlookup_bench", "randlookup",
+        [("k", [100, 10000, 100000, 1000000, 10000000, 100000000]),
+         ("n", [25000000])],
+        ["Result"]),
+    ("matrix_multiplication", "matrix_multiplication_bench", "matrix_multiplication",
+        [("b", [128]),
+         ("n", [128, 256, 512, 1024, 2048])],
+        ["Transposed", "Unblocked", "Blocked"]),
+    ("swapped_loops", "swapped_loops_bench", "swapped_loops",
+        [("p", [0.00001, 0.01, 0.5, 1.0]),
+         ("k", [10, 100, 1000, 10000, 1000000]),
+         ("n", [10000])],
+        ["Original", "Interchanged", "Cached"]),
+]
+
+# The hardware counters the benchmarks report with BENCH_COUNTERS set.
+COUNTERS = ("cycles", "instructions", "llc-misses", "branch-misses", "l1d-misses")
+
+# The columns of a results file that aren't grid parameters.
+STATISTICS = ("plan", "median", "p95", "mean", "ci", "runs") + tuple(c.replace("-", "_") for c in COUNTERS)
+
+# Two-sided 95% quantiles of Student's t distribution, by degrees of freedom.
+_T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# A runtime line: "Local: 0.035 (result=...)" or "Original (result=...):0.035".
+_TIME = re.compile(r"^([A-Za-z][\w ]*?)\s*(?:\([^)]*\))?\s*:\s*([0-9.]+(?:[eE][-+]?[0-9]+)?)")
+
+def parse_times(output):
+    # Returns {plan: runtime} from the output of a single benchmark run.
+    times = {}
+    for line in output.splitlines():
+        if line.startswith(">>>") or line[:1].isspace():
+            continue
+        match = _TIME.match(line)
+        if match:
+            times[match.group(1)] = float(match.group(2))
+    return times
+
+def parse_counters(output):
+    # Returns {plan: {counter: count}} from the output of a single benchmark
+    # run, i.e. from lines like ">>> counters No Branch cycles=123 ...".
+    counters = {}
+    for line in output.splitlines():
+        if not line.startswith(">>> counters "):
+            continue
+        words = line[len(">>> counters "):].split()
+        plan = " ".join(w for w in words if "=" not in w)
+        counters[plan] = dict((k, float(v)) for k, v in (w.split("=", 1) for w in words if "=" in w))
+    return counters
+
+def percentile(values, q):
+    # The q-th percentile (0 <= q <= 100) of values, interpolating linearly
+    # between the closest ranks.
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lo = int(math.floor(position))
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (position - lo)
+
+def confidence(values):
+    # The half-width of the 95% confidence interval of the mean of values.
+    n = len(values)
+    if n < 2:
+        return float("inf")
+    mean = sum(values) / float(n)
+    sd = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    t = _T95[n - 2] if n - 2 < len(_T95) else 1.96
+    return t * sd / math.sqrt(n)
+
+def summarize(values, counters=None):
+    # The statistics recorded for the runtimes of a plan, and the median of
+    # each of its counters, given as {counter: [counts]}.
+    mean = sum(values) / float(len(values))
+    return {
+        "median": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "mean": mean,
+        "ci": confidence(values),
+        "runs": len(values),
+        "counters": dict((c, percentile(v, 50)) for c, v in (counters or {}).iteritems()),
+    }
+
+def command(directory, point, cpus=None):
+    # The command line running a benchmark at a point.
+    args = [os.path.join(ROOT, directory, "bench")]
+    for flag in sorted(point):
+        args.extend(["-" + flag, str(point[flag])])
+    if cpus is not None:
+        args = ["taskset", "-c", cpus] + args
+    return args
+
+def measure(args, warmup=1, min_runs=3, max_runs=30, precision=0.02, env=None):
+    # Runs a benchmark until the runtime of every plan is known to within
+    # precision, and returns {plan: statistics}.
+    for _ in range(warmup):
+        subprocess.check_output(args, env=env)
+    samples = {}
+    counters = {}
+    runs = 0
+    while runs < max_runs:
+        output = subprocess.check_output(args, env=env)
+        for plan, time in parse_times(output).iteritems():
+            samples.setdefault(plan, []).append(time)
+        for plan, counts in parse_counters(output).iteritems():
+            for counter, count in counts.iteritems():
+                counters.setdefault(plan, {}).setdefault(counter, []).append(count)
+        runs += 1
+        if runs >= min_runs and all(confidence(v) <= precision * sum(v) / len(v)
+                                    for v in samples.itervalues()):
+            break
+    return dict((plan, summarize(values, counters.get(plan))) for plan, values in samples.iteritems())
+
+def run(directory, raw, axes, output, build=True, cpus=None, counters=False, plans=None,
+        **options):
+    # Runs the benchmark in directory over its grid and appends the statistics
+    # to <output>/<raw>/results.bin. Yields (point, {plan: statistics}). If
+    # counters is set, hardware counters are read and recorded as well. The
+    # plan column is sized for plans, the plans the benchmark prints (defaults
+    # to those it prints at the first point).
+    if build:
+        subprocess.check_call(["make", "-s", "--directory", os.path.join(ROOT, directory)])
+    env = dict(os.environ)
+    env.setdefault("OMP_PROC_BIND", "close")
+    env.setdefault("OMP_PLACES", "cores")
+    env["BENCH_COUNTERS"] = "1" if counters else "0"
+    columns = list(STATISTICS if counters else STATISTICS[:-len(COUNTERS)])
+    path = os.path.join(output, raw)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    names = [n for n, _ in axes]
+    points = grid(axes)
+    out = None
+    try:
+        for point in points:
+            stats = measure(command(directory, point, cpus), env=env, **options)
+            if out is None:
+                # String columns are sized for every point.
+                types = dict((c, "<f8") for c in columns)
+                types.update(plan=column_type("", *(stats if plans is None else plans)), runs="<i8")
+                out = ResultsWriter(os.path.join(path, "results.bin"),
+                                    [(n, column_type(*[p[n] for p in points])) for n in names] +
+                                    [(c, types[c]) for c in columns])
+            for plan in sorted(stats):
+                s = dict(stats[plan], plan=plan)
+                for counter in COUNTERS:
+                    s[counter.replace("-", "_")] = s["counters"].get(counter, -1.0)
+                out.write([point[n] for n in names] + [s[c] for c in columns])
+            out.flush()
+            yield point, stats
+    finally:
+        if out is not None:
+            out.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmarks and record their runtimes")
+    parser.add_argument("benchmarks", nargs="*",
+        help="Benchmarks to run (defaults to all of them)")
+    parser.add_argument("-o", "--output", required=True,
+        help="Directory to write the results to")
+    parser.add_argument("-p", "--profile", default=None,
+        help="Profile of the machine the benchmarks run on")
+    parser.add_argument("--warmup", type=int, default=1,
+        help="Number of runs to discard before measuring")
+    parser.add_argument("--min-runs", type=int, default=3,
+        help="Minimum number of measured runs per point")
+    parser.add_argument("--max-runs", type=int, default=30,
+        help="Maximum number of measured runs per point")
+    parser.add_argument("--precision", type=float, default=0.02,
+        help="Target half-width of the 95%% confidence interval, relative to the mean")
+    parser.add_argument("--cpus", default=None,
+        help="CPUs to pin the benchmarks to, as a taskset list (e.g. 0-7)")
+    parser.add_argument("--counters", action="store_true",
+        help="Record hardware performance counters")
+    parser.add_argument("--no-build", action="store_true",
+        help="Don't rebuild the benchmarks")
+    args = parser.parse_args()
+
+    names = [name for name, _, _, _, _ in BENCHMARKS]
+    unknown = set(args.benchmarks) - set(names)
+    if unknown:
+        parser.error("unknown benchmarks: {0}".format(", ".join(sorted(unknown))))
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    profile = MachineProfile.load(args.profile) if args.profile else DEFAULT
+    profile.save(os.path.join(args.output, "machine.profile"))
+
+    for name, directory, raw, axes, plans in BENCHMARKS:
+        if args.benchmarks and name not in args.benchmarks:
+            continue
+        for point, stats in run(directory, raw, axes, args.output, not args.no_build, args.cpus,
+                                args.counters, plans, warmup=args.warmup, min_runs=args.min_runs,
+                                max_runs=args.max_runs, precision=args.precision):
+            print "{0} {1}".format(name, ", ".join("{0}={1}".format(k, point[k]) for k in sorted(point)))
+            for plan in sorted(stats):
+                s = stats[plan]
+                print "    {0}: median {1:.6f}, p95 {2:.6f}, +-{3:.1f}% over {4} runs".format(
+                    plan, s["median"], s["p95"], 100 * s["ci"] / s["mean"], s["runs"])
+                if s["counters"]:
+                    print "        " + ", ".join("{0} {1:.0f}".format(c, s["counters"][c])
+                                                 for c in COUNTERS if c in s["counters"])
+            sys.stdout.flush()
@@ -0,0 +1,396 @@
+# A cache simulator to check the analytic memory model against.
+"""
+simulate() runs the loop nest of a plan through a simulated cache hierarchy and
+counts where each access hits, next to the level fractions the analytic model
+(cost_with_bandwidth.cost) predicts for the same lookups:
+
+    sim = simulate(For(n, Id("i"), 1, Lookup(Vector("R", k), Lookup("A", Id("i")))))
+    print sim
+
+The caches are set-associative with LRU replacement and the sizes, line size
+and associativity of the machine profile (L1_WAYS etc.). Each level is filled on
+a miss; no level is inclusive of another. A single thread is simulated, so the
+analytic fractions are those of cost(expr, threads=1).
+
+The addresses are generated by interpreting the plan:
+
+    - Only perfectly nested For loops are supported (loops whose body contains
+      another loop can't be flattened into a single iteration space).
+    - Loop variables and arithmetic on them are evaluated exactly. Values loaded
+      from memory are unknown, so a lookup indexed by one (e.g. R[A[i]]) reads
+      a uniformly random element of the vector.
+    - The branches of an If are taken at random with the If's selectivity.
+    - Vectors are laid out one after the other, page aligned; a lookup with
+      several indices addresses a row-major array whose dimensions are the
+      trip counts of the loops indexing it.
+
+Simulating every access is slow, so large plans are simulated at a scale: with
+scale=0.01, the trip counts, vector lengths and cache sizes are all 100x smaller
+(both the simulation and the analytic estimate use the scaled plan). Nests with
+more than max_iterations iterations are also sampled: windows spread over the
+iteration space are simulated, each after a warm-up, and the counts are
+extrapolated to the whole loop.
+
+reuse_histograms() uses the same traces to sample the distribution of the reuse
+distances of each lookup, which cost_with_bandwidth.cost can weight the cache
+levels by (cost(expr, reuse=reuse_histograms(expr))).
+"""
+
+from arith import np
+from cost_with_bandwidth import cost
+from expressions import *
+from machine import DEFAULT
+from reuse_distance import ReuseHistogram, stack_distances
+
+# The levels accesses can hit, from L1 to memory.
+LEVELS = ("L1", "L2", "L3", "MEM")
+
+# Number of iterations whose addresses are generated at once.
+BATCH = 1 << 14
+
+# Vectors start on page boundaries.
+PAGE_SIZE = 4096
+
+class Cache(object):
+    # A set-associative cache holding line numbers, with LRU replacement.
+    def __init__(self, lines, ways):
+        lines = max(1, int(lines))
+        self.ways = max(1, min(int(ways), lines))
+        self.sets = max(1, lines // self.ways)
+        # Each set lists its lines from least to most recently used.
+        self._sets = [[] for _ in xrange(self.sets)]
+
+    def access(self, line):
+        # Returns whether line is cached. A missing line is brought in,
+        # evicting the least recently used line of its set if it is full.
+        s = self._sets[line % self.sets]
+        if line in s:
+            if s[-1] != line:
+                s.remove(line)
+                s.append(line)
+            return True
+        s.append(line)
+        if len(s) > self.ways:
+            del s[0]
+        return False
+
+class Hierarchy(object):
+    # The caches of a machine profile.
+    def __init__(self, profile=DEFAULT):
+        self.caches = [Cache(size, ways) for size, ways in zip(profile.cache_sizes, profile.cache_ways)]
+
+    def access(self, line):
+        # Returns the index in LEVELS of the level that served line.
+        for level, cache in enumerate(self.caches):
+            if cache.access(line):
+                return level
+        return len(self.caches)
+
+class Simulation(object):
+    # The result of simulate().
+    #   lookups: the lookups of the plan, in the order they are first reached.
+    #   hits: {lookup: [expected accesses served by each of LEVELS]} over the
+    #     whole loop.
+    #   analytic: {lookup: the cost_with_bandwidth.cost details of lookup}.
+    #   iterations: the number of iterations of the loop nest.
+    #   simulated: the number of iterations whose accesses were counted.
+    def __init__(self, lookups, hits, analytic, iterations, simulated):
+        self.lookups = lookups
+        self.hits = hits
+        self.analytic = analytic
+        self.iterations = iterations
+        self.simulated = simulated
+
+    def fractions(self, lookup):
+        # Returns the fraction of the accesses of lookup served by each level.
+        total = float(sum(self.hits[lookup]))
+        if total == 0:
+            return [0.0] * len(LEVELS)
+        return [h / total for h in self.hits[lookup]]
+
+    def total(self):
+        # Returns the accesses served by each level, over all lookups.
+        return [sum(self.hits[l][i] for l in self.lookups) for i in xrange(len(LEVELS))]
+
+    def __str__(self):
+        lines = ["{0} of {1} iterations simulated".format(self.simulated, self.iterations)]
+        header = "".join("{0:>8}".format(level) for level in LEVELS)
+        lines.append("{0:<40} {1:>12} {2}".format("lookup", "accesses", header))
+        for l in self.lookups:
+            name = str(l)[:40]
+            lines.append("{0:<40} {1:>12.4g} {2}  simulated".format(
+                name, sum(self.hits[l]), "".join("{0:>8.3f}".format(f) for f in self.fractions(l))))
+            d = self.analytic.get(l)
+            if d is not None:
+                lines.append("{0:<40} {1:>12.4g} {2}  model".format(
+                    "", float(d["accesses"]), "".join("{0:>8.3f}".format(float(f)) for f in d["levels"])))
+        return "\n".join(lines)
+
+def scaled(expr, scale, memo=None):
+    # Returns a copy of expr with the trip counts of its loops and the lengths
+    # of its vectors multiplied by scale.
+    if memo is None:
+        memo = {}
+    if id(expr) in memo:
+        return memo[id(expr)]
+    node = object.__new__(type(expr))
+    for f in expr._fields:
+        value = getattr(expr, f)
+        if isinstance(value, Expr):
+            value = scaled(value, scale, memo)
+        elif isinstance(value, list):
+            value = [scaled(v, scale, memo) if isinstance(v, Expr) else v for v in value]
+        object.__setattr__(node, f, value)
+    if isinstance(node, For):
+        node.iters = max(node.stride, int(round(node.iters * scale)))
+    elif isinstance(node, Vector):
+        node.length = int(round(node.length * scale))
+    memo[id(expr)] = node
+    return node
+
+def scaled_profile(profile, scale):
+    # Returns profile with its caches scaled by scale (but at least one set).
+    sizes = [max(ways, int(round(size * scale))) for size, ways in zip(profile.cache_sizes, profile.cache_ways)]
+    return profile.replace(name="{0}*{1}".format(profile.name, scale),
+                           L1_SIZE=sizes[0], L2_SIZE=sizes[1], L3_SIZE=sizes[2])
+
+def _loop_nest(expr):
+    # Returns the loops of a perfect loop nest, outermost first, and its body.
+    loops = []
+    while isinstance(expr, For):
+        loops.append(expr)
+        expr = expr.expr
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, For):
+            raise ValueError("only perfectly nested loops can be simulated")
+        stack.extend(node.children())
+    return loops, expr
+
+class _Interpreter(object):
+    # Generates the addresses accessed by a batch of iterations of a loop nest.
+    def __init__(self, loops, line_size, rng):
+        self.loops = loops
+        self.extents = dict((loop.loopIdx, int(loop.iters)) for loop in loops)
+        self.line_size = line_size
+        self.rng = rng
+        # Base addresses and sizes of the vectors, in the order they are
+        # first accessed.
+        self.bases = {}
+        self.next_base = PAGE_SIZE
+
+    def run(self, env, n, mask, body, accesses):
+        # Evaluates body for n iterations, whose loop variables have the values
+        # in env. accesses gets a (lookup, lines, mask) triple per lookup.
+        self.n = n
+        self.accesses = accesses
+        self._eval(body, env, mask)
+
+    def _base(self, vector, size):
+        if vector not in self.bases:
+            self.bases[vector] = self.next_base
+            self.next_base = self.next_base + (size // PAGE_SIZE + 1) * PAGE_SIZE
+        return self.bases[vector]
+
+    def _extent(self, lookup, dim):
+        index = lookup.index[dim]
+        if index in self.extents:
+            return self.extents[index]
+        if len(lookup.index) == 1 and lookup.vector.length > 0:
+            return int(lookup.vector.length)
+        raise ValueError("can't tell the size of dimension {0} of {1}".format(dim, lookup))
+
+    def _eval(self, node, env, mask):
+        # Returns the values of node in each iteration, or None if they are
+        # unknown.
+        if isinstance(node, Literal):
+            if isinstance(node.value, (int, long, float)):
+                return np.full(self.n, node.value)
+            return None
+        if isinstance(node, Id):
+            return env.get(node)
+        if isinstance(node, Let):
+            env = dict(env)
+            env[node.name] = self._eval(node.value, env, mask)
+            return self._eval(node.expr, env, mask)
+        if isinstance(node, Lookup):
+            flat = 0
+            for dim, index in enumerate(node.index):
+                extent = self._extent(node, dim)
+                value = self._eval(index, env, mask)
+                if value is None:
+                    value = self.rng.randint(0, max(1, extent), self.n)
+                flat = flat * extent + value.astype(np.int64)
+            size = int(node.elemSize)
+            extents = [self._extent(node, dim) for dim in xrange(len(node.index))]
+            base = self._base(node.vector, size * reduce(lambda x, y: x * y, extents))
+            self.accesses.append((node, (base + flat * size) // self.line_size, mask))
+            return None
+        if isinstance(node, If):
+            self._eval(node.cond, env, mask)
+            taken = self.rng.random_sample(self.n) < node.selectivity
+            self._eval(node.true, env, mask & taken)
+            self._eval(node.false, env, mask & ~taken)
+            return None
+        if isinstance(node, BinaryExpr):
+            left = self._eval(node.left, env, mask)
+            right = self._eval(node.right, env, mask)
+            if left is None or right is None:
+                return None
+            return _BINARY_OPS[type(node)](left, right)
+        for c in node.children():
+            self._eval(c, env, mask)
+        return None
+
+_BINARY_OPS = {
+    GreaterThan: lambda l, r: (l > r).astype(np.int64),
+    LogicalAnd: lambda l, r: ((l != 0) & (r != 0)).astype(np.int64),
+    BitwiseAnd: lambda l, r: l.astype(np.int64) & r.astype(np.int64),
+    Add: lambda l, r: l + r,
+    Subtract: lambda l, r: l - r,
+    Multiply: lambda l, r: l * r,
+    Divide: lambda l, r: l // r,
+    Mod: lambda l, r: l % r,
+}
+
+def _windows(iterations, max_iterations, windows):
+    # Returns the (start, warm-up end, end) iterations of the windows to
+    # simulate.
+    if iterations <= max_iterations:
+        return [(0, 0, iterations)]
+    length = max_iterations // windows
+    step = iterations // windows
+    return [(k * step, k * step + length // 4, k * step + length) for k in xrange(windows)]
+
+def iterations(expr):
+    # Returns the number of iterations of the loop nest expr.
+    loops, _ = _loop_nest(expr)
+    return reduce(lambda x, y: x * y, [max(1, int(loop.iters) // loop.stride) for loop in loops], 1)
+
+def trace(expr, line_size, max_iterations=1 << 18, windows=16, seed=0):
+    # Generates the accesses of the loop nest expr in program order: iteration
+    # by iteration, and in each iteration in the order the lookups are
+    # evaluated. Yields batches of (lookups, sites, lines, counted, n), where
+    # the i-th access is by lookups[sites[i]] to cache line lines[i], counted[i]
+    # is false for accesses in a warm-up and n is the number of iterations
+    # counted. See above for max_iterations.
+    loops, body = _loop_nest(expr)
+    trips = [max(1, int(loop.iters) // loop.stride) for loop in loops]
+    interpreter = _Interpreter(loops, line_size, np.random.RandomState(seed))
+
+    for start, warm, end in _windows(iterations(expr), max_iterations, windows):
+        for batch in xrange(start, end, BATCH):
+            t = np.arange(batch, min(batch + BATCH, end), dtype=np.int64)
+            n = len(t)
+            # The values of the loop variables in each iteration.
+            env = {}
+            inner = 1
+            for loop, trip in reversed(zip(loops, trips)):
+                env[loop.loopIdx] = (t // inner) % trip * loop.stride
+                inner = inner * trip
+
+            accesses = []
+            interpreter.run(env, n, np.ones(n, dtype=bool), body, accesses)
+            counted_iterations = int(np.count_nonzero(t >= warm))
+            if not accesses:
+                yield [], [], [], [], counted_iterations
+                continue
+
+            lines = np.array([l for _, l, _ in accesses]).T.ravel()
+            masks = np.array([m for _, _, m in accesses]).T.ravel()
+            sites = np.tile(np.arange(len(accesses)), n)
+            counted = (t >= warm).repeat(len(accesses))
+            yield ([lookup for lookup, _, _ in accesses], sites[masks].tolist(),
+                   lines[masks].tolist(), counted[masks].tolist(), counted_iterations)
+
+def simulate(expr, profile=None, scale=1.0, max_iterations=1 << 18, windows=16, seed=0):
+    # Simulates the accesses of the loop nest expr on the caches of profile
+    # (by default the one in params.py) and returns a Simulation. See above
+    # for scale and max_iterations.
+    if profile is None:
+        profile = DEFAULT
+    if scale != 1.0:
+        expr = scaled(expr, scale)
+        profile = scaled_profile(profile, scale)
+
+    details = []
+    cost(expr, profile, threads=1, details=details)
+    analytic = dict((d["lookup"], d) for d in details)
+
+    hierarchy = Hierarchy(profile)
+    access = hierarchy.access
+    lookups = []
+    counts = {}
+    simulated = 0
+    for batch_lookups, sites, lines, counted, n in trace(expr, profile.CACHE_LINE_SIZE,
+                                                         max_iterations, windows, seed):
+        simulated += n
+        for lookup in batch_lookups:
+            if lookup not in counts:
+                lookups.append(lookup)
+                counts[lookup] = [0] * len(LEVELS)
+        site_counts = [counts[lookup] for lookup in batch_lookups]
+        for site, line, c in zip(sites, lines, counted):
+            level = access(line)
+            if c:
+                site_counts[site][level] += 1
+
+    factor = float(iterations(expr)) / simulated
+    hits = dict((l, [c * factor for c in counts[l]]) for l in lookups)
+    return Simulation(lookups, hits, analytic, iterations(expr), simulated)
+
+def reuse_histograms(expr, profile=None, scale=1.0, max_iterations=1 << 16, windows=16, seed=0):
+    # Returns {lookup: ReuseHistogram} for the lookups of the loop nest expr.
+    #
+    # Sequential lookups (see expressions.access_pattern) get a single point at
+    # the model's reuse distance. The others are sampled: their stack distances
+    # are computed over a trace (see trace()) of the loop nest shrunk by scale
+    # as in simulate(), then divided by scale.
+    if profile is None:
+        profile = DEFAULT
+    details = []
+    cost(expr, profile, threads=1, details=details)
+    histograms = {}
+    for d in details:
+        if d["access"] == "sequential":
+            histograms[d["lookup"]] = ReuseHistogram.point(d["reuse_distance"])
+    if len(histograms) == len(details):
+        return histograms
+
+    # The trace is of the scaled plan; map its lookups back.
+    memo = {}
+    traced = scaled(expr, scale, memo) if scale != 1.0 else expr
+    originals = dict((id(copy), node) for node, copy in
+                     ((n, memo.get(id(n), n)) for n in _nodes(expr)))
+
+    accesses = []
+    lines = []
+    counted = []
+    for batch_lookups, batch_sites, batch_lines, batch_counted, _ in trace(
+            traced, profile.CACHE_LINE_SIZE, max_iterations, windows, seed):
+        batch_lookups = [originals[id(l)] for l in batch_lookups]
+        accesses.extend(batch_lookups[site] for site in batch_sites)
+        lines.extend(batch_lines)
+        counted.extend(batch_counted)
+
+    distances = {}
+    cold = {}
+    for lookup, c, distance in zip(accesses, counted, stack_distances(lines)):
+        if not c or lookup in histograms:
+            continue
+        if distance < 0:
+            cold[lookup] = cold.get(lookup, 0) + 1
+        else:
+            distances.setdefault(lookup, []).append(distance / scale)
+    for lookup in set(distances) | set(cold):
+        histograms[lookup] = ReuseHistogram(distances.get(lookup, []), cold.get(lookup, 0))
+    return histograms
+
+def _nodes(expr):
+    # Yields the nodes of expr.
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children())
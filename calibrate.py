@@ -0,0 +1,181 @@
+# Measures the parameters of this machine and writes a machine profile.
+"""
+Builds and runs the microbenchmarks in parameter_estimation/calibrate and fits
+their results into a MachineProfile:
+
+    - the clock frequency, from a chain of dependent adds,
+    - cache sizes and associativity, the line size and the number of NUMA
+      nodes, from sysfs,
+    - the load latency of each level of the memory hierarchy, from a pointer
+      chasing walk over a working set of half that level's size (and 8x the
+      L3 size for memory), in cycles,
+    - the read throughput of each level, from all cores streaming over the
+      same working sets, and the memory throughput of a single core,
+    - the cost of an atomic add relative to a regular one, and the extra cost
+      under contention (ATOMICADD_LATENCY and ATOMICADD_PENALTY, as in
+      expressions.VecMergerMerge), from the same loop as
+      parameter_estimation/atomic,
+    - the branch misprediction penalty, from a branch over sorted and random
+      data. A random branch with selectivity 0.5 costs BRANCHPRED_LATENCY
+      extra cycles per iteration in the model.
+
+With --simd, the profile also gets the vector register width from
+/proc/cpuinfo as SIMD_WIDTH, which switches on the lane-by-lane model of
+vectorized loops (see params.py). It is off by default, as in params.py.
+
+Parameters that aren't measured (e.g. REMOTE_MEM_LATENCY, which needs numactl
+to place memory on another node) keep their values from params.py. The whole run
+takes a few seconds:
+
+    $ python calibrate.py -o host.profile
+"""
+
+import argparse
+import glob
+import multiprocessing
+import os
+import subprocess
+
+from machine import DEFAULT
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "parameter_estimation", "calibrate")
+
+def cache_hierarchy():
+    # Returns (line size, [L1 data, L2, L3 sizes] in bytes, [L1 data, L2, L3
+    # ways]) from sysfs, or None if they aren't available.
+    sizes = {}
+    ways = {}
+    line_size = None
+    for index in glob.glob("/sys/devices/system/cpu/cpu0/cache/index*"):
+        def read(name):
+            with open(os.path.join(index, name)) as f:
+                return f.read().strip()
+        try:
+            if read("type") == "Instruction":
+                continue
+            size = read("size")
+            multiplier = {"K": 1 << 10, "M": 1 << 20}.get(size[-1], 1)
+            level = int(read("level"))
+            sizes[level] = int(size.rstrip("KM")) * multiplier
+            ways[level] = int(read("ways_of_associativity"))
+            line_size = int(read("coherency_line_size"))
+        except (IOError, ValueError):
+            return None
+    if sorted(sizes) != [1, 2, 3]:
+        return None
+    return line_size, [sizes[1], sizes[2], sizes[3]], [ways[1], ways[2], ways[3]]
+
+def numa_nodes():
+    # Returns the number of NUMA nodes, or 1 if sysfs doesn't say.
+    return max(1, len(glob.glob("/sys/devices/system/node/node[0-9]*")))
+
+def simd_width():
+    # Returns the width in bytes of the widest vector registers the CPU
+    # supports, or None if /proc/cpuinfo doesn't say.
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = set(line.split(":", 1)[1].split())
+                    for flag, width in (("avx512f", 64), ("avx2", 32), ("sse2", 16)):
+                        if flag in flags:
+                            return width
+                    return None
+    except IOError:
+        pass
+    return None
+
+def working_sets(cache_bytes):
+    # The working set measuring each level: half of each cache, and memory.
+    return [size / 2 for size in cache_bytes] + [max(8 * cache_bytes[-1], 256 << 20)]
+
+def run(sizes, threads, scale=1.0, build=True):
+    # Runs the benchmarks and returns {(name, size): value}.
+    if build:
+        subprocess.check_call(["make", "-s", "--directory", BENCH_DIR])
+    out = subprocess.check_output([os.path.join(BENCH_DIR, "bench"),
+                                   "-w", ",".join(str(s) for s in sizes),
+                                   "-t", str(threads),
+                                   "-s", str(scale)])
+    results = {}
+    for line in out.splitlines():
+        if line.startswith(">>>"):
+            _, name, size, value = line.split()
+            results[(name, int(size))] = float(value)
+    return results
+
+def fit(results, sizes, threads, line_size, cache_bytes, cache_ways=None, base=DEFAULT):
+    # Returns the profile fitted to the benchmark results.
+    values = {}
+    if cache_ways is not None:
+        values["L1_WAYS"], values["L2_WAYS"], values["L3_WAYS"] = cache_ways
+    clock = results[("clock", 0)]
+    values["CLOCK_FREQUENCY"] = clock
+    values["CORES"] = threads
+    values["SOCKETS"] = numa_nodes()
+    values["CACHE_LINE_SIZE"] = line_size
+    values["L1_SIZE"], values["L2_SIZE"], values["L3_SIZE"] = [b / line_size for b in cache_bytes]
+
+    # Latencies in cycles. Measurement noise can make a level look faster than
+    # the one above it, which the model doesn't expect.
+    latency = 0.0
+    for level, size in zip(["L1", "L2", "L3", "MEM"], sizes):
+        latency = max(latency, round(results[("latency", size)] * clock, 1))
+        values[level + "_LATENCY"] = latency
+        values[level + "_THROUGHPUT"] = results[("throughput", size)]
+    values["MEM_THROUGHPUT_PER_CORE"] = results[("core_throughput", sizes[-1])]
+
+    add = results[("add", 0)]
+    atomic = results[("atomic_add", 0)]
+    values["ATOMICADD_LATENCY"] = round(atomic / add, 2)
+    if threads > 1:
+        # The contended benchmark has all threads updating 8 elements.
+        p_contend = 1.0 - pow(1.0 - 1.0 / 8, threads)
+        penalty = (results[("contended_atomic_add", 8)] - atomic) / add / p_contend
+        values["ATOMICADD_PENALTY"] = round(max(0.0, penalty), 2)
+
+    mispredict = results[("random_branch", 0)] - results[("sorted_branch", 0)]
+    values["BRANCHPRED_LATENCY"] = round(max(0.0, mispredict * clock), 1)
+
+    return base.replace(name="calibrated", **values)
+
+def calibrate(threads=None, scale=1.0, build=True, simd=False):
+    # Measures this machine and returns its profile, with SIMD_WIDTH set if
+    # simd is.
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+    hierarchy = cache_hierarchy()
+    if hierarchy is None:
+        line_size = DEFAULT.CACHE_LINE_SIZE
+        cache_bytes = [size * line_size for size in DEFAULT.cache_sizes]
+        cache_ways = None
+    else:
+        line_size, cache_bytes, cache_ways = hierarchy
+    sizes = working_sets(cache_bytes)
+    results = run(sizes, threads, scale, build)
+    profile = fit(results, sizes, threads, line_size, cache_bytes, cache_ways)
+    width = simd_width() if simd else None
+    if width is not None:
+        profile = profile.replace(SIMD_WIDTH=width)
+    return profile
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure this machine and write a machine profile")
+    parser.add_argument("-o", "--output", required=True,
+        help="File to write the profile to")
+    parser.add_argument("-t", "--threads", type=int, default=None,
+        help="Number of threads (defaults to the number of CPUs)")
+    parser.add_argument("-s", "--scale", type=float, default=1.0,
+        help="Scales the run time of the benchmarks")
+    parser.add_argument("--simd", action="store_true",
+        help="Set SIMD_WIDTH, enabling the lane-by-lane vectorization model")
+    parser.add_argument("--no-build", action="store_true",
+        help="Don't rebuild the benchmarks")
+    args = parser.parse_args()
+
+    profile = calibrate(args.threads, args.scale, not args.no_build, args.simd)
+    profile.save(args.output)
+    for field in profile.FIELDS:
+        if getattr(profile, field) != getattr(DEFAULT, field):
+            print "{0} = {1!r} (was {2!r})".format(field, getattr(profile, field), getattr(DEFAULT, field))
@@ -0,0 +1,245 @@
+# Compiles expression trees into flat cost programs.
+"""
+Costing a tree with cost_with_bandwidth.cost re-walks it on every call: context
+dictionary lookups, loop stack pushes in For.cost, a fresh search over the
+condition in If.cost, and reuse distance computations for every Lookup. None of
+that depends on the annotation values, only on the shape of the tree.
+
+The compiler runs the cost model once with symbolic parameters (Param) bound
+in place of the annotations that should stay free, e.g.
+
+    branch.selectivity = Param("p")
+    loop = For(Param("n"), Id("i"), 1, body)
+    program = compile_cost(loop)
+    program(p=0.5, n=1e6)
+
+Every arithmetic operation on a parameter is recorded, and everything else is
+folded into constants while tracing. The recorded operations are emitted as a
+straight-line Python function (one local per operation, common subexpressions
+shared), so evaluating the program is plain arithmetic with no tree walk and no
+dictionary lookups. Since the same operations are replayed in the same order,
+the results are identical to cost(), and, as with cost_batch, parameters may be
+bound to NumPy arrays to evaluate a whole grid at once.
+"""
+
+import math
+import threading
+
+import arith
+from arith import Value
+
+# Operators and the Python source they compile to.
+_BINARY_OPS = {
+    "add": "{0} + {1}",
+    "sub": "{0} - {1}",
+    "mul": "{0} * {1}",
+    "div": "{0} / {1}",
+    "pow": "{0} ** {1}",
+    "lt": "{0} < {1}",
+    "le": "{0} <= {1}",
+    "gt": "{0} > {1}",
+    "ge": "{0} >= {1}",
+    "eq": "{0} == {1}",
+    "ne": "{0} != {1}",
+}
+
+_UNARY_OPS = {
+    "neg": "-{0}",
+    "abs": "abs({0})",
+}
+
+# Helpers from arith.py, called by name from the generated code.
+_HELPER_OPS = ["to_float", "trunc", "minimum", "maximum", "clip", "where", "logical_or", "logical_and"]
+
+class Sym(Value):
+    # A symbolic value: the result of applying op to args. Args are either
+    # other symbols or constants.
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+
+    def apply(self, op, *args):
+        if op == "all_true":
+            # Can't be decided while tracing, so the model keeps going and
+            # masks the remaining work with where().
+            return False
+        return _make(op, args)
+
+    def __add__(self, other): return _make("add", (self, other))
+    def __radd__(self, other): return _make("add", (other, self))
+    def __sub__(self, other): return _make("sub", (self, other))
+    def __rsub__(self, other): return _make("sub", (other, self))
+    def __mul__(self, other): return _make("mul", (self, other))
+    def __rmul__(self, other): return _make("mul", (other, self))
+    def __div__(self, other): return _make("div", (self, other))
+    def __rdiv__(self, other): return _make("div", (other, self))
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+    def __pow__(self, other): return _make("pow", (self, other))
+    def __rpow__(self, other): return _make("pow", (other, self))
+    def __neg__(self): return _make("neg", (self,))
+    def __abs__(self): return _make("abs", (self,))
+    def __lt__(self, other): return _make("lt", (self, other))
+    def __le__(self, other): return _make("le", (self, other))
+    def __gt__(self, other): return _make("gt", (self, other))
+    def __ge__(self, other): return _make("ge", (self, other))
+    def __eq__(self, other): return _make("eq", (self, other))
+    def __ne__(self, other): return _make("ne", (self, other))
+
+    # Symbols can't be used as dictionary keys, which also keeps them out of
+    # the caches in the cost model.
+    __hash__ = None
+
+    def __nonzero__(self):
+        raise TypeError("symbolic cost value used in a branch; use the arith helpers instead")
+    __bool__ = __nonzero__
+
+    def __str__(self):
+        return "{0}({1})".format(self.op, ", ".join(str(a) for a in self.args))
+
+class Param(Sym):
+    # A free parameter of a cost program.
+    def __init__(self, name):
+        Sym.__init__(self, "param", ())
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+def _key(x):
+    # A hashable key for an operand. Symbols are keyed by identity, constants
+    # by type and value (1 and 1.0 differ under Python 2 division).
+    if isinstance(x, Sym):
+        return ("sym", id(x))
+    try:
+        hash(x)
+    except TypeError:
+        return ("id", id(x))
+    return (type(x), x)
+
+# Per-thread tracing state. While a trace is in progress, `symbols` maps
+# (op, operand keys) to the symbol recorded for it, so that common
+# subexpressions are only emitted once.
+_state = threading.local()
+
+def _make(op, args):
+    sym = Sym(op, args)
+    symbols = getattr(_state, "symbols", None)
+    if symbols is None:
+        return sym
+    key = (op,) + tuple(_key(a) for a in args)
+    return symbols.setdefault(key, sym)
+
+def format_instruction(op, args):
+    # Returns the Python source for applying op to the operands args.
+    if op in _BINARY_OPS:
+        return _BINARY_OPS[op].format(*args)
+    if op in _UNARY_OPS:
+        return _UNARY_OPS[op].format(*args)
+    return "{0}({1})".format(op, ", ".join(args))
+
+def program_namespace(constants):
+    # Returns the globals generated code runs with: the arith helpers and the
+    # constants that were given names.
+    namespace = dict((h, getattr(arith, h)) for h in _HELPER_OPS)
+    namespace.update(constants)
+    return namespace
+
+class CostProgram(object):
+    # A compiled cost function.
+    def __init__(self, params, instructions, result, constants):
+        # Names of the free parameters.
+        self.params = params
+        # A list of (name, op, operands) instructions, in evaluation order.
+        # Operands are parameter or instruction names, or constants.
+        self.instructions = instructions
+        # The operand holding the cost.
+        self.result = result
+        # Constants without a literal form (inf, nan, arrays).
+        self.constants = constants
+        self.source = self._source()
+        namespace = program_namespace(constants)
+        exec compile(self.source, "<cost program>", "exec") in namespace
+        self._fn = namespace["program"]
+
+    def _source(self):
+        lines = ["def program({0}):".format(", ".join(self.params))]
+        for name, op, args in self.instructions:
+            lines.append("    {0} = {1}".format(name, format_instruction(op, args)))
+        lines.append("    return {0}".format(self.result))
+        return "\n".join(lines) + "\n"
+
+    def __call__(self, *args, **kwargs):
+        return self._fn(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def __str__(self):
+        return self.source
+
+def _is_literal(x):
+    # Returns whether repr(x) evaluates back to x.
+    if isinstance(x, float):
+        return not (math.isinf(x) or math.isnan(x))
+    return isinstance(x, (bool, int, long))
+
+def lower(result, params=()):
+    # Lowers a traced result to a CostProgram. params lists parameter names
+    # that must be accepted even if the cost doesn't depend on them.
+    params = list(params)
+    instructions = []
+    constants = {}
+    names = {}
+
+    def operand(x):
+        if isinstance(x, Sym):
+            return names[id(x)]
+        if _is_literal(x):
+            return repr(x) if x >= 0 else "({0!r})".format(x)
+        name = "k{0}".format(len(constants))
+        constants[name] = x
+        return name
+
+    def visit(sym):
+        if id(sym) in names:
+            return
+        if isinstance(sym, Param):
+            if sym.name not in params:
+                params.append(sym.name)
+            names[id(sym)] = sym.name
+            return
+        for a in sym.args:
+            if isinstance(a, Sym):
+                visit(a)
+        name = "t{0}".format(len(instructions))
+        instructions.append((name, sym.op, [operand(a) for a in sym.args]))
+        names[id(sym)] = name
+
+    if isinstance(result, Sym):
+        visit(result)
+    return CostProgram(params, instructions, operand(result), constants)
+
+def compile_cost(expr, cost=None):
+    # Compiles the cost of expr, leaving every Param bound in its annotations
+    # free. cost defaults to cost_with_bandwidth.cost.
+    from cost_with_bandwidth import annotation_values
+    if cost is None:
+        from cost_with_bandwidth import cost
+    params = []
+    for v in annotation_values(expr):
+        if isinstance(v, Param) and v.name not in params:
+            params.append(v.name)
+    return compile_call(cost, expr, params=params)
+
+def compile_call(fn, *args, **kwargs):
+    # Compiles fn(*args), which may compute a cost from several expressions,
+    # leaving every Param it is given (in annotations, or as fields of a
+    # MachineProfile) free. The keyword argument params lists parameter names
+    # the program must accept even if the cost doesn't depend on them.
+    _state.symbols = {}
+    try:
+        result = fn(*args)
+    finally:
+        _state.symbols = None
+    return lower(result, kwargs.get("params", ()))
@@ -45,7 +45,11 @@ def cost(expr, block_sizes, latencies):
     # N times, where N is the number of iterations in the loop. This ignores
     # costs related to the memory heirarchy and assumes all values are loaded
     # into registers.
-    p_cost = expr.cost({})
+    ctx = {}
+    p_cost = expr.cost(ctx)
+
+    # Whether each Lookup is sequential, by node.
+    sequential = {}
 
     def _get_lookups(expr, lookups=set(), loopIndices=[]):
         # Find Lookup (i.e. memory access) nodes in the expression tree.
@@ -54,10 +58,10 @@ def cost(expr, block_sizes, latencies):
             if isinstance(c, For):
                 loopIndices.append(c.loopIdx)
             # Here, we'll annotate the Lookup nodes with a bunch of excess data
-            # (e.g., is it sequential, etc.). This is hacky since we're adding
-            # new fields to the object.
+            # (e.g., is it sequential, etc.). Nodes have no room for new
+            # fields, so this is kept on the side.
             if isinstance(c, Lookup):
-                c.sequential = is_sequential(c, loopIndices)
+                sequential[c] = is_sequential(c, loopIndices)
                 lookups.add(c)
             _get_lookups(c, lookups, loopIndices)
         return lookups
@@ -70,6 +74,9 @@ def cost(expr, block_sizes, latencies):
     l3_seq_costs = []
 
     for l in lookups:
+        # The probability that the lookup is executed.
+        p_execute = annotation(ctx, l, "p_execute")
+
         # Compute the cost of L1 access time. All elements do this access.
         # Assume an element on a line is loaded "at once."
         #l1_cost = expr.iters * expr.stride * 4 * latencies[0]
@@ -80,9 +87,9 @@ def cost(expr, block_sizes, latencies):
         # accessing a cache line, and then weights the number of accessed
         # blocks (i.e., the total data size divded by the block size) by this
         # probability and the L2 access latency.
-        l1_cost = sequential_cost(l.p_execute, 4 * expr.stride,
+        l1_cost = sequential_cost(p_execute, 4 * expr.stride,
             expr.iters / expr.stride, block_sizes[0], latencies[1])
-        l1_cost += random_cost(l.p_execute, 4 * expr.stride,
+        l1_cost += random_cost(p_execute, 4 * expr.stride,
                 expr.iters / expr.stride, block_sizes[0], latencies[1])
 
         # Compute the cost of missing in L2 (same as description in L1).
@@ -90,22 +97,22 @@ def cost(expr, block_sizes, latencies):
         # as well/L2 data accesses are always prefetched from L3 and the
         # prefetch time is less than the processing + L1 access time). This
         # needs some refinement.
-        l2_cost = sequential_cost(l.p_execute, 4 * expr.stride,
+        l2_cost = sequential_cost(p_execute, 4 * expr.stride,
             expr.iters / expr.stride, block_sizes[1], latencies[2])
-        l2_cost += random_cost(l.p_execute, 4 * expr.stride,
+        l2_cost += random_cost(p_execute, 4 * expr.stride,
                 expr.iters / expr.stride, block_sizes[1], latencies[2])
 
         # Compute the cost of missing in L3. An L3 miss which is sequential
         # is overlapped with the L1/processing cost. A random miss goes to
         # memory.
-        l3_seq_cost = sequential_cost(l.p_execute, 4 * expr.stride,\
+        l3_seq_cost = sequential_cost(p_execute, 4 * expr.stride,\
                 expr.iters / expr.stride, block_sizes[2], latencies[3])
-        l3_rnd_cost = random_cost(l.p_execute, 4 * expr.stride,\
+        l3_rnd_cost = random_cost(p_execute, 4 * expr.stride,\
                 expr.iters / expr.stride, block_sizes[2], latencies[3])
 
         # Register loading cost (i.e. L1 access cost for each data element).
         # TODO probably an overestimate.
-        reg_cost = (expr.iters * 4 * expr.stride / 8) * l.p_execute
+        reg_cost = (expr.iters * 4 * expr.stride / 8) * p_execute
 
         lookup_costs.append(l1_cost + l3_rnd_cost + reg_cost)
         l3_seq_costs.append(l3_seq_cost)
@@ -26,16 +26,41 @@ Memory cost captures the cost of loading values from the memory heirarchy. This
 is an attempt at simplifying the model used before, making sure to take into
 account the bandwidth of the memory sub-system.
 
-TODO : Multi-core.
+Multi-core: by default, a loop is costed as if it ran on one core while every
+other core ran a copy of it (hence the shared L3 in the random access cost and
+the contention between CORES threads in VecMergerMerge). Drivers divide the
+iteration counts by the number of cores themselves. Given a thread count T, the
+outermost loop is instead split between T threads and the cost is the wall
+clock time of the parallel loop: each thread gets 1/T of the L3 and of
+MEM_THROUGHPUT (but no more memory throughput than a single core can use), and
+more threads than cores run in turns.
+
+NUMA: on machines with several sockets, threads are spread evenly across the
+sockets and share the L3 of their own socket. Depending on its placement (see
+expressions.Vector) and access pattern, a fraction of the memory accesses to a
+vector go to other sockets, at REMOTE_MEM_LATENCY and through the interconnect.
 """
 
 from expressions import *
 from extended_cost_model import *
+from arith import np, all_true, clip, is_array, logical_and, logical_or, minimum, to_float, where
+from machine import DEFAULT, MachineProfile
 
-import params
-
-def cost(expr):
-    # Return the cost of an expression.
+def cost(expr, profile=None, threads=None, details=None, reuse=None, terms=None):
+    # Return the cost of an expression on the machine described by profile
+    # (a machine.MachineProfile, by default the one in params.py), run by
+    # threads threads if given (see above).
+    #
+    # If details is a list, a dict describing the memory cost of each Lookup
+    # is appended to it (see _lookup_details).
+    #
+    # reuse optionally maps lookups to reuse_distance.ReuseHistograms (see
+    # cachesim.reuse_histograms). The memory cost of those lookups weights
+    # every level of the hierarchy by the fraction of their reuse distances
+    # that fit in it, instead of using a single reuse distance.
+    #
+    # If terms is a dict, the processing cost is broken down in it by node
+    # and term (see expressions.account). explain() puts these together.
 
     # Only consider costs of loops.
     if not isinstance(expr, For):
@@ -45,71 +70,367 @@ def cost(expr):
     # N times, where N is the number of iterations in the loop. This ignores
     # costs related to the memory heirarchy and assumes all values are loaded
     # into registers.
-    p_cost = expr.cost({})
+    # The annotations recorded while costing are kept per evaluation (see
+    # expressions.annotate), so costing doesn't modify the tree.
+    if profile is None:
+        profile = DEFAULT
+    annotations = {}
+    ctx = {"annotations": annotations, "profile": profile, "threads": threads}
+    if terms is not None:
+        ctx["explain"] = terms
+    p_cost = expr.cost(ctx)
 
     # CPU clock frequency.
-    clock_frequency = params.CLOCK_FREQUENCY
+    clock_frequency = profile.CLOCK_FREQUENCY
 
     # Memory throughput at different levels of the heirarchy (index 0 is L1 cache, etc.).
-    memory_throughput = [params.L1_THROUGHPUT, params.L2_THROUGHPUT, params.L3_THROUGHPUT, params.MEM_THROUGHPUT]
+    memory_throughput = profile.memory_throughput
     # Cache sizes in terms of blocks (cache size at level i in bytes = cache_size[i] * block_size).
-    cache_sizes = [params.L1_SIZE, params.L2_SIZE, params.L3_SIZE]
+    cache_sizes = profile.cache_sizes
 
     # Cache block (line) size at different levels of the memory heirarchy.
-    block_size = params.CACHE_LINE_SIZE
+    block_size = profile.CACHE_LINE_SIZE
     # Memory access latencies at different levels of the memory heirarchy.
-    latencies = [params.L1_LATENCY, params.L2_LATENCY, params.L3_LATENCY, params.MEM_LATENCY]
+    latencies = profile.latencies
+
+    # Threads are spread evenly across the sockets, and share the L3 of their
+    # socket.
+    if threads is None:
+        threads_per_socket = to_float(profile.CORES) / profile.SOCKETS
+    else:
+        threads_per_socket = where(threads > profile.SOCKETS, to_float(threads) / profile.SOCKETS, 1.0)
+        # The L3 cache and memory bandwidth are shared between the threads.
+        cache_sizes = cache_sizes[:-1] + [cache_sizes[-1] / threads_per_socket]
+        memory_throughput = memory_throughput[:-1] + [
+            minimum(profile.MEM_THROUGHPUT / to_float(threads), profile.MEM_THROUGHPUT_PER_CORE)]
+        # Accesses to other sockets share the interconnect.
+        remote_throughput = minimum(profile.INTERCONNECT_THROUGHPUT / to_float(threads), memory_throughput[-1])
 
-    def _get_lookups(expr, lookups=set()):
-        # Find Lookup (i.e. memory access) nodes in the expression tree.
+    def _get_lookups(expr, lookups=[], seen=set()):
+        # Find Lookup (i.e. memory access) nodes in the expression tree. They
+        # are kept in the order they are first reached, so the memory costs are
+        # summed in the same order whatever the annotation values are.
         for c in expr.children():
-            if isinstance(c, Lookup):
-                lookups.add(c)
-            _get_lookups(c, lookups)
+            if isinstance(c, Lookup) and c not in seen:
+                seen.add(c)
+                lookups.append(c)
+            _get_lookups(c, lookups, seen)
         return lookups
 
     # The list of lookups.
-    lookups = list(_get_lookups(expr))
+    lookups = _get_lookups(expr)
     m_cost = 0
 
+    # The prefetcher follows the first PREFETCH_STREAMS streams.
+    prefetching = not all_true(profile.PREFETCH_STREAMS == 0)
+    streams = [l for l in lookups if annotations[l.id]["access"] in ("sequential", "strided")]
+
+    # Misses of latency-bound lookups overlap, up to LINE_FILL_BUFFERS at a
+    # time. A chain of dependent lookups only has one miss in flight per
+    # iteration, so the lookups of a chain of length k overlap k times less.
+    latency_bound = set(l for l in lookups
+                        if (prefetching and annotations[l.id]["access"] in ("indirect", "random")) or
+                           (not annotations[l.id]["sequential"] and not (prefetching and l in streams)))
+    chains = dependent_chains(lookup_dependences(expr), latency_bound)
+
     for l in lookups:
-        num_lookups = (l.loops * l.p_execute)
-        l_reuse_distance = reuse_distance(l, lookups, l.loops_seq, block_size)
-
-        if l.sequential:
-            # Sequential access - use bandwidth.
-            cache_level = len(cache_sizes)
-            for i in xrange(len(cache_sizes)):
-                if cache_sizes[i] > l_reuse_distance:
-                    cache_level = i
-                    break
-            mem_lookups = (num_lookups * l.elemSize)
-            m_cost += (((mem_lookups) / memory_throughput[cache_level]) * clock_frequency)
+        a = annotations[l.id]
+        # Vectorized lookups access every lane.
+        num_lookups = (a["loops"] * a["p_execute"]) * a["lanes"]
+        l_reuse_distance = reuse_distance(l, lookups, a["loops_seq"], block_size)
+        # The fraction of memory accesses that stay on the socket.
+        local = profile.local_fraction(l.vector.placement, a["sequential"], a["private"])
+        overlap = where(profile.LINE_FILL_BUFFERS > chains.get(l, 1),
+                        to_float(profile.LINE_FILL_BUFFERS) / chains.get(l, 1), 1.0)
+
+        if reuse is not None and l in reuse:
+            levels = reuse[l].level_fractions(cache_sizes)
+            if a["sequential"]:
+                # Each level supplies its share of the bytes at its throughput.
+                seconds = 0.0
+                for f, throughput in zip(levels, memory_throughput):
+                    seconds = seconds + f / throughput
+                l_cost = num_lookups * l.elemSize * seconds * clock_frequency
+                if details is not None:
+                    level_costs = [num_lookups * l.elemSize * (f / throughput) * clock_frequency
+                                   for f, throughput in zip(levels, memory_throughput)]
+            else:
+                mem_latency = local * latencies[-1] + (1.0 - local) * profile.REMOTE_MEM_LATENCY
+                rand_cost = 0.0
+                for f, latency in zip(levels, latencies[:-1] + [mem_latency]):
+                    rand_cost = rand_cost + f * latency
+                l_cost = num_lookups * rand_cost / overlap
+                if details is not None:
+                    level_costs = [num_lookups * f * latency / overlap
+                                   for f, latency in zip(levels, latencies[:-1] + [mem_latency])]
         else:
-            # Random access - use latency.
-            rand_cost = 0.0
-            vector_size = l.vector.length * l.elemSize
-            prev_p = 0.0
-            for i in xrange(len(cache_sizes)):
-                # Number of blocks in the vector.
-                blocks = vector_size / block_size
-                if i == len(cache_sizes) - 1:
-                    blocks *= params.CORES
-                p = cache_sizes[i] / blocks
-                p = min(1.0, max(p, 0.0))
-                old_p = p
-                p -= prev_p
-                prev_p += p
-                rand_cost += p * latencies[i]
-                if old_p == 1.0:
-                    break
-
-            # Factor in the DRAM access latency for "unaccounted" probabilities.
-            if prev_p != 1.0:
+            # With the prefetcher model on, indirect and random lookups are
+            # latency bound whatever is_sequential says.
+            random_access = prefetching and a["access"] in ("indirect", "random")
+            if a["sequential"]:
+                # Sequential access - use bandwidth. The throughput is the one of
+                # the smallest cache level that holds the reuse distance.
+                throughput = memory_throughput[len(cache_sizes)]
+                for i in reversed(xrange(len(cache_sizes))):
+                    throughput = where(cache_sizes[i] > l_reuse_distance, memory_throughput[i], throughput)
+                if details is not None:
+                    level = len(cache_sizes)
+                    for i in reversed(xrange(len(cache_sizes))):
+                        level = where(cache_sizes[i] > l_reuse_distance, i, level)
+                    levels = [where(level == i, 1.0, 0.0) for i in xrange(len(cache_sizes) + 1)]
+                mem_lookups = (num_lookups * l.elemSize)
+                seq_cost = ((mem_lookups) / throughput) * clock_frequency
+                if threads is not None:
+                    # Each thread streams its share of the vector. If that doesn't
+                    # fit in its share of the L3, it comes from memory, whose
+                    # bandwidth is shared with the other threads.
+                    from_memory = l.vector.length * l.elemSize / to_float(threads) > cache_sizes[-1] * block_size
+                    stream_throughput = where(local == 1.0, memory_throughput[-1],
+                        1.0 / (local / memory_throughput[-1] + (1.0 - local) / remote_throughput))
+                    stream_cost = (mem_lookups / stream_throughput) * clock_frequency
+                    if details is not None:
+                        streamed = logical_and(from_memory, stream_cost > seq_cost)
+                        levels = [where(streamed, float(i == len(cache_sizes)), f) for i, f in enumerate(levels)]
+                    seq_cost = where(from_memory, where(stream_cost > seq_cost, stream_cost, seq_cost), seq_cost)
+                l_cost = seq_cost
+                if details is not None:
+                    seq_levels = levels
+                    level_costs = [f * seq_cost for f in levels]
+            if not a["sequential"] or random_access:
+                # Random access - use latency.
+                rand_cost = 0.0
+                vector_size = l.vector.length * l.elemSize
+                prev_p = 0.0
+                # Set once a cache level is large enough to hold the whole vector;
+                # larger levels add nothing after that.
+                done = False
+                levels = [0.0] * (len(cache_sizes) + 1)
+                for i in xrange(len(cache_sizes)):
+                    # Number of blocks in the vector.
+                    blocks = vector_size / block_size
+                    if i == len(cache_sizes) - 1 and threads is None:
+                        blocks = blocks * threads_per_socket
+                    p = cache_sizes[i] / blocks
+                    p = clip(p, 0.0, 1.0)
+                    old_p = p
+                    p = p - prev_p
+                    if details is not None:
+                        levels[i] = where(done, 0.0, p)
+                    prev_p = where(done, prev_p, prev_p + p)
+                    rand_cost = where(done, rand_cost, rand_cost + p * latencies[i])
+                    done = logical_or(done, old_p == 1.0)
+                    if all_true(done):
+                        break
+
+                # Factor in the DRAM access latency for "unaccounted" probabilities.
+                mem_latency = local * latencies[-1] + (1.0 - local) * profile.REMOTE_MEM_LATENCY
                 p = 1.0 - prev_p
-                rand_cost += p * latencies[-1]
-            m_cost += (num_lookups * rand_cost)
+                rand_cost = where(prev_p != 1.0, rand_cost + p * mem_latency, rand_cost)
+                if details is not None:
+                    levels[-1] = where(prev_p != 1.0, p, 0.0)
+                    rand_levels = [num_lookups * f * latency / overlap
+                                   for f, latency in zip(levels, latencies[:-1] + [mem_latency])]
+                rand_l_cost = num_lookups * rand_cost / overlap
+                if a["sequential"]:
+                    l_cost = where(profile.PREFETCH_STREAMS > 0, rand_l_cost, l_cost)
+                    if details is not None:
+                        levels = [where(profile.PREFETCH_STREAMS > 0, r, s) for r, s in zip(levels, seq_levels)]
+                        level_costs = [where(profile.PREFETCH_STREAMS > 0, r, s)
+                                       for r, s in zip(rand_levels, level_costs)]
+                else:
+                    l_cost = rand_l_cost
+                    if details is not None:
+                        level_costs = rand_levels
+
+        if prefetching and a["access"] in ("sequential", "strided"):
+            # A stream of lines from the level holding the reuse distance. If
+            # the prefetcher follows it, each line is requested
+            # PREFETCH_DISTANCE lines ahead, which hides that much of its
+            # latency. Streams beyond PREFETCH_STREAMS, and strides the
+            # prefetcher doesn't detect, wait for every line.
+            mem_latency = local * latencies[-1] + (1.0 - local) * profile.REMOTE_MEM_LATENCY
+            throughput = memory_throughput[len(cache_sizes)]
+            latency = mem_latency
+            level = len(cache_sizes)
+            for i in reversed(xrange(len(cache_sizes))):
+                throughput = where(cache_sizes[i] > l_reuse_distance, memory_throughput[i], throughput)
+                latency = where(cache_sizes[i] > l_reuse_distance, latencies[i], latency)
+                level = where(cache_sizes[i] > l_reuse_distance, i, level)
+            stride_bytes = a["stride"] * l.elemSize
+            line_bytes = minimum(where(stride_bytes > l.elemSize, stride_bytes, l.elemSize), block_size)
+            lines = num_lookups * line_bytes / block_size
+            # Cycles between two lines of the stream.
+            line_cycles = (p_cost / to_float(a["loops"])) * block_size / line_bytes
+            followed = logical_and(streams.index(l) < profile.PREFETCH_STREAMS,
+                                   stride_bytes <= profile.PREFETCH_MAX_STRIDE)
+            exposed = where(followed, clip(latency - profile.PREFETCH_DISTANCE * line_cycles, 0.0, latency), latency)
+            stream_cost = (num_lookups * line_bytes / throughput) * clock_frequency + lines * exposed
+            l_cost = where(profile.PREFETCH_STREAMS > 0, stream_cost, l_cost)
+            if details is not None:
+                level_costs = [where(profile.PREFETCH_STREAMS > 0, where(level == i, stream_cost, 0.0), c)
+                               for i, c in enumerate(level_costs)]
+
+        m_cost = m_cost + l_cost
+
+        if details is not None:
+            details.append(_lookup_details(l, a, num_lookups, l_reuse_distance, local, levels,
+                                           where(l in latency_bound, overlap, 1.0), l_cost, level_costs))
 
     # Add memory and processing cost here.
     # TODO what's the correct way to combine these?
-    return p_cost + m_cost
+    c = p_cost + m_cost
+    if threads is not None:
+        c = c * oversubscription(profile, threads)
+    return c
+
+def oversubscription(profile, threads):
+    # The factor by which a loop run by threads threads takes longer because
+    # threads beyond the number of cores have to wait for one.
+    if threads is None:
+        return 1.0
+    return where(threads > profile.CORES, to_float(threads) / profile.CORES, 1.0)
+
+def _lookup_details(lookup, annotations, accesses, reuse_distance, local, levels, overlap, cost,
+                    level_costs):
+    # The description of the memory cost of a lookup:
+    #   lookup: the Lookup node.
+    #   accesses: the expected number of times it is executed.
+    #   sequential, private, access, stride: see Lookup.cost.
+    #   reuse_distance: its reuse distance, in blocks.
+    #   local: the fraction of its memory accesses on the local socket.
+    #   levels: the fraction of its accesses served by each of the L1, L2 and
+    #     L3 caches and memory.
+    #   overlap: how many of its misses are in flight at once.
+    #   cost: its memory cost.
+    #   level_costs: the part of cost spent in each of the L1, L2 and L3
+    #     caches and memory.
+    return {
+        "lookup": lookup,
+        "accesses": accesses,
+        "sequential": annotations["sequential"],
+        "private": annotations["private"],
+        "access": annotations["access"],
+        "stride": annotations["stride"],
+        "reuse_distance": reuse_distance,
+        "local": local,
+        "levels": levels,
+        "overlap": overlap,
+        "cost": cost,
+        "level_costs": level_costs,
+    }
+
+def lookup_dependences(expr):
+    # Returns {lookup: set of the lookups its index depends on} for the
+    # lookups of expr, following values bound by Let. In Q3, for example,
+    # mktsegments[customer_idx] depends on customer_idxs[order_idx], which
+    # depends on order_idxs[i].
+    dependences = {}
+
+    def loads(node, env):
+        # Returns the lookups the value of node depends on, and records the
+        # dependences of the lookups in node.
+        if isinstance(node, Lookup):
+            deps = set()
+            for index in node.index:
+                deps |= loads(index, env)
+            dependences.setdefault(node, set()).update(deps)
+            return set([node])
+        if isinstance(node, Id):
+            return env.get(node, set())
+        if isinstance(node, Let):
+            value = loads(node.value, env)
+            inner = dict(env)
+            inner[node.name] = value
+            return loads(node.expr, inner)
+        deps = set()
+        for c in node.children():
+            deps |= loads(c, env)
+        if isinstance(node, (BinaryExpr, GetField)):
+            return deps
+        return set()
+
+    loads(expr, {})
+    return dependences
+
+def dependent_chains(dependences, latency_bound):
+    # Returns {lookup: length of the longest chain of dependent lookups in
+    # latency_bound through it} for the lookups in latency_bound.
+    def depth(l, edges, memo):
+        # The longest chain ending at l, following edges.
+        if l not in memo:
+            memo[l] = (l in latency_bound) + max([depth(p, edges, memo) for p in edges.get(l, ())] or [0])
+        return memo[l]
+
+    dependents = {}
+    for l, deps in dependences.iteritems():
+        for p in deps:
+            dependents.setdefault(p, set()).add(l)
+    up = {}
+    down = {}
+    return dict((l, depth(l, dependences, up) + depth(l, dependents, down) - 1)
+                for l in latency_bound)
+
+def best_threads(expr, profile=None, max_threads=None):
+    # Returns (threads, cost) for the number of threads, up to max_threads
+    # (by default the number of cores), that runs expr fastest. Ties go to
+    # fewer threads.
+    if profile is None:
+        profile = DEFAULT
+    if max_threads is None:
+        max_threads = profile.CORES
+    best = None
+    for t in xrange(1, max_threads + 1):
+        c = cost(expr, profile, t)
+        if best is None or c < best[1]:
+            best = (t, c)
+    return best
+
+def cost_batch(expr, profile=None, threads=None):
+    # Return the costs of an expression whose annotations are bound to arrays.
+    #
+    # Any of If.selectivity, For.iters and Vector.length may hold a NumPy
+    # array instead of a number; the arrays must broadcast against each other
+    # (e.g. build them with numpy.meshgrid). The tree is walked once and the
+    # result is an array with the broadcast shape, where each element equals
+    # what cost() returns for the tree with the corresponding scalars bound.
+    # The parameters of profile may be arrays as well (see
+    # MachineProfile.stack), which broadcast in the same way, and so may the
+    # number of threads.
+    arrays = _bound_arrays(expr)
+    if profile is not None:
+        arrays.extend(v for v in profile.values().itervalues() if is_array(v))
+    if is_array(threads):
+        arrays.append(threads)
+    shape = ()
+    for a in arrays:
+        shape = np.broadcast(np.empty(shape, dtype=bool), a).shape
+    return np.broadcast_to(np.asarray(cost(expr, profile, threads), dtype=float), shape).copy()
+
+def cost_profiles(expr, profiles):
+    # Return an array with the cost of an expression on each of profiles,
+    # computed in a single pass. The annotations of the expression must be
+    # scalars, or arrays whose last axis has one entry per profile.
+    return cost_batch(expr, MachineProfile.stack(profiles))
+
+def _bound_arrays(expr):
+    # Find the array-valued annotations in the expression tree.
+    return [v for v in annotation_values(expr) if is_array(v)]
+
+def annotation_values(expr):
+    # Yields the values of the If.selectivity, For.iters and Vector.length
+    # annotations in the expression tree, in pre-order.
+    for node, name in annotated_nodes(expr):
+        yield getattr(node, name)
+
+def annotated_nodes(expr):
+    # Yields (node, attribute name) for each If, For and Vector node in the
+    # expression tree, in pre-order. Shared nodes are yielded once per use.
+    if isinstance(expr, If):
+        yield expr, "selectivity"
+    elif isinstance(expr, For):
+        yield expr, "iters"
+    elif isinstance(expr, Vector):
+        yield expr, "length"
+    for c in expr.children():
+        for a in annotated_nodes(c):
+            yield a
@@ -0,0 +1,93 @@
+# Precomputed plan choices over a parameter grid.
+"""
+At query time a plan is picked from estimates of parameters such as b, p and n.
+A DecisionIndex costs every plan variant at every point of a grid ahead of time
+(with sweep.sweep) and keeps only the cheapest plan per point, one byte each.
+Picking a plan is then a binary search per axis, with no cost model evaluation:
+
+    index = DecisionIndex.build(q1_cost.costs, [("b", [10, 100, 1000]),
+                                                ("p", [0.01, 0.5, 1.0]),
+                                                ("n", [2.5e7])],
+                                log_axes=["b"])
+    index.choose(b=250, p=0.3, n=2.5e7)   # "Global" or "Local"
+
+A point is mapped to the nearest grid point on each axis, where "nearest" is
+measured on a log scale for axes in log_axes. The grid should therefore be fine
+enough near the decision boundaries (see gradients.crossover to locate them).
+"""
+
+import array
+import bisect
+import json
+import math
+
+from sweep import grid, sweep
+
+class DecisionIndex(object):
+    def __init__(self, axes, labels, choices, log_axes=()):
+        # axes: a list of (name, sorted values) pairs.
+        # labels: the plan labels.
+        # choices: the index into labels of the cheapest plan at each grid
+        #   point, in grid order (the last axis varies fastest).
+        self.axes = [(name, list(values)) for name, values in axes]
+        self.labels = list(labels)
+        self.choices = array.array("B", choices)
+        self.log_axes = list(log_axes)
+
+        # The values at which each axis switches from one grid point to the
+        # next.
+        self._cuts = []
+        for name, values in self.axes:
+            if name in self.log_axes:
+                cuts = [math.sqrt(lo * hi) for lo, hi in zip(values, values[1:])]
+            else:
+                cuts = [(lo + hi) / 2.0 for lo, hi in zip(values, values[1:])]
+            self._cuts.append(cuts)
+
+        # Offsets of a step along each axis in choices.
+        self._strides = []
+        stride = 1
+        for _, values in reversed(self.axes):
+            self._strides.insert(0, stride)
+            stride = stride * len(values)
+        assert len(self.choices) == stride
+
+    @classmethod
+    def build(cls, builder, axes, log_axes=(), processes=None):
+        # Costs builder (see sweep.sweep; it must return a list of (label,
+        # plan) pairs) over the grid given by axes and records the cheapest
+        # plan at each point. Ties go to the plan listed first.
+        axes = [(name, sorted(values)) for name, values in axes]
+        labels = []
+        choices = []
+        for _, costs in sweep(builder, grid(axes), processes):
+            best = min(xrange(len(costs)), key=lambda i: costs[i][1])
+            label = costs[best][0]
+            if label not in labels:
+                labels.append(label)
+            choices.append(labels.index(label))
+        return cls(axes, labels, choices, log_axes)
+
+    def choose(self, **point):
+        # Returns the label of the cheapest plan at point, which must give a
+        # value for every axis.
+        offset = 0
+        for (name, _), cuts, stride in zip(self.axes, self._cuts, self._strides):
+            offset = offset + bisect.bisect_left(cuts, point[name]) * stride
+        return self.labels[self.choices[offset]]
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"axes": self.axes,
+                       "labels": self.labels,
+                       "choices": self.choices.tolist(),
+                       "log_axes": self.log_axes}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            d = json.load(f)
+        return cls(d["axes"], d["labels"], d["choices"], d["log_axes"])
+
+    def __len__(self):
+        return len(self.choices)
@@ -0,0 +1,115 @@
+# Breaks the cost of a plan down by node and by term.
+"""
+cost_with_bandwidth.cost returns a single number. explain() returns where it
+comes from, to find out why a plan costs what it does (or why the optimizer
+picked a plan that turned out slow):
+
+    e = explain(For(n, Id("i"), 1, Lookup(Vector("R", k), Lookup("A", Id("i")))))
+    print e
+
+The processing cost is attributed to the nodes that incur it, split into the
+terms in expressions.TERMS: instructions ("processing"), branch mispredictions
+("branch_penalty") and atomic updates and their contention ("atomic"). The
+memory cost is attributed to each Lookup, split by the level of the memory
+hierarchy (L1, L2, L3 and memory) its accesses are served from, next to the
+lookup's access pattern, reuse distance and the fraction of its accesses each
+level serves. All costs are totals over the whole loop, as in cost(), so the
+terms of every node and lookup add up to the cost of the plan.
+
+The costs may be arrays if the plan's annotations or profile are (see
+cost_with_bandwidth.cost_batch); printing an Explanation needs scalars.
+"""
+
+from arith import all_true
+from cachesim import LEVELS
+from cost_with_bandwidth import cost, oversubscription
+from expressions import TERMS, For
+from machine import DEFAULT
+
+class Explanation(object):
+    # The result of explain().
+    #   cost: the cost of the plan.
+    #   nodes: [(node, {term: cost})] for the nodes with a processing cost, in
+    #     pre-order, leaving out those whose terms are all 0. The terms are
+    #     those in expressions.TERMS.
+    #   lookups: the memory cost details of each lookup (see
+    #     cost_with_bandwidth._lookup_details), in the order they are first
+    #     reached.
+    def __init__(self, cost, nodes, lookups):
+        self.cost = cost
+        self.nodes = nodes
+        self.lookups = lookups
+
+    def terms(self, node):
+        # Returns {term: cost} for node, with every term in TERMS.
+        for n, terms in self.nodes:
+            if n is node:
+                return dict((t, terms.get(t, 0.0)) for t in TERMS)
+        return dict((t, 0.0) for t in TERMS)
+
+    def totals(self):
+        # Returns {term: cost} over the whole plan, for the terms in TERMS,
+        # "memory" and each of LEVELS.
+        totals = dict((t, 0.0) for t in TERMS + ("memory",) + LEVELS)
+        for _, terms in self.nodes:
+            for t, c in terms.iteritems():
+                totals[t] = totals[t] + c
+        for d in self.lookups:
+            totals["memory"] = totals["memory"] + d["cost"]
+            for level, c in zip(LEVELS, d["level_costs"]):
+                totals[level] = totals[level] + c
+        return totals
+
+    def __str__(self):
+        totals = self.totals()
+        lines = ["cost {0:.4g}: {1}, memory {2:.4g} ({3})".format(
+            float(self.cost),
+            ", ".join("{0} {1:.4g}".format(t, float(totals[t])) for t in TERMS),
+            float(totals["memory"]),
+            ", ".join("{0} {1:.4g}".format(level, float(totals[level])) for level in LEVELS))]
+        lines.append("{0:<40} {1}".format("node", "".join("{0:>16}".format(t) for t in TERMS)))
+        for node, terms in self.nodes:
+            lines.append("{0:<40} {1}".format(str(node)[:40], "".join(
+                "{0:>16.4g}".format(float(terms.get(t, 0.0))) for t in TERMS)))
+        lines.append("{0:<40} {1:>10} {2:>10} {3:>10} {4}{5:>12}".format(
+            "lookup", "access", "reuse", "accesses", "".join("{0:>10}".format(level) for level in LEVELS),
+            "memory"))
+        for d in self.lookups:
+            lines.append("{0:<40} {1:>10} {2:>10.4g} {3:>10.4g} {4}{5:>12.4g}".format(
+                str(d["lookup"])[:40], d["access"], float(d["reuse_distance"]), float(d["accesses"]),
+                "".join("{0:>10.4g}".format(float(c)) for c in d["level_costs"]), float(d["cost"])))
+            lines.append("{0:<40} {1:>10} {2:>10} {3:>10} {4}".format(
+                "", "", "", "fraction", "".join("{0:>10.3f}".format(float(f)) for f in d["levels"])))
+        return "\n".join(lines)
+
+def _preorder(expr, seen=None):
+    # Yields the nodes of expr in pre-order, each once.
+    if seen is None:
+        seen = set()
+    if id(expr) in seen:
+        return
+    seen.add(id(expr))
+    yield expr
+    for c in expr.children():
+        for node in _preorder(c, seen):
+            yield node
+
+def explain(expr, profile=None, threads=None, reuse=None):
+    # Returns an Explanation of cost(expr, profile, threads, reuse=reuse).
+    if profile is None:
+        profile = DEFAULT
+    terms = {}
+    details = []
+    c = cost(expr, profile, threads, details, reuse, terms)
+    if not isinstance(expr, For):
+        return Explanation(c, [], [])
+    # Threads beyond the number of cores slow down every term alike.
+    scale = oversubscription(profile, threads)
+    nodes = []
+    for node in _preorder(expr):
+        if node.id in terms and not all(all_true(v == 0) for v in terms[node.id][1].itervalues()):
+            nodes.append((node, dict((t, v * scale) for t, v in terms[node.id][1].iteritems())))
+    for d in details:
+        d["cost"] = d["cost"] * scale
+        d["level_costs"] = [v * scale for v in d["level_costs"]]
+    return Explanation(c, nodes, details)
@@ -1,22 +1,82 @@
 # Implements dummy expression objects to test cost model logic on.
 
 import math
+import threading
+import weakref
 
 from reuse_distance import *
+from arith import all_true, logical_and, maximum, minimum, to_float, where
+from machine import lanes_of, profile_of, threads_of
 import sys
 
-import params
-
-class Expr:
+class Expr(object):
     # Root expression class
+    #
+    # Nodes use __slots__ to keep them small. Equality and hashing are
+    # structural: two nodes are equal if they are of the same class and their
+    # _fields are equal. Hashes are computed once and cached, so nodes should
+    # not be modified once they have been hashed (e.g. put in a set) or
+    # interned with hashcons().
+    #
+    # Costing a node never modifies it: annotations computed while costing are
+    # kept in the evaluation context (see annotate()), so one tree, or trees
+    # sharing subtrees, can be costed from several threads at once.
+    __slots__ = ("_id", "_hash", "_interned", "__weakref__")
+
+    # Names of the slots which define the structure of a node.
+    _fields = ()
+
     newId = 0
+    _idLock = threading.Lock()
     @property
     def id(self):
-        if self._id == None:
-            self._id = Expr.newId
-            Expr.newId += 1
+        if getattr(self, "_id", None) is None:
+            with Expr._idLock:
+                if getattr(self, "_id", None) is None:
+                    self._id = Expr.newId
+                    Expr.newId += 1
         return self._id
 
+    def __getstate__(self):
+        # Ids, cached hashes and interning are only meaningful within one
+        # process, so they aren't pickled.
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if not name.startswith("_") and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    @classmethod
+    def make(cls, *args, **kwargs):
+        # Constructs a node and interns it (see hashcons). Building a tree
+        # bottom-up with make() allocates each distinct subtree only once.
+        return hashcons(cls(*args, **kwargs))
+
+    def _key(self):
+        return (type(self).__name__,) + tuple(_field_key(getattr(self, f)) for f in self._fields)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return False
+        return hash(self) == hash(other) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(self._key())
+            return self._hash
+
     def cost(self, ctx):
         raise NotImplementedError
 
@@ -29,17 +89,104 @@ class Expr:
         """
         return 1.0
 
+class _Identity(object):
+    # Wraps an unhashable field value (e.g. a NumPy array or a compiler.Param)
+    # so that it compares and hashes by identity.
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, _Identity) and self.value is other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(self.value)
+
+def _field_key(value):
+    # The part of a node's key contributed by a field.
+    if isinstance(value, Expr):
+        return value
+    if isinstance(value, list):
+        return tuple(_field_key(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return _Identity(value)
+    # The type is part of the key since e.g. 1 and 1.0 divide differently.
+    return (type(value).__name__, value)
+
+# Interned nodes, keyed by Expr._key().
+_hashcons_table = weakref.WeakValueDictionary()
+_hashcons_lock = threading.RLock()
+
+def hashcons(expr):
+    # Returns the interned node structurally equal to expr, so that equal
+    # subtrees are represented by a single shared node. The children of expr
+    # are replaced by their interned versions in place.
+    if getattr(expr, "_interned", False):
+        return expr
+    for f in expr._fields:
+        value = getattr(expr, f)
+        if isinstance(value, Expr):
+            setattr(expr, f, hashcons(value))
+        elif isinstance(value, list):
+            setattr(expr, f, [hashcons(v) if isinstance(v, Expr) else v for v in value])
+    key = expr._key()
+    with _hashcons_lock:
+        node = _hashcons_table.get(key)
+        if node is None:
+            expr._interned = True
+            _hashcons_table[key] = node = expr
+    return node
+
+def annotate(ctx, node, **annotations):
+    # Records annotations for a node in the evaluation context ctx. The
+    # annotations are kept in ctx["annotations"], keyed by node id. If a node
+    # is reached more than once (e.g. a shared subtree), the annotations from
+    # the first time it was reached are kept.
+    if "annotations" not in ctx:
+        ctx["annotations"] = {}
+    ctx["annotations"].setdefault(node.id, annotations)
+
+def annotation(ctx, node, name):
+    # Returns an annotation recorded for node by annotate().
+    return ctx["annotations"][node.id][name]
+
+# The terms the processing cost of a node is broken down into by account():
+#   processing: instructions, including the fixed cost of branches and masks,
+#     gathers and scatters, and the port model's cost of a loop body.
+#   branch_penalty: expected branch mispredictions.
+#   atomic: atomic updates of a global VecMerger and their contention, and
+#     lanes of a scatter merged again after a conflict.
+TERMS = ("processing", "branch_penalty", "atomic")
+
+def account(ctx, node, term, cost):
+    # Records cost, incurred each time node is evaluated, under term for node
+    # if ctx breaks the cost down (see cost_with_bandwidth.explain). The
+    # breakdown is kept in ctx["explain"] as {node id: (node, {term: cost})},
+    # with costs weighted by how many times the node runs (ctx["weight"]).
+    explained = ctx.get("explain")
+    if explained is None:
+        return
+    if node.id not in explained:
+        explained[node.id] = (node, {})
+    terms = explained[node.id][1]
+    terms[term] = terms.get(term, 0.0) + cost * ctx.get("weight", 1.0)
+
 # Literals have no cost.
 class Literal(Expr):
+    __slots__ = ("value",)
+    _fields = ("value",)
+
     def __init__(self, value=None):
         self.value = value
 
     def cost(self, ctx):
-        if "selectivity" in ctx:
-            self.p_execute = ctx["selectivity"]
-        else:
-            self.p_execute = 1.0
-
+        annotate(ctx, self, p_execute=ctx.get("selectivity", 1.0))
         return 0.
 
     def __str__(self):
@@ -47,6 +194,9 @@ class Literal(Expr):
 
 # Ids have no cost.
 class Id(Expr):
+    __slots__ = ("name",)
+    _fields = ("name",)
+
     def __init__(self, name):
         self.name = name
 
@@ -56,15 +206,10 @@ class Id(Expr):
     def __str__(self):
         return self.name
 
-    def __eq__(self, other):
-        if not isinstance(other, Id):
-            return False
-        return self.name == other.name
-
-    def __hash__(self):
-        return hash(self.name)
-
 class FixedCostExpr(Expr):
+    __slots__ = ("fixedCost",)
+    _fields = ("fixedCost",)
+
     def __init__(self, fixedCost):
         self.fixedCost = fixedCost
 
@@ -72,9 +217,13 @@ class FixedCostExpr(Expr):
         return "fixed({0})".format(self.fixedCost)
 
     def cost(self, ctx):
+        account(ctx, self, "processing", self.fixedCost)
         return self.fixedCost
 
 class VecMergerResult(Expr):
+    __slots__ = ("globalTable", "vecMergerSize", "mergeCost")
+    _fields = ("globalTable", "vecMergerSize", "mergeCost")
+
     def __init__(self, globalTable, vecMergerSize, mergeCost):
         # Flag which specifies whether the table is global or local.
         self.globalTable = globalTable
@@ -89,13 +238,18 @@ class VecMergerResult(Expr):
     def cost(self, ctx):
         # Arbitrary fixed cost for cleanup.
         if self.globalTable:
-            return 10000
+            c = 10000
         else:
             # We run the run procedure on each partial table.
-            return self.vecMergerSize * self.mergeCost * params.CORES
+            c = self.vecMergerSize * self.mergeCost * threads_of(ctx)
+        account(ctx, self, "processing", c)
+        return c
 
 class VecMergerMerge(Expr):
     # Represents a merge into a VecMerger.
+    __slots__ = ("lookup", "mergeExpr", "elemSize", "globalTable")
+    _fields = ("lookup", "mergeExpr", "elemSize", "globalTable")
+
     def __init__(self, builder, index, mergeExpr, elemSize, globalTable):
         # The index accessed for the vecmerger.
         # Resolves to a lookup in the VecMerger's internal buffer.
@@ -120,17 +274,42 @@ class VecMergerMerge(Expr):
     def cost(self, ctx):
         # The cost of merging a value is (naively) the cost of looking up an
         # element in the buffer, and the cost of merging the expression in.
+        # A local table is private to the thread updating it.
+        old_private = ctx.get("private", False)
+        ctx["private"] = not self.globalTable
         l = self.lookup.cost(ctx)
+        ctx["private"] = old_private
+        old_atomic = ctx.get("atomic", False)
+        ctx["atomic"] = self.globalTable
         m = self.mergeExpr.cost(ctx)
+        ctx["atomic"] = old_atomic
         if self.globalTable:
+            machine = profile_of(ctx)
             elems = self.lookup.vector.length
             # Probability of contention = access prob. 
-            p_contend = 1.0 - pow((1.0 - (1.0 / elems)), params.CORES)
+            p_contend = 1.0 - pow((1.0 - (1.0 / elems)), threads_of(ctx))
+            # Contention with a thread on another socket moves the cache line
+            # between sockets, which costs more.
+            sockets = machine.SOCKETS
+            penalty = (machine.ATOMICADD_PENALTY / sockets +
+                       machine.REMOTE_ATOMICADD_PENALTY * (sockets - 1) / sockets)
             # We give some (high) fixed cost for an atomic instruction,
             # and a large penalty in case there's contention. Contention probability
             # is the probability that two cores update the same element at once.
-            m *= (params.ATOMICADD_LATENCY + (params.ATOMICADD_PENALTY * p_contend))
-        return l + m
+            atomic = m * (machine.ATOMICADD_LATENCY + (penalty * p_contend))
+            account(ctx, self, "atomic", atomic - m)
+            m = atomic
+        # In a vectorized loop, the update is a scatter. Lanes that update the
+        # same element as another lane are merged again, one at a time.
+        lanes = lanes_of(ctx)
+        elems = self.lookup.vector.length
+        elems = where(elems > 1, elems, 1.0)
+        p_conflict = 1.0 - pow(1.0 - 1.0 / elems, lanes - 1)
+        scatter = lanes * (profile_of(ctx).SCATTER_LANE_LATENCY + p_conflict * m)
+        if "explain" in ctx:
+            account(ctx, self, "processing", where(lanes > 1, lanes * profile_of(ctx).SCATTER_LANE_LATENCY, 0.0))
+            account(ctx, self, "atomic", where(lanes > 1, lanes * p_conflict * m, 0.0))
+        return l + m + where(lanes > 1, scatter, 0.0)
 
     def __str__(self):
         return "merge({0}, {1}, {2})".format(self.lookup, self.mergeExpr, self.elemSize)
@@ -138,6 +317,9 @@ class VecMergerMerge(Expr):
 
 class Let(Expr):
     # A let statement like in ML that saves an expression name for a value.
+    __slots__ = ("name", "value", "expr")
+    _fields = ("name", "value", "expr")
+
     def __init__(self, name, value, expr):
         if isinstance(name, str):
             self.name = Id(name)
@@ -168,6 +350,9 @@ class StructLiteral(Expr):
     # expressions. This expression should almost always be paired with
     # a Let statement, since it's values are only initialized once in real
     # generated code.
+    __slots__ = ("exprs",)
+    _fields = ("exprs",)
+
     def __init__(self, exprs):
         # A name for the struct literal, so it can be referenced by other nodes.
         self.exprs = exprs
@@ -184,6 +369,9 @@ class StructLiteral(Expr):
         return "{" + s + "}"
 
 class GetField(Expr):
+    __slots__ = ("struct", "index", "size")
+    _fields = ("struct", "index", "size")
+
     def __init__(self, struct, index, size=4.0):
         # The struct to get the field from.
         self.struct = struct
@@ -205,6 +393,16 @@ class GetField(Expr):
         return "{0}.{1}".format(self.struct, self.index)
 
 class BinaryExpr(Expr):
+    __slots__ = ("left", "right", "vecSize")
+    _fields = ("left", "right", "vecSize")
+
+    # The profile parameters holding the scalar and vectorized latency of
+    # the op.
+    latencies = ("BINOP_LATENCY", "BINOP_VEC_LATENCY")
+    # The ports the op issues to in the port model (see params.PORT_MODEL);
+    # vectorized ops other than divisions issue to the VEC ports.
+    port = "ALU"
+
     def __init__(self, left, right, vecSize=1):
         self.left = left
         self.right = right
@@ -218,53 +416,86 @@ class BinaryExpr(Expr):
         Cost components:
         - LHS expression cost.
         - RHS expression cost.
-        - 1 (to perform the comparison)
+        - 1 (to perform the comparison), or nothing in the port model, where
+          the enclosing loop accounts for the op (see port_cost).
         """
-        if "selectivity" in ctx:
-            self.p_execute = ctx["selectivity"]
-        else:
-            self.p_execute = 1.0
+        annotate(ctx, self, p_execute=ctx.get("selectivity", 1.0))
 
         lhsCost = self.left.cost(ctx)
         rhsCost = self.right.cost(ctx)
 
-        if self.vecSize > 1:
-            fixedCost = params.BINOP_VEC_LATENCY
-        else:
-            fixedCost = params.BINOP_LATENCY
-        
+        machine = profile_of(ctx)
+        latency, instructions = self.instructions(machine)
+        fixedCost = latency * instructions
+        if ctx.get("atomic"):
+            # Ops merged into a global VecMerger are part of an atomic update,
+            # which VecMergerMerge costs from their summed latencies.
+            account(ctx, self, "processing", fixedCost)
+            return lhsCost + rhsCost + fixedCost
+        issue(ctx, self.port if self.vecSize == 1 or self.port == "DIV" else "VEC", instructions)
+        fixedCost = where(machine.PORT_MODEL, 0.0, fixedCost)
+        account(ctx, self, "processing", fixedCost)
         return lhsCost + rhsCost + fixedCost
 
+    def instructions(self, machine):
+        # Returns the latency of the op and the number of instructions it
+        # takes.
+        if self.vecSize > 1:
+            # An op over more lanes than fit in a vector register takes several
+            # instructions. Operands are assumed to be 4 bytes wide.
+            width = where(machine.SIMD_WIDTH > 0, machine.SIMD_WIDTH, 1)
+            instructions = self.vecSize * 4.0 / width
+            return (getattr(machine, self.latencies[1]),
+                    where(logical_and(machine.SIMD_WIDTH > 0, instructions > 1), instructions, 1))
+        return getattr(machine, self.latencies[0]), 1
+
 # Basic Binary expressions, whose cost is computed as being
 # the costs of the LHS and RHS expressions + 1 for the
 # actual instruction.
 class GreaterThan(BinaryExpr):
+    __slots__ = ()
     def __str__(self):
         return str(self.left) + ">" + str(self.right)
 class LogicalAnd(BinaryExpr):
+    __slots__ = ()
     def __str__(self):
         return str(self.left) + "&&" + str(self.right)
 class BitwiseAnd(BinaryExpr):
+    __slots__ = ()
     def __str__(self):
         return str(self.left) + "&" + str(self.right)
 class Add(BinaryExpr):
+    __slots__ = ()
     def __str__(self):
         return str(self.left) + "+" + str(self.right)
 class Subtract(BinaryExpr):
+    __slots__ = ()
     def __str__(self):
         return str(self.left) + "-" + str(self.right)
 class Multiply(BinaryExpr):
+    __slots__ = ()
+    latencies = ("MUL_LATENCY", "MUL_VEC_LATENCY")
+    port = "MUL"
     def __str__(self):
         return str(self.left) + "*" + str(self.right)
 class Divide(BinaryExpr):
+    __slots__ = ()
+    latencies = ("DIV_LATENCY", "DIV_VEC_LATENCY")
+    port = "DIV"
     def __str__(self):
         return str(self.left) + "/" + str(self.right)
 class Mod(BinaryExpr):
+    __slots__ = ()
+    latencies = ("DIV_LATENCY", "DIV_VEC_LATENCY")
+    port = "DIV"
     def __str__(self):
         return str(self.left) + "%" + str(self.right)
 
 class For(Expr):
     # A for loop.
+    __slots__ = ("iters", "stride", "loopIdx", "expr")
+    _fields = ("iters", "stride", "loopIdx", "expr")
+
     def __init__(self, iters, loopIdx, stride, expr):
         # The range of this loop. An 'iters' value of 1000 with a stride of 8
         # means the loop body will be executed 1000 / 8 = 125 times.
@@ -292,11 +523,28 @@ class For(Expr):
     def cost(self, ctx):
         if "loops" not in ctx:
             ctx["loops"] = []
+        if "nest" not in ctx:
+            ctx["nest"] = []
 
         # Keep a stack of loops so costs can be derived based on loop nesting.
-        iterations = float(self.iters) / self.stride
+        iterations = to_float(self.iters) / self.stride
+        if not ctx["loops"] and ctx.get("threads") is not None:
+            # The outermost loop is split evenly between the threads.
+            iterations = iterations / ctx["threads"]
         ctx["loops"].append((iterations, self.loopIdx))
+        ctx["nest"].append(self)
+        old_issued = ctx.get("issued")
+        ctx["issued"] = ({}, ctx.get("selectivity", 1.0))
+        old_weight = ctx.get("weight", 1.0)
+        if "explain" in ctx:
+            ctx["weight"] = old_weight * iterations
         exprCost = self.expr.cost(ctx)
+        ports = port_cost(ctx, self.expr)
+        account(ctx, self, "processing", ports)
+        exprCost = exprCost + ports
+        ctx["weight"] = old_weight
+        ctx["issued"] = old_issued
+        ctx["nest"].pop()
         ctx["loops"].pop()
         return exprCost * iterations
 
@@ -304,13 +552,17 @@ class For(Expr):
 class If(Expr):
     # A conditional branch.
     # Possible annotations:
-    def __init__(self, cond, true, false):
+    #   selectivity: the probability that the condition holds.
+    __slots__ = ("cond", "true", "false", "selectivity")
+    _fields = ("cond", "true", "false", "selectivity")
+
+    def __init__(self, cond, true, false, selectivity=1.0):
         self.cond = cond
         self.true = true
         self.false = false
 
         # Annotations are just fields in the object.
-        self.selectivity = 1.0
+        self.selectivity = selectivity
 
     def children(self):
         return [self.cond, self.true, self.false]
@@ -333,52 +585,102 @@ class If(Expr):
 
         # Get the smallest iteration distance. If it's sufficiently small, we
         # use it to amortize the branch prediction cost.
-        it_distance = min([sys.maxint] + [iteration_distance(id_node, ctx["loops"]) for id_node in ids])
+        it_distance = reduce(minimum, [iteration_distance(id_node, ctx["loops"]) for id_node in ids], sys.maxint)
 
         if "selectivity" in ctx:
             old_s = ctx["selectivity"]
-            ctx["selectivity"] *= self.selectivity
+            ctx["selectivity"] = ctx["selectivity"] * self.selectivity
         else:
             old_s = 1.0
             ctx["selectivity"] = self.selectivity
 
+        # The branches run every time in a vectorized loop (see below).
+        lanes = lanes_of(ctx)
+        weight = ctx.get("weight", 1.0)
+
         p_true = ctx["selectivity"]
+        if "explain" in ctx:
+            ctx["weight"] = weight * where(lanes > 1, 1.0, p_true)
         trueCost = self.true.cost(ctx)
 
         p_false = old_s * (1 - self.selectivity)
         ctx["selectivity"] = p_false
+        if "explain" in ctx:
+            ctx["weight"] = weight * where(lanes > 1, 1.0, p_false)
         falseCost = self.false.cost(ctx)
+        ctx["weight"] = weight
 
         # Restore the selectivity; this effectively "pops" downstream changes.
         ctx["selectivity"] = old_s
-        self.p_execute = ctx["selectivity"]
+        annotate(ctx, self, p_execute=ctx["selectivity"])
 
         # Picked this arbitrarily...
-        branch_penalty = params.BRANCH_MISPREDICT_PENALTY(self.selectivity)
-        if it_distance > params.BRANCHPRED_PREDICTABLE_IT_DIST:
-            branch_penalty = 0.0
-        c = params.BRANCH_LATENCY + condCost + p_true * trueCost + p_false * falseCost + branch_penalty
-        return c
+        machine = profile_of(ctx)
+        branch_penalty = machine.branch_mispredict_penalty(self.selectivity)
+        branch_penalty = where(it_distance > machine.BRANCHPRED_PREDICTABLE_IT_DIST, 0.0, branch_penalty)
+        if "explain" in ctx:
+            account(ctx, self, "processing", where(lanes > 1, machine.MASK_LATENCY, machine.BRANCH_LATENCY))
+            account(ctx, self, "branch_penalty", where(lanes > 1, 0.0, branch_penalty))
+        c = machine.BRANCH_LATENCY + condCost + p_true * trueCost + p_false * falseCost + branch_penalty
+        # In a vectorized loop, both branches are evaluated under masks and
+        # blended, whatever the selectivity.
+        masked = condCost + trueCost + falseCost + machine.MASK_LATENCY
+        return where(lanes > 1, masked, c)
 
     def __str__(self):
         return "if({0},{1},{2})".format(str(self.cond),
                 str(self.true),
                 str(self.false))
 
+# Where a vector's memory is placed on a machine with several sockets (NUMA
+# nodes):
+#   interleaved: pages are spread across the sockets.
+#   first-touch: pages are on the socket of the thread that first wrote them;
+#     for a vector initialized in parallel, each thread's part of a scan is
+#     local to it.
+#   replicated: each socket has its own copy.
+PLACEMENTS = ("interleaved", "first-touch", "replicated")
+
 class Vector(Expr):
-    def __init__(self, name, length):
+    __slots__ = ("name", "length", "placement")
+    _fields = ("name", "length", "placement")
+
+    def __init__(self, name, length, placement="first-touch"):
         self.name = name
         self.length = length
 
+        # Annotations are just fields in the object.
+        if placement not in PLACEMENTS:
+            raise ValueError("unknown placement {0!r}".format(placement))
+        self.placement = placement
+
     def cost(self, ctx):
         # TODO
         return 0
 
+    # Vectors are compared by identity, not structure: two vectors built
+    # separately are different arrays even if they have the same name and
+    # length (e.g. each Lookup("A", i) makes a new one), so their lookups are
+    # separate streams. This also keeps hashcons from merging them, so a plan
+    # costs the same whether or not it is interned. The key can be the id
+    # since interned vectors leave the (weak) table when they die.
+    def _key(self):
+        return (type(self).__name__, id(self))
+
+    def __eq__(self, other):
+        return self is other
+
+    def __hash__(self):
+        return id(self)
+
     def __str__(self):
         return "vec({0},{1})".format(self.name, self.length)
 
 class Lookup(Expr):
     # A memory lookup into an array.
+    __slots__ = ("vector", "index", "elemSize")
+    _fields = ("vector", "index", "elemSize")
+
     def __init__(self, vector, index, elemSize=4.0):
 
         if isinstance(vector, str):
@@ -392,25 +694,26 @@ class Lookup(Expr):
             self.index = index
 
         self.elemSize = elemSize
-        self.sequential = False
-
-    def __eq__(self, other):
-            return isinstance(other, Lookup) and\
-                    self.vector == other.vector and\
-                    self.index == other.index
 
     def children(self):
         return [self.vector] + self.index
 
-    def __hash__(self):
-        return hash(str(self.vector) + str(self.index))
-
     def __str__(self):
         return "lookup({0},{1})".format(str(self.vector),
                 [str(i) for i in self.index] if self.index is not None else "?")
 
     def cost(self, ctx):
-        # Sets annotations on a lookup node; doesn't perform any cost calculation.
+        # Annotates a lookup node; doesn't perform any cost calculation. The
+        # annotations are:
+        #   p_execute: the probability that the lookup is executed.
+        #   loops_seq: the enclosing loops, as (iterations, index) in nest order.
+        #   loops: the total number of iterations of the enclosing loops.
+        #   sequential: whether the access pattern is sequential.
+        #   private: whether the vector is private to the thread (e.g. a
+        #     local VecMerger table).
+        #   access, stride: the access pattern and stride, see access_pattern.
+        #   lanes: the number of elements loaded at once (see
+        #     machine.lanes_of).
 
         def is_sequential(lookup, indices):
             # given a lookup expression and an ordered list of loop
@@ -459,21 +762,165 @@ class Lookup(Expr):
             return False
 
         # Memory access costs determined separately.
-        if "selectivity" in ctx:
-            self.p_execute = ctx["selectivity"]
-        else:
-            self.p_execute = 1.0
-        self.loops_seq = []
-        for loop in ctx["loops"]:
-            self.loops_seq.append(loop)
+        loops_seq = list(ctx["loops"])
 
         iters = [loop[0] for loop in ctx["loops"]]
-        self.loops = reduce(lambda x,y: x*y, iters)
-
         idxes = [loop[1] for loop in ctx["loops"]]
-        self.sequential = is_sequential(self, idxes)
+        access, stride = access_pattern(self, ctx["nest"])
+        annotate(ctx, self,
+                 p_execute=ctx.get("selectivity", 1.0),
+                 loops_seq=loops_seq,
+                 loops=reduce(lambda x,y: x*y, iters),
+                 sequential=is_sequential(self, idxes),
+                 private=ctx.get("private", False),
+                 access=access,
+                 stride=stride,
+                 lanes=lanes_of(ctx))
 
         childCost = 0.0
         for c in self.children():
-            childCost += c.cost(ctx)
+            childCost = childCost + c.cost(ctx)
+        issue(ctx, "LOAD", 1)
+        if access in ("indirect", "random"):
+            # A vectorized lookup through computed indices is a gather.
+            lanes = lanes_of(ctx)
+            gather = where(lanes > 1, lanes * profile_of(ctx).GATHER_LANE_LATENCY, 0.0)
+            account(ctx, self, "processing", gather)
+            childCost = childCost + gather
         return childCost
+
+def _depends_on_memory(expr, loop_vars):
+    # Returns whether the value of expr depends on values loaded from memory,
+    # directly or through an Id bound by a Let.
+    if isinstance(expr, Lookup) or (isinstance(expr, Id) and expr not in loop_vars):
+        return True
+    for c in expr.children():
+        if _depends_on_memory(c, loop_vars):
+            return True
+    return False
+
+def _coefficient(expr, var, loop_vars):
+    # Returns how much expr, a function of the loop variables, changes when
+    # var increases by one, or None if that isn't a known constant.
+    if isinstance(expr, Id):
+        return 1 if expr == var else 0
+    if isinstance(expr, Literal):
+        return 0
+    if isinstance(expr, BinaryExpr):
+        left = _coefficient(expr.left, var, loop_vars)
+        right = _coefficient(expr.right, var, loop_vars)
+        if left is None or right is None:
+            return None
+        if left == 0 and right == 0:
+            return 0
+        if isinstance(expr, Add):
+            return left + right
+        if isinstance(expr, Subtract):
+            return left - right
+        if isinstance(expr, Multiply):
+            # Only multiplication by a known constant keeps the stride fixed.
+            for coefficient, other in ((left, expr.right), (right, expr.left)):
+                if isinstance(other, Literal) and isinstance(other.value, (int, long, float)):
+                    return coefficient * other.value
+        return None
+    return None
+
+def access_pattern(lookup, loops):
+    # Classifies the accesses of lookup within loops (the enclosing For nodes,
+    # outermost first) and returns (access, stride):
+    #   sequential: consecutive iterations of the innermost loop the index
+    #     depends on access consecutive elements (stride 1). The elements of
+    #     a vectorized loop (stride > 1) count as consecutive.
+    #   strided: they access elements stride elements apart, e.g. B[k][j] in
+    #     a loop over k, whose stride is the trip count of the loop over j.
+    #   indirect: the index is loaded from memory, e.g. R[A[i]].
+    #   random: anything else (stride is None for indirect and random).
+    # A lookup with several indices addresses a row-major array whose
+    # dimensions are the trip counts of the loops indexing it.
+    loop_vars = [loop.loopIdx for loop in loops]
+    for index in lookup.index:
+        if _depends_on_memory(index, loop_vars):
+            return "indirect", None
+    extents = dict((loop.loopIdx, loop.iters) for loop in loops)
+    for loop in reversed(loops):
+        coefficients = [_coefficient(index, loop.loopIdx, loop_vars) for index in lookup.index]
+        if None in coefficients:
+            return "random", None
+        if not any(coefficients):
+            continue
+        stride = 0
+        for dim, coefficient in enumerate(coefficients):
+            if coefficient == 0:
+                continue
+            size = abs(coefficient)
+            for inner in lookup.index[dim + 1:]:
+                if inner not in extents:
+                    return "random", None
+                size = size * extents[inner]
+            stride = stride + size
+        if coefficients == [0] * (len(coefficients) - 1) + [1]:
+            return "sequential", 1
+        return "strided", stride
+    # The index doesn't depend on any loop.
+    return "sequential", 0
+
+# The port model (see params.PORT_MODEL). Ops and loads record the instructions
+# they issue per iteration of the enclosing loop with issue(); the loop then
+# adds the larger of the critical path of its body and the time the busiest
+# kind of port needs to issue them.
+PORTS = ("ALU", "MUL", "DIV", "VEC", "LOAD")
+
+def issue(ctx, port, instructions):
+    # Records instructions issued to port, weighted by the probability that
+    # they execute in an iteration of the enclosing loop.
+    if ctx.get("issued") is None:
+        return
+    issued, loop_selectivity = ctx["issued"]
+    weight = ctx.get("selectivity", 1.0) / loop_selectivity
+    issued[port] = issued.get(port, 0.0) + weight * instructions
+
+def critical_path(expr, machine, env=None, lanes=1):
+    # Returns the latency of the longest chain of dependent ops in expr,
+    # without entering nested loops. Loaded values are ready at once; memory
+    # costs are accounted for separately. The branches of an If count by how
+    # likely they are taken, as in If.cost, or both at once in a vectorized
+    # loop (lanes > 1), where they run under masks.
+    if env is None:
+        env = {}
+    if isinstance(expr, For):
+        return 0
+    if isinstance(expr, VecMergerMerge) and expr.globalTable:
+        # Atomic updates are costed by VecMergerMerge.
+        return critical_path(expr.lookup, machine, env, lanes)
+    if isinstance(expr, Id):
+        return env.get(expr, 0)
+    if isinstance(expr, Let):
+        inner = dict(env)
+        inner[expr.name] = critical_path(expr.value, machine, env, lanes)
+        return critical_path(expr.expr, machine, inner, lanes)
+    if isinstance(expr, If):
+        cond = critical_path(expr.cond, machine, env, lanes)
+        true = critical_path(expr.true, machine, env, lanes)
+        false = critical_path(expr.false, machine, env, lanes)
+        taken = expr.selectivity * true + (1 - expr.selectivity) * false
+        return cond + where(lanes > 1, maximum(true, false), taken)
+    path = 0
+    for c in expr.children():
+        path = maximum(path, critical_path(c, machine, env, lanes))
+    if isinstance(expr, BinaryExpr):
+        latency, instructions = expr.instructions(machine)
+        path = path + latency
+    return path
+
+def port_cost(ctx, body):
+    # The cost per iteration of the ops issued by a loop's body in the port
+    # model, and 0 otherwise.
+    machine = profile_of(ctx)
+    if all_true(machine.PORT_MODEL == 0):
+        return 0.0
+    issued, _ = ctx["issued"]
+    cycles = critical_path(body, machine, lanes=lanes_of(ctx))
+    for port in PORTS:
+        if port in issued:
+            cycles = maximum(cycles, issued[port] / to_float(getattr(machine, port + "_PORTS")))
+    return where(machine.PORT_MODEL, cycles, 0.0)
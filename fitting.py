@@ -0,0 +1,221 @@
+# Fits the parameters of a machine profile to measured runtimes.
+"""
+Hand-tuned constants such as ATOMICADD_PENALTY or BRANCHPRED_LATENCY are fitted
+to the runtimes in the benchmark logs (see accuracy.py) by bounded least squares
+on log-runtime:
+
+    $ python fitting.py -o fitted.profile -f ATOMICADD_PENALTY -f BRANCHPRED_LATENCY=0:40
+
+Every plan of every workload is compiled once (compiler.compile_call) with the
+fitted profile fields left free as Params. Where the plan builder allows it, the
+point parameters (b, p, n...) are left free as well, so a single program covers
+all the points a plan was measured at. Each iteration of the fit then evaluates
+every program once, on arrays: one row per measured point, one column for the
+current parameters and one per parameter for the finite differences of the
+Jacobian. The fit itself is Levenberg-Marquardt, with steps clipped to the
+bounds.
+
+Costs are in cycles of a single core and the benchmarks report seconds over
+all of them, so each workload's predicted log-costs get their own offset,
+solved for in closed form. The fit therefore only matches how runtimes vary
+within a workload, which is also what plan choices depend on. Parameters the
+measured workloads don't exercise keep their values.
+"""
+
+import argparse
+import math
+
+import accuracy
+import sweep
+from arith import np
+from compiler import Param, compile_call
+from machine import DEFAULT, MachineProfile
+
+# Default bounds of the parameters that are usually fitted.
+BOUNDS = {
+    "BINOP_LATENCY": (0.25, 4.0),
+    "BINOP_VEC_LATENCY": (0.25, 16.0),
+    "MUL_LATENCY": (0.25, 8.0),
+    "DIV_LATENCY": (0.25, 64.0),
+    "ATOMICADD_LATENCY": (1.0, 100.0),
+    "ATOMICADD_PENALTY": (0.0, 200.0),
+    "BRANCHPRED_LATENCY": (0.0, 50.0),
+    "L1_LATENCY": (1.0, 10.0),
+    "L2_LATENCY": (4.0, 40.0),
+    "L3_LATENCY": (10.0, 200.0),
+    "MEM_LATENCY": (20.0, 1000.0),
+    "L3_THROUGHPUT": (1e10, 1e13),
+    "MEM_THROUGHPUT": (1e9, 1e12),
+}
+
+# The parameters fitted by default.
+FREE = ("ATOMICADD_LATENCY", "ATOMICADD_PENALTY", "BRANCHPRED_LATENCY", "MEM_LATENCY")
+
+class Observations(object):
+    # The measured runtimes of a set of workloads and the compiled costs of
+    # their plans, as a function of the parameters in fields.
+    def __init__(self, fields, raw_dir=accuracy.RAW_DIR, base=DEFAULT, workloads=None):
+        self.fields = list(fields)
+        profile = base.replace(**dict((f, Param(f)) for f in self.fields))
+        # (workload index, program, {point parameter: column of values},
+        # log runtimes) per compiled program.
+        self.groups = []
+        self.workloads = []
+        for name, bench, builder, renames, fixed in accuracy.WORKLOADS:
+            if workloads and name not in workloads:
+                continue
+            measured = accuracy.measurements(raw_dir, bench, renames, fixed)
+            if not measured:
+                continue
+            self.workloads.append(name)
+            self._compile(len(self.workloads) - 1, builder, measured, profile)
+
+    def _compile(self, workload, builder, measured, profile):
+        # Compiles the plans of a workload over all its points at once if the
+        # builder accepts symbolic parameters, else point by point.
+        names = sorted(measured[0][0])
+        try:
+            plans = builder(**dict((k, Param(k)) for k in names))
+            programs = [(label, compile_call(sweep.plan_cost, plan, profile, params=names))
+                        for label, plan in plans]
+        except TypeError:
+            # A parameter decides the shape of the plan (e.g. the number of
+            # lookups in q6).
+            for point, times in measured:
+                for label, plan in builder(**point):
+                    if label in times:
+                        self.groups.append((workload, compile_call(sweep.plan_cost, plan, profile), {},
+                                            np.log([times[label]])))
+            return
+        for label, program in programs:
+            rows = [(point, times[label]) for point, times in measured if label in times]
+            # Integer parameters stay integers, since the model divides them
+            # with Python 2 semantics.
+            args = dict((k, np.array([point[k] for point, _ in rows])[:, None]) for k in names)
+            self.groups.append((workload, program, args, np.log([t for _, t in rows])))
+
+    def __len__(self):
+        return sum(len(times) for _, _, _, times in self.groups)
+
+    def log_costs(self, values):
+        # Returns the predicted log-costs as an array with a row per
+        # observation and a column per column of values, which maps each
+        # field to a row vector of values to evaluate.
+        columns = len(values[self.fields[0]]) if self.fields else 1
+        out = []
+        for _, program, args, times in self.groups:
+            kwargs = dict(args)
+            for f in self.fields:
+                if f in program.params:
+                    kwargs[f] = values[f][None, :]
+            c = np.broadcast_to(np.asarray(program(**kwargs), dtype=float), (len(times), columns))
+            out.append(np.log(np.maximum(c, 1e-300)))
+        return np.concatenate(out)
+
+    def log_times(self):
+        return np.concatenate([times for _, _, _, times in self.groups])
+
+    def workload_index(self):
+        return np.concatenate([np.repeat(w, len(times)) for w, _, _, times in self.groups])
+
+def _center(x, index, count):
+    # Subtracts the mean of each workload from the rows of x.
+    sums = np.zeros((count,) + x.shape[1:])
+    np.add.at(sums, index, x)
+    counts = np.bincount(index, minlength=count).astype(float)
+    return x - (sums / counts.reshape((count,) + (1,) * (x.ndim - 1)))[index]
+
+def fit(observations, bounds, base=DEFAULT, iterations=100, tol=1e-8):
+    # Fits the fields of observations within bounds ({field: (lo, hi)}),
+    # starting from their values in base. Returns (fitted profile, RMS error of
+    # log-runtime before, after).
+    fields = observations.fields
+    lo = np.array([bounds[f][0] for f in fields], dtype=float)
+    hi = np.array([bounds[f][1] for f in fields], dtype=float)
+    theta = np.clip(np.array([getattr(base, f) for f in fields], dtype=float), lo, hi)
+    # Finite difference steps, towards the inside of the bounds.
+    steps = 1e-4 * (hi - lo)
+    index = observations.workload_index()
+    count = len(observations.workloads)
+    log_times = observations.log_times()
+
+    def evaluate(theta, jacobian):
+        # Returns the residuals, centered per workload, and their Jacobian.
+        columns = [theta]
+        if jacobian:
+            for i in range(len(fields)):
+                t = theta.copy()
+                t[i] = t[i] + steps[i] if t[i] + steps[i] <= hi[i] else t[i] - steps[i]
+                columns.append(t)
+        values = dict((f, np.array([c[i] for c in columns])) for i, f in enumerate(fields))
+        c = observations.log_costs(values)
+        r = _center(c[:, 0] - log_times, index, count)
+        if not jacobian:
+            return r, None
+        deltas = np.array([columns[i + 1][i] - theta[i] for i in range(len(fields))])
+        J = _center((c[:, 1:] - c[:, :1]) / deltas, index, count)
+        return r, J
+
+    r, J = evaluate(theta, True)
+    before = math.sqrt(np.mean(r ** 2))
+    damping = 1e-3
+    for _ in range(iterations):
+        if not len(fields):
+            break
+        A = J.T.dot(J)
+        g = J.T.dot(r)
+        improved = False
+        while damping < 1e10:
+            delta = np.linalg.solve(A + damping * np.diag(np.diag(A) + 1e-12), -g)
+            candidate = np.clip(theta + delta, lo, hi)
+            r_new, _ = evaluate(candidate, False)
+            if r_new.dot(r_new) < r.dot(r):
+                improved = True
+                break
+            damping *= 10
+        if not improved:
+            break
+        done = r.dot(r) - r_new.dot(r_new) < tol * r.dot(r)
+        theta = candidate
+        damping = max(damping / 10, 1e-12)
+        r, J = evaluate(theta, True)
+        if done:
+            break
+    after = math.sqrt(np.mean(r ** 2))
+    values = dict((f, float(v)) for f, v in zip(fields, theta))
+    return base.replace(name="fitted", **values), before, after
+
+def _parse_field(spec):
+    # Parses NAME or NAME=lo:hi.
+    name, _, bounds = spec.partition("=")
+    if bounds:
+        lo, hi = bounds.split(":")
+        return name, (float(lo), float(hi))
+    if name not in BOUNDS:
+        raise ValueError("no default bounds for {0}; give them as {0}=lo:hi".format(name))
+    return name, BOUNDS[name]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit profile parameters to measured runtimes")
+    parser.add_argument("-o", "--output", required=True,
+        help="File to write the fitted profile to")
+    parser.add_argument("-p", "--profile", default=None,
+        help="Profile to start from (defaults to params.py)")
+    parser.add_argument("-d", "--raw-dir", default=accuracy.RAW_DIR,
+        help="Directory holding the benchmark logs (defaults to data/ec2/raw)")
+    parser.add_argument("-f", "--field", action="append", default=None,
+        help="Parameter to fit, as NAME or NAME=lo:hi (may be repeated)")
+    parser.add_argument("-w", "--workload", action="append", default=None,
+        help="Only fit to this workload (may be repeated)")
+    parser.add_argument("-n", "--iterations", type=int, default=100,
+        help="Maximum number of iterations")
+    args = parser.parse_args()
+
+    base = MachineProfile.load(args.profile) if args.profile else DEFAULT
+    bounds = dict(_parse_field(spec) for spec in (args.field or FREE))
+    observations = Observations(sorted(bounds), args.raw_dir, base, args.workload)
+    profile, before, after = fit(observations, bounds, base, args.iterations)
+    profile.save(args.output)
+    print "{0} runtimes, RMS log error {1:.4f} -> {2:.4f}".format(len(observations), before, after)
+    for field in observations.fields:
+        print "{0} = {1!r} (was {2!r})".format(field, getattr(profile, field), getattr(base, field))
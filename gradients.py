@@ -0,0 +1,203 @@
+# Forward-mode derivatives of costs with respect to annotations.
+"""
+Bind a Dual made with variable() to an annotation and cost the tree as usual;
+the cost comes back as a Dual holding both the cost and its derivatives with
+respect to every variable:
+
+    branch.selectivity = variable("p", 0.5)
+    c = cost(loop)
+    c.value, c.grad["p"]
+
+The derivatives flow through the same code as the costs (BinaryExpr, If, For,
+VecMergerMerge and the memory term of cost_with_bandwidth.cost), through the
+arith helpers, which pick the derivative of the branch they select. Step
+functions of an annotation (int truncation of reuse distances, the cache level a
+reuse distance falls into) have a zero derivative, so costs are differentiated
+piecewise. Values and derivatives may be NumPy arrays, as with cost_batch.
+
+crossover() uses the derivatives to find where two plans cost the same, e.g.
+the selectivity at which a local VecMerger becomes cheaper than a global one,
+in a handful of evaluations instead of a grid sweep.
+"""
+
+import math
+
+import arith
+from arith import Value, is_array, np
+
+class Dual(Value):
+    # A value with its derivatives: grad maps variable names to the
+    # derivative of value with respect to that variable.
+    __slots__ = ("value", "grad")
+
+    def __init__(self, value, grad=None):
+        self.value = value
+        self.grad = grad if grad is not None else {}
+
+    def apply(self, op, *args):
+        if op in ("to_float", "trunc"):
+            # Truncation is a step function, with a zero derivative.
+            x = args[0]
+            grad = x.grad if op == "to_float" else {}
+            return Dual(getattr(arith, op)(x.value), grad)
+        if op == "minimum":
+            x, y = args
+            return _where(_value(y) < _value(x), y, x)
+        if op == "maximum":
+            x, y = args
+            return _where(_value(y) > _value(x), y, x)
+        if op == "clip":
+            x, lo, hi = args
+            return _where(_value(x) < _value(lo), lo, _where(_value(x) > _value(hi), hi, x))
+        if op == "where":
+            cond, x, y = args
+            return _where(_value(cond), x, y)
+        # logical_or, logical_and and all_true only apply to conditions.
+        return getattr(arith, op)(*[_value(a) for a in args])
+
+    def __add__(self, other):
+        return _combine(self.value + _value(other), self, 1.0, other, 1.0)
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return _combine(self.value - _value(other), self, 1.0, other, -1.0)
+
+    def __rsub__(self, other):
+        return _combine(_value(other) - self.value, other, 1.0, self, -1.0)
+
+    def __mul__(self, other):
+        return _combine(self.value * _value(other), self, _value(other), other, self.value)
+    __rmul__ = __mul__
+
+    def __div__(self, other):
+        return _divide(self, other)
+
+    def __rdiv__(self, other):
+        return _divide(other, self)
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+    def __pow__(self, other):
+        return _power(self, other)
+
+    def __rpow__(self, other):
+        return _power(other, self)
+
+    def __neg__(self):
+        return _combine(-self.value, self, -1.0, None, 0.0)
+
+    def __abs__(self):
+        return _combine(abs(self.value), self, arith.where(self.value < 0, -1.0, 1.0), None, 0.0)
+
+    # Comparisons compare values, so the model takes the same branches it
+    # would for plain numbers.
+    def __lt__(self, other): return self.value < _value(other)
+    def __le__(self, other): return self.value <= _value(other)
+    def __gt__(self, other): return self.value > _value(other)
+    def __ge__(self, other): return self.value >= _value(other)
+    def __eq__(self, other): return self.value == _value(other)
+    def __ne__(self, other): return self.value != _value(other)
+
+    # Duals can't be used as dictionary keys, which keeps them out of the
+    # caches in the cost model.
+    __hash__ = None
+
+    def __nonzero__(self):
+        return bool(self.value)
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return "Dual({0!r}, {1!r})".format(self.value, self.grad)
+
+    def __str__(self):
+        return str(self.value)
+
+def _value(x):
+    return x.value if isinstance(x, Dual) else x
+
+def _grad(x):
+    return x.grad if isinstance(x, Dual) else {}
+
+def _combine(value, x, dx, y, dy):
+    # Returns the Dual for value, whose derivative is dx * x' + dy * y'.
+    grad = {}
+    for k, d in _grad(x).iteritems():
+        grad[k] = dx * d
+    for k, d in _grad(y).iteritems():
+        grad[k] = grad[k] + dy * d if k in grad else dy * d
+    return Dual(value, grad)
+
+def _divide(x, y):
+    xv, yv = _value(x), _value(y)
+    return _combine(xv / yv, x, 1.0 / yv, y, -arith.to_float(xv) / (yv * yv))
+
+def _power(x, y):
+    xv, yv = _value(x), _value(y)
+    value = xv ** yv
+    dy = 0.0
+    if _grad(y):
+        dy = value * _log(xv)
+    return _combine(value, x, yv * xv ** (yv - 1), y, dy)
+
+def _log(x):
+    if is_array(x):
+        return np.log(x)
+    return math.log(x)
+
+def _where(cond, x, y):
+    # where() for values and derivatives alike.
+    grad = {}
+    xg, yg = _grad(x), _grad(y)
+    for k in set(xg) | set(yg):
+        grad[k] = arith.where(cond, xg.get(k, 0.0), yg.get(k, 0.0))
+    return Dual(arith.where(cond, _value(x), _value(y)), grad)
+
+def variable(name, value):
+    # Returns value as the variable name, i.e. with a derivative of 1 with
+    # respect to itself.
+    return Dual(value, {name: 1.0})
+
+def value(x):
+    # Returns the value of a Dual, or x itself for numbers.
+    return _value(x)
+
+def derivative(x, name):
+    # Returns the derivative of x with respect to the variable name.
+    return _grad(x).get(name, 0.0)
+
+def crossover(f, lo, hi, name="x", tol=1e-9, maxiter=50):
+    # Finds x in [lo, hi] with f(x) == 0, where f is called with a variable
+    # called name and returns a Dual, e.g. the difference between the costs
+    # of two plans. Returns None if f has the same sign at lo and hi.
+    #
+    # Newton steps use the derivative of f; steps leaving the bracket (e.g.
+    # where f is flat) fall back to bisection, so this always converges.
+    def evaluate(x):
+        y = f(variable(name, x))
+        return value(y), derivative(y, name)
+
+    flo, _ = evaluate(lo)
+    fhi, _ = evaluate(hi)
+    if flo == 0:
+        return lo
+    if fhi == 0:
+        return hi
+    if (flo < 0) == (fhi < 0):
+        return None
+
+    x = lo + (hi - lo) / 2.0
+    for _ in xrange(maxiter):
+        fx, dfx = evaluate(x)
+        if fx == 0:
+            return x
+        if (fx < 0) == (flo < 0):
+            lo, flo = x, fx
+        else:
+            hi = x
+        step = x - fx / dfx if dfx != 0 else None
+        if step is None or not lo < step < hi:
+            step = lo + (hi - lo) / 2.0
+        if abs(step - x) <= tol * max(1.0, abs(x)):
+            return step
+        x = step
+    return x
@@ -0,0 +1,148 @@
+/**
+ * perf_counters.h
+ *
+ * Optional hardware performance counters around the timed region of a
+ * benchmark, so each term of the cost model (cache misses, branch mispredicts,
+ * ...) can be checked against a measurement. Counters are only used when the
+ * BENCH_COUNTERS environment variable is set to a value other than 0, and
+ * only on Linux, through perf_event_open. Counters that can't be opened (in
+ * most containers, or with a restrictive perf_event_paranoid) are left out,
+ * and without any the benchmark runs as before.
+ *
+ * Usage:
+ *
+ *  struct perf_counters pc;
+ *  perf_counters_open(&pc);      // before any thread is created
+ *  ...
+ *  perf_counters_start(&pc);
+ *  run_query(...);
+ *  perf_counters_stop(&pc);
+ *  perf_counters_print(&pc, "Local");
+ *
+ * which prints a line of the form
+ *
+ *  >>> counters Local cycles=123 instructions=456 ...
+ *
+ * Counters are inherited by threads created after perf_counters_open, so the
+ * counts of a multi-threaded region are totals over all its threads. Counts of
+ * counters the kernel had to multiplex are scaled to the whole region.
+ *
+ */
+
+#ifndef PERF_COUNTERS_H
+#define PERF_COUNTERS_H
+
+#include <stdio.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#ifdef __linux__
+#include <unistd.h>
+#include <sys/ioctl.h>
+#include <sys/syscall.h>
+#include <linux/perf_event.h>
+#endif
+
+#define PERF_COUNTERS_MAX 5
+
+struct perf_counters {
+    int count;
+    const char *names[PERF_COUNTERS_MAX];
+    int fds[PERF_COUNTERS_MAX];
+    double values[PERF_COUNTERS_MAX];
+};
+
+#ifdef __linux__
+
+#define PERF_CACHE_READ_MISS(cache) \
+    ((cache) | (PERF_COUNT_HW_CACHE_OP_READ << 8) | (PERF_COUNT_HW_CACHE_RESULT_MISS << 16))
+
+static int perf_counters_open_one(uint32_t type, uint64_t config) {
+    struct perf_event_attr attr;
+    memset(&attr, 0, sizeof(attr));
+    attr.size = sizeof(attr);
+    attr.type = type;
+    attr.config = config;
+    attr.disabled = 1;
+    attr.inherit = 1;
+    attr.exclude_kernel = 1;
+    attr.exclude_hv = 1;
+    attr.read_format = PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING;
+    return (int)syscall(__NR_perf_event_open, &attr, 0, -1, -1, 0);
+}
+
+#endif
+
+/** Opens the counters if BENCH_COUNTERS is set. */
+static void perf_counters_open(struct perf_counters *pc) {
+    pc->count = 0;
+#ifdef __linux__
+    const char *enabled = getenv("BENCH_COUNTERS");
+    if (enabled == NULL || strcmp(enabled, "0") == 0) {
+        return;
+    }
+
+    struct { const char *name; uint32_t type; uint64_t config; } events[PERF_COUNTERS_MAX] = {
+        {"cycles", PERF_TYPE_HARDWARE, PERF_COUNT_HW_CPU_CYCLES},
+        {"instructions", PERF_TYPE_HARDWARE, PERF_COUNT_HW_INSTRUCTIONS},
+        {"llc-misses", PERF_TYPE_HW_CACHE, PERF_CACHE_READ_MISS(PERF_COUNT_HW_CACHE_LL)},
+        {"branch-misses", PERF_TYPE_HARDWARE, PERF_COUNT_HW_BRANCH_MISSES},
+        {"l1d-misses", PERF_TYPE_HW_CACHE, PERF_CACHE_READ_MISS(PERF_COUNT_HW_CACHE_L1D)},
+    };
+    for (int i = 0; i < PERF_COUNTERS_MAX; i++) {
+        int fd = perf_counters_open_one(events[i].type, events[i].config);
+        if (fd >= 0) {
+            pc->names[pc->count] = events[i].name;
+            pc->fds[pc->count] = fd;
+            pc->count++;
+        }
+    }
+    if (pc->count == 0) {
+        fprintf(stderr, "performance counters unavailable\n");
+    }
+#endif
+}
+
+/** Resets and starts the counters. */
+static void perf_counters_start(struct perf_counters *pc) {
+#ifdef __linux__
+    for (int i = 0; i < pc->count; i++) {
+        ioctl(pc->fds[i], PERF_EVENT_IOC_RESET, 0);
+        ioctl(pc->fds[i], PERF_EVENT_IOC_ENABLE, 0);
+    }
+#endif
+}
+
+/** Stops the counters and reads their values. */
+static void perf_counters_stop(struct perf_counters *pc) {
+#ifdef __linux__
+    for (int i = 0; i < pc->count; i++) {
+        ioctl(pc->fds[i], PERF_EVENT_IOC_DISABLE, 0);
+    }
+    for (int i = 0; i < pc->count; i++) {
+        // The value, the time enabled and the time running.
+        uint64_t buf[3];
+        pc->values[i] = -1.0;
+        if (read(pc->fds[i], buf, sizeof(buf)) == sizeof(buf) && buf[2] > 0) {
+            pc->values[i] = (double)buf[0] * ((double)buf[1] / (double)buf[2]);
+        }
+    }
+#endif
+}
+
+/** Prints the values read by perf_counters_stop for the plan label. */
+static void perf_counters_print(struct perf_counters *pc, const char *label) {
+    if (pc->count == 0) {
+        return;
+    }
+    printf(">>> counters %s", label);
+    for (int i = 0; i < pc->count; i++) {
+        if (pc->values[i] >= 0) {
+            printf(" %s=%.0f", pc->names[i], pc->values[i]);
+        }
+    }
+    printf("\n");
+}
+
+#endif
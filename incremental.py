@@ -0,0 +1,133 @@
+# Re-costs an expression tree incrementally as its annotations change.
+"""
+An optimizer typically changes one annotation at a time (an If.selectivity, a
+For.iters or a Vector.length) and asks for the cost again. cost() would walk
+the whole tree again, collect every Lookup and recompute every reuse distance.
+
+IncrementalCost compiles the tree once (see compiler.py) with every annotation
+bound to its own parameter and keeps the value of every instruction of the
+program. Changing an annotation re-runs only the instructions that depend on it,
+i.e. the part of the cost between the edited node and the result, and reuses
+the cached values for everything else:
+
+    costs = IncrementalCost(loop)
+    costs.cost()
+    costs.update(branch, 0.5)   # Returns the new cost.
+
+Results are identical to cost() on a tree with the same annotation values. The
+tree itself isn't modified: the program is compiled from a copy of it with the
+parameters in place of the annotations.
+"""
+
+from compiler import Param, compile_cost, format_instruction, program_namespace
+from cost_with_bandwidth import annotated_nodes
+from expressions import Expr
+
+class IncrementalCost(object):
+    def __init__(self, expr, cost=None):
+        # cost defaults to cost_with_bandwidth.cost.
+        self.expr = expr
+
+        # Bind a parameter to each annotated node, keyed by identity since
+        # structurally equal nodes may be annotated differently.
+        self._params = {}
+        bound = {}
+        env = {}
+        for node, name in annotated_nodes(expr):
+            if id(node) in self._params:
+                continue
+            param = "a{0}".format(len(self._params))
+            self._params[id(node)] = param
+            bound[id(node)] = (name, Param(param))
+            env[param] = getattr(node, name)
+        self.program = compile_cost(_bind(expr, bound), cost)
+
+        self._namespace = program_namespace(self.program.constants)
+        self._names = set(self.program.params)
+        self._names.update(name for name, _, _ in self.program.instructions)
+        # Update functions, by the parameter they recompute the cost for.
+        self._updates = {}
+        self._env = env
+        self._run(self._block(self.program.instructions))
+
+    def _block(self, instructions):
+        # Compiles a function that runs instructions, reading the operands
+        # they don't compute from the environment and storing the results back.
+        defined = set(name for name, _, _ in instructions)
+        loads = []
+        for _, _, args in instructions:
+            for a in args:
+                if a in self._names and a not in defined and a not in loads:
+                    loads.append(a)
+        if self.program.result in self._names and self.program.result not in defined:
+            loads.append(self.program.result)
+
+        lines = ["def update(env):"]
+        lines.extend("    {0} = env[{0!r}]".format(a) for a in loads)
+        for name, op, args in instructions:
+            lines.append("    {0} = {1}".format(name, format_instruction(op, args)))
+            lines.append("    env[{0!r}] = {0}".format(name))
+        lines.append("    return {0}".format(self.program.result))
+        namespace = dict(self._namespace)
+        exec compile("\n".join(lines) + "\n", "<cost update>", "exec") in namespace
+        return namespace["update"]
+
+    def _run(self, update):
+        self._cost = update(self._env)
+        return self._cost
+
+    def _update_for(self, param):
+        # Returns the update function for param, compiling it on first use.
+        if param not in self._updates:
+            dirty = set([param])
+            instructions = []
+            for instruction in self.program.instructions:
+                name, _, args = instruction
+                if any(a in dirty for a in args):
+                    dirty.add(name)
+                    instructions.append(instruction)
+            self._updates[param] = self._block(instructions)
+        return self._updates[param]
+
+    def _param(self, node):
+        try:
+            return self._params[id(node)]
+        except KeyError:
+            raise ValueError("{0} is not an annotated node of this tree".format(node))
+
+    def cost(self):
+        # Returns the cost for the current annotation values.
+        return self._cost
+
+    def value(self, node):
+        # Returns the current value of node's annotation.
+        return self._env[self._param(node)]
+
+    def update(self, node, value):
+        # Sets the annotation of node (an If, For or Vector in the tree) to
+        # value and returns the new cost.
+        param = self._param(node)
+        self._env[param] = value
+        return self._run(self._update_for(param))
+
+def _bind(expr, bound, memo=None):
+    # Returns a copy of expr in which the annotation of each node in bound
+    # ({id(node): (annotation name, Param)}) is replaced by its Param. Nodes
+    # shared within expr stay shared in the copy.
+    if memo is None:
+        memo = {}
+    if id(expr) in memo:
+        return memo[id(expr)]
+    node = object.__new__(type(expr))
+    for f in expr._fields:
+        value = getattr(expr, f)
+        if isinstance(value, Expr):
+            value = _bind(value, bound, memo)
+        elif isinstance(value, list):
+            value = [_bind(v, bound, memo) if isinstance(v, Expr) else v for v in value]
+        object.__setattr__(node, f, value)
+    if id(expr) in bound:
+        name, param = bound[id(expr)]
+        object.__setattr__(node, name, param)
+    memo[id(expr)] = node
+    return node
@@ -0,0 +1,48 @@
+# A bounded least-recently-used cache with hit/miss counters.
+
+import collections
+import threading
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+class LRUCache(object):
+    def __init__(self, maxsize=4096):
+        # The maximum number of entries kept.
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, compute):
+        # Returns the value cached for key, calling compute() and caching its
+        # result if there isn't one. compute() runs without holding the lock,
+        # so concurrent misses on the same key may both compute it.
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries[key] = value
+                return value
+        value = compute()
+        with self._lock:
+            if self.maxsize <= 0:
+                return value
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+            self._entries[key] = value
+        return value
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
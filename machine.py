@@ -0,0 +1,210 @@
+# Machine profiles: the parameters of the machine a plan is costed for.
+"""
+A MachineProfile holds the constants the cost model needs (core count, cache
+sizes, latencies, throughputs, instruction costs). It is immutable, so one
+profile can be shared between threads, and is passed explicitly to
+cost_with_bandwidth.cost. The defaults are the values in params.py.
+
+Profiles are stored in text files with one "NAME = value" line per parameter,
+using the names in params.py; "#" starts a comment. Parameters a file doesn't
+mention keep their default values:
+
+    # c5.9xlarge
+    CORES = 18
+    L3_SIZE = 393216
+
+MachineProfile.stack combines several profiles into one whose parameters are
+NumPy arrays, so a plan can be costed against all of them in a single pass
+(see cost_with_bandwidth.cost_profiles).
+"""
+
+import ast
+
+import params
+from arith import np, where
+
+class MachineProfile(object):
+    # The parameters of a profile, in the order they are written to files.
+    FIELDS = (
+        "CORES",
+        "CLOCK_FREQUENCY",
+        "L1_THROUGHPUT",
+        "L2_THROUGHPUT",
+        "L3_THROUGHPUT",
+        "MEM_THROUGHPUT",
+        "MEM_THROUGHPUT_PER_CORE",
+        "L1_SIZE",
+        "L2_SIZE",
+        "L3_SIZE",
+        "CACHE_LINE_SIZE",
+        "L1_WAYS",
+        "L2_WAYS",
+        "L3_WAYS",
+        "L1_LATENCY",
+        "L2_LATENCY",
+        "L3_LATENCY",
+        "MEM_LATENCY",
+        "LINE_FILL_BUFFERS",
+        "PREFETCH_STREAMS",
+        "PREFETCH_DISTANCE",
+        "PREFETCH_MAX_STRIDE",
+        "SOCKETS",
+        "REMOTE_MEM_LATENCY",
+        "INTERCONNECT_THROUGHPUT",
+        "BINOP_LATENCY",
+        "BINOP_VEC_LATENCY",
+        "MUL_LATENCY",
+        "MUL_VEC_LATENCY",
+        "DIV_LATENCY",
+        "DIV_VEC_LATENCY",
+        "SIMD_WIDTH",
+        "GATHER_LANE_LATENCY",
+        "SCATTER_LANE_LATENCY",
+        "MASK_LATENCY",
+        "PORT_MODEL",
+        "ALU_PORTS",
+        "MUL_PORTS",
+        "DIV_PORTS",
+        "VEC_PORTS",
+        "LOAD_PORTS",
+        "ATOMICADD_LATENCY",
+        "ATOMICADD_PENALTY",
+        "REMOTE_ATOMICADD_PENALTY",
+        "BRANCHPRED_PREDICTABLE_IT_DIST",
+        "BRANCHPRED_LATENCY",
+        "BRANCH_LATENCY",
+    )
+
+    __slots__ = FIELDS + ("name",)
+
+    def __init__(self, name="default", **values):
+        # Parameters not given take their values from params.py.
+        unknown = set(values) - set(self.FIELDS)
+        if unknown:
+            raise ValueError("unknown machine parameters: {0}".format(", ".join(sorted(unknown))))
+        object.__setattr__(self, "name", name)
+        for field in self.FIELDS:
+            object.__setattr__(self, field, values.get(field, getattr(params, field)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("machine profiles are immutable; use replace()")
+
+    def replace(self, name=None, **values):
+        # Returns a copy of this profile with some parameters changed.
+        d = self.values()
+        d.update(values)
+        return MachineProfile(self.name if name is None else name, **d)
+
+    def values(self):
+        # Returns the parameters as a dict.
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def branch_mispredict_penalty(self, selectivity):
+        # The expected branch misprediction penalty; see
+        # params.BRANCH_MISPREDICT_PENALTY.
+        return -2 * self.BRANCHPRED_LATENCY * abs(selectivity - 0.5) + self.BRANCHPRED_LATENCY
+
+    @property
+    def cache_sizes(self):
+        # Cache sizes in blocks, from L1 to L3.
+        return [self.L1_SIZE, self.L2_SIZE, self.L3_SIZE]
+
+    @property
+    def cache_ways(self):
+        # Associativity of each cache, from L1 to L3.
+        return [self.L1_WAYS, self.L2_WAYS, self.L3_WAYS]
+
+    @property
+    def latencies(self):
+        # Access latencies from L1 to memory.
+        return [self.L1_LATENCY, self.L2_LATENCY, self.L3_LATENCY, self.MEM_LATENCY]
+
+    @property
+    def memory_throughput(self):
+        # Throughputs from L1 to memory.
+        return [self.L1_THROUGHPUT, self.L2_THROUGHPUT, self.L3_THROUGHPUT, self.MEM_THROUGHPUT]
+
+    def local_fraction(self, placement, sequential, private):
+        # The fraction of accesses to a vector with the given placement that
+        # go to the local socket.
+        if private or placement == "replicated":
+            return 1.0
+        if placement == "first-touch" and sequential:
+            return 1.0
+        return 1.0 / self.SOCKETS
+
+    @classmethod
+    def load(cls, path):
+        # Reads a profile file. The profile is named after the file.
+        values = {}
+        with open(path) as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                name, sep, value = line.partition("=")
+                if not sep:
+                    raise ValueError("{0}:{1}: expected NAME = value".format(path, lineno))
+                values[name.strip()] = ast.literal_eval(value.strip())
+        return cls(path, **values)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            f.write("# Machine profile: {0}\n".format(self.name))
+            for field in self.FIELDS:
+                f.write("{0} = {1!r}\n".format(field, getattr(self, field)))
+
+    @classmethod
+    def stack(cls, profiles):
+        # Returns a profile whose parameters are arrays holding the parameters
+        # of each of profiles, in order.
+        profiles = list(profiles)
+        return cls("+".join(p.name for p in profiles),
+                   **dict((field, np.array([getattr(p, field) for p in profiles]))
+                          for field in cls.FIELDS))
+
+    def _key(self):
+        return tuple(getattr(self, field) for field in self.FIELDS)
+
+    def __eq__(self, other):
+        return isinstance(other, MachineProfile) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        return dict(self.values(), name=self.name)
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            object.__setattr__(self, k, v)
+
+    def __repr__(self):
+        return "MachineProfile({0!r})".format(self.name)
+
+# The profile described by params.py.
+DEFAULT = MachineProfile()
+
+def profile_of(ctx):
+    # Returns the machine profile of an evaluation context.
+    return ctx.get("profile", DEFAULT)
+
+def lanes_of(ctx):
+    # Returns the number of lanes the innermost enclosing loop processes per
+    # iteration: its stride if the SIMD model is on (see params.SIMD_WIDTH),
+    # else 1.
+    nest = ctx.get("nest")
+    if not nest:
+        return 1
+    return where(profile_of(ctx).SIMD_WIDTH > 0, nest[-1].stride, 1)
+
+def threads_of(ctx):
+    # Returns the number of threads running the loop being costed. Unless a
+    # thread count is given, every core is assumed to run a copy of it.
+    threads = ctx.get("threads")
+    if threads is None:
+        return profile_of(ctx).CORES
+    return threads
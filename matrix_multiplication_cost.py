@@ -20,34 +20,32 @@ version, for sufficiently large N.
 
 """
 
+import argparse
+
 from expressions import *
 from cost_with_bandwidth import *
+from sweep import grid, sweep
 
 def print_result(name, value):
     print "{0}: {1}".format(name, value)
 
-for b in [128]:
-  print "----- {0} -----".format(b)
-  for n in [128, 256, 512, 1024, 2048]:
-    print "n={0}, block_size={1}".format(n, b)
+def costs(n, b):
+    # Returns the costs of the transposed, unblocked and blocked loops for
+    # n x n matrices and blocks of b x b.
 
     # Loop 0 (transposed).
     k_loop = For(n, Id("k"), 1, Add(Lookup("C", [Id("i"), Id("j")]),
                                     Multiply(Lookup("A", [Id("i"), Id("k")]),
                                              Lookup("B", [Id("j"), Id("k")]))))
     j_loop = For(n, Id("j"), 1, k_loop)
-    i_loop = For(n, Id("i"), 1, j_loop)
-    c = cost(i_loop)
-    print_result("Transposed", c)
+    transposed = For(n, Id("i"), 1, j_loop)
 
     # Loop 1 (unblocked).
     k_loop = For(n, Id("k"), 1, Add(Lookup("C", [Id("i"), Id("j")]),
                                     Multiply(Lookup("A", [Id("i"), Id("k")]),
                                              Lookup("B", [Id("k"), Id("j")]))))
     j_loop = For(n, Id("j"), 1, k_loop)
-    i_loop = For(n, Id("i"), 1, j_loop)
-    c = cost(i_loop)
-    print_result("Unblocked", c)
+    unblocked = For(n, Id("i"), 1, j_loop)
 
     # Loop 2 (blocked).
     k_loop = For(b, Id("k"), 1, Add(Lookup("C", [Id("i"), Id("j")]),
@@ -56,6 +54,27 @@ for b in [128]:
     j_loop = For(b, Id("j"), 1, k_loop)
     i_loop = For(n, Id("i"), 1, j_loop)
     jj_loop = For(n, Id("jj"), b, i_loop)
-    kk_loop = For(n, Id("kk"), b, jj_loop)
-    c = cost(kk_loop)
-    print_result("Blocked", c)
+    blocked = For(n, Id("kk"), b, jj_loop)
+
+    return [("Transposed", hashcons(transposed)),
+            ("Unblocked", hashcons(unblocked)),
+            ("Blocked", hashcons(blocked))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost blocked and unblocked matrix multiplications")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-o", "--output", default=None,
+        help="File to write the results to, one row per point and plan")
+    args = parser.parse_args()
+
+    points = grid([("b", [128]),
+                   ("n", [128, 256, 512, 1024, 2048])])
+    for point, results in sweep(costs, points, args.processes, output=args.output,
+                                columns=["b", "n"]):
+        b, n = point["b"], point["n"]
+        if n == 128:
+            print "----- {0} -----".format(b)
+        print "n={0}, block_size={1}".format(n, b)
+        for label, c in results:
+            print_result(label, c)
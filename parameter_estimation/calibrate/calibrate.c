@@ -0,0 +1,271 @@
+/**
+ * calibrate.c
+ *
+ * Microbenchmarks for the machine parameters of the cost model. Each result
+ * is printed on a line of the form
+ *
+ *  >>> <name> <working set in bytes> <value>
+ *
+ * and fitted into a machine profile by calibrate.py in the root of this repo.
+ *
+ */
+
+#ifdef __linux__
+#define _GNU_SOURCE
+#endif
+
+#include <stdlib.h>
+#include <stdio.h>
+#include <stdint.h>
+#include <string.h>
+#include <unistd.h>
+#include <time.h>
+
+#include <omp.h>
+
+// A node of the pointer chasing benchmark, padded to a cache line so that
+// every access touches a different line.
+struct node {
+    struct node *next;
+    char pad[64 - sizeof(struct node *)];
+};
+
+double now() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+// Keeps the compiler from optimizing results away.
+volatile uint64_t sink;
+
+/** Returns the clock frequency in Hz, measured with a chain of dependent adds
+ * (one add retires per cycle).
+ */
+double clock_frequency(long iterations) {
+    uint64_t x = 0;
+    double start = now();
+    for (long i = 0; i < iterations; i++) {
+        // Eight dependent adds per iteration hide the loop overhead.
+        x += i; __asm__ volatile("" : "+r"(x));
+        x += i; __asm__ volatile("" : "+r"(x));
+        x += i; __asm__ volatile("" : "+r"(x));
+        x += i; __asm__ volatile("" : "+r"(x));
+        x += i; __asm__ volatile("" : "+r"(x));
+        x += i; __asm__ volatile("" : "+r"(x));
+        x += i; __asm__ volatile("" : "+r"(x));
+        x += i; __asm__ volatile("" : "+r"(x));
+    }
+    double elapsed = now() - start;
+    sink = x;
+    return iterations * 8 / elapsed;
+}
+
+/** Returns the latency of a dependent load in seconds, for a random cyclic
+ * walk over a working set of size bytes.
+ */
+double chase_latency(size_t size, long accesses) {
+    size_t n = size / sizeof(struct node);
+    if (n < 2) {
+        n = 2;
+    }
+    struct node *nodes = (struct node *)malloc(sizeof(struct node) * n);
+    size_t *order = (size_t *)malloc(sizeof(size_t) * n);
+
+    // Sattolo's algorithm: a random permutation with a single cycle.
+    for (size_t i = 0; i < n; i++) {
+        order[i] = i;
+    }
+    for (size_t i = n - 1; i > 0; i--) {
+        size_t j = random() % i;
+        size_t t = order[i];
+        order[i] = order[j];
+        order[j] = t;
+    }
+    for (size_t i = 0; i < n; i++) {
+        nodes[order[i]].next = &nodes[order[(i + 1) % n]];
+    }
+
+    // Warm up.
+    struct node *p = &nodes[0];
+    for (size_t i = 0; i < n; i++) {
+        p = p->next;
+    }
+
+    double start = now();
+    for (long i = 0; i < accesses; i++) {
+        p = p->next;
+    }
+    double elapsed = now() - start;
+    sink = (uint64_t)p;
+
+    free(order);
+    free(nodes);
+    return elapsed / accesses;
+}
+
+/** Returns the aggregate read throughput in bytes/second of threads threads
+ * repeatedly summing a working set of size bytes, split between them.
+ */
+double stream_throughput(size_t size, size_t total, int threads) {
+    size_t n = size / threads / sizeof(uint64_t);
+    if (n < 64) {
+        n = 64;
+    }
+    long passes = total / (n * sizeof(uint64_t) * threads) + 1;
+    double elapsed = 0.0;
+
+#pragma omp parallel num_threads(threads)
+    {
+        // Allocated by each thread, so pages are local to it.
+        uint64_t *a = (uint64_t *)malloc(sizeof(uint64_t) * n);
+        for (size_t i = 0; i < n; i++) {
+            a[i] = i;
+        }
+        uint64_t sum = 0;
+#pragma omp barrier
+#pragma omp master
+        elapsed = now();
+#pragma omp barrier
+        for (long k = 0; k < passes; k++) {
+            for (size_t i = 0; i < n; i++) {
+                sum += a[i];
+            }
+            __asm__ volatile("" : "+r"(sum));
+        }
+#pragma omp barrier
+#pragma omp master
+        elapsed = now() - elapsed;
+        sink = sum;
+        free(a);
+    }
+    return (double)passes * n * sizeof(uint64_t) * threads / elapsed;
+}
+
+/** Returns the time per element, in seconds, of adding one array into another
+ * in each of threads threads. If atomic is set, the adds are atomic. Each
+ * thread updates its own array unless shared is set, in which case all threads
+ * update the same array of n elements.
+ */
+double add_time(size_t n, long total, int threads, int atomic, int shared) {
+    int64_t *a = (int64_t *)malloc(sizeof(int64_t) * n);
+    int64_t *shared_b = (int64_t *)calloc(n, sizeof(int64_t));
+    for (size_t i = 0; i < n; i++) {
+        a[i] = random();
+    }
+    long passes = total / n + 1;
+    double elapsed = 0.0;
+
+#pragma omp parallel num_threads(threads)
+    {
+        // Private arrays are padded apart to avoid false sharing.
+        int64_t *b = shared ? shared_b : (int64_t *)calloc(n + 16, sizeof(int64_t));
+#pragma omp barrier
+#pragma omp master
+        elapsed = now();
+#pragma omp barrier
+        for (long k = 0; k < passes; k++) {
+            if (atomic) {
+                for (size_t i = 0; i < n; i++) {
+                    __sync_fetch_and_add(&b[i], a[i]);
+                }
+            } else {
+                for (size_t i = 0; i < n; i++) {
+                    b[i] += a[i];
+                }
+            }
+            __asm__ volatile("" : : "r"(b) : "memory");
+        }
+#pragma omp barrier
+#pragma omp master
+        elapsed = now() - elapsed;
+        if (!shared) {
+            free(b);
+        }
+    }
+    free(shared_b);
+    free(a);
+    return elapsed / ((double)passes * n);
+}
+
+/** Returns the time per iteration, in seconds, of a loop with a branch taken
+ * for values below 128, over n bytes that are either random or sorted.
+ */
+__attribute__((optimize("no-if-conversion", "no-if-conversion2", "no-tree-vectorize")))
+double branch_time(size_t n, long total, int sorted) {
+    uint8_t *data = (uint8_t *)malloc(n);
+    for (size_t i = 0; i < n; i++) {
+        data[i] = sorted ? (uint8_t)(i * 256 / n) : (uint8_t)random();
+    }
+    long passes = total / n + 1;
+    uint64_t sum = 0;
+
+    double start = now();
+    for (long k = 0; k < passes; k++) {
+        for (size_t i = 0; i < n; i++) {
+            if (data[i] < 128) {
+                sum += data[i];
+                __asm__ volatile("" : "+r"(sum));
+            }
+        }
+    }
+    double elapsed = now() - start;
+    sink = sum;
+    free(data);
+    return elapsed / ((double)passes * n);
+}
+
+int main(int argc, char **argv) {
+    // Comma separated working set sizes in bytes.
+    char *sizes = strdup("32768,1048576,16777216,268435456");
+    // Number of threads for the multi-threaded benchmarks.
+    int threads = omp_get_max_threads();
+    // Scales the amount of work done by every benchmark.
+    double scale = 1.0;
+
+    int ch;
+    while ((ch = getopt(argc, argv, "w:t:s:")) != -1) {
+        switch (ch) {
+            case 'w':
+                sizes = strdup(optarg);
+                break;
+            case 't':
+                threads = atoi(optarg);
+                break;
+            case 's':
+                scale = atof(optarg);
+                break;
+            case '?':
+            default:
+                fprintf(stderr, "invalid options");
+                exit(1);
+        }
+    }
+
+    printf(">>> threads 0 %d\n", threads);
+    printf(">>> clock 0 %f\n", clock_frequency((long)(5e7 * scale)));
+
+    size_t size = 0;
+    for (char *s = strtok(sizes, ","); s != NULL; s = strtok(NULL, ",")) {
+        size = strtoull(s, NULL, 10);
+        printf(">>> latency %zu %e\n", size, chase_latency(size, (long)(2e6 * scale)));
+        printf(">>> throughput %zu %e\n", size,
+                stream_throughput(size, (size_t)(1e9 * scale), threads));
+        fflush(stdout);
+    }
+    // The throughput a single thread gets from the largest working set.
+    printf(">>> core_throughput %zu %e\n", size,
+            stream_throughput(size, (size_t)(1e9 * scale), 1));
+
+    // Small arrays, so the adds run from L1.
+    long adds = (long)(2e7 * scale);
+    printf(">>> add 0 %e\n", add_time(1024, adds, threads, 0, 0));
+    printf(">>> atomic_add 0 %e\n", add_time(1024, adds, threads, 1, 0));
+    printf(">>> contended_atomic_add 8 %e\n", add_time(8, adds, threads, 1, 1));
+
+    long branches = (long)(5e7 * scale);
+    printf(">>> sorted_branch 0 %e\n", branch_time(1 << 16, branches, 1));
+    printf(">>> random_branch 0 %e\n", branch_time(1 << 16, branches, 0));
+
+    return 0;
+}
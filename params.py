@@ -33,6 +33,11 @@ L2_THROUGHPUT   = 350E9
 L3_THROUGHPUT   = 120E9
 MEM_THROUGHPUT  = 55E9
 
+# Memory throughput a single core can reach on its own. Threads share
+# MEM_THROUGHPUT, so a scan stops getting faster with more threads once they
+# use it all up.
+MEM_THROUGHPUT_PER_CORE = 12E9
+
 # Cache sizes in *blocks/lines*
 L1_SIZE         = 500
 L2_SIZE         = 4000
@@ -41,12 +46,66 @@ L3_SIZE         = 720000
 # Cache line size in bytes.
 CACHE_LINE_SIZE = 64
 
+# Associativity (ways per set) of each cache. The analytic model treats caches
+# as fully associative; these are only used by the cache simulator (see
+# cachesim.py).
+L1_WAYS = 8
+L2_WAYS = 8
+L3_WAYS = 16
+
 # Memory Latencies
 L1_LATENCY = 1
 L2_LATENCY = 7
 L3_LATENCY = 19
 MEM_LATENCY = 36
 
+# Number of cache misses a core can have in flight (line fill buffers).
+# Independent random lookups overlap their latencies up to this many at a time,
+# and chains of dependent lookups (A[B[i]]) share them. 1 means misses are
+# served one at a time; recent x86 cores have 10-12.
+LINE_FILL_BUFFERS = 1
+
+# ************************* Prefetcher Parameters  *************************
+
+"""
+The hardware prefetcher follows sequential and constant-stride streams of
+accesses (see expressions.access_pattern) and fetches their lines ahead of use.
+With PREFETCH_STREAMS = 0 the prefetcher isn't modeled, and lookups are costed
+as sequential (bandwidth) or random (latency) accesses.
+"""
+
+# Number of streams the prefetcher can follow at once; 0 disables the model.
+PREFETCH_STREAMS = 0
+
+# How many lines ahead of the current access the prefetcher fetches.
+PREFETCH_DISTANCE = 16
+
+# The largest stride, in bytes, the prefetcher detects. Prefetchers don't
+# cross page boundaries.
+PREFETCH_MAX_STRIDE = 2048
+
+# ************************* NUMA Parameters  *************************
+
+"""
+Instructions (Linux):
+
+    Sockets: lscpu, NUMA node(s)
+    Remote latency: run the memory latency benchmark under
+        numactl --cpunodebind=0 --membind=1
+
+Caches sizes are per socket, MEM_LATENCY is the latency of the local node and
+MEM_THROUGHPUT is the total over all nodes.
+"""
+
+# Number of sockets (NUMA nodes). The cores are spread evenly across them.
+SOCKETS = 1
+
+# Latency of an access to memory on another socket.
+REMOTE_MEM_LATENCY = 60
+
+# Throughput of the interconnect between sockets, for all remote accesses.
+INTERCONNECT_THROUGHPUT = 40E9
+
 # ************************* Instruction Parameters *************************
 
 # Latency of a standard binary op (+ - / * >= etc.)
@@ -54,10 +113,63 @@ BINOP_LATENCY = 1
 # Latency of a vectorized binary op (+ - / * >= etc.)
 BINOP_VEC_LATENCY = 4
 
+# Latencies of multiplications and divisions (including Mod), scalar and
+# vectorized. They default to the latencies of other ops; on recent x86 cores a
+# multiply takes 3-5 cycles and a division 20 or more.
+MUL_LATENCY = 1
+MUL_VEC_LATENCY = 4
+DIV_LATENCY = 1
+DIV_VEC_LATENCY = 4
+
+"""
+Vectorization: a loop with stride s > 1 processes s lanes per iteration. By
+default the only difference this makes is BINOP_VEC_LATENCY. With SIMD_WIDTH set
+to the width of a vector register (16 for SSE, 32 for AVX2, 64 for AVX-512),
+vectorized loops are costed lane by lane:
+    - vector ops wider than a register take several instructions,
+    - lookups load every lane; a lookup through an index loaded from memory is
+      a gather, costing GATHER_LANE_LATENCY per lane,
+    - a VecMerger update is a scatter, costing SCATTER_LANE_LATENCY per lane,
+      and lanes updating the same element are merged one after the other,
+    - an If evaluates both branches under masks, costing MASK_LATENCY to blend
+      them instead of a branch.
+"""
+# Width of a vector register in bytes; 0 disables the lane-by-lane model.
+SIMD_WIDTH = 0
+# Cost of each lane of a gather.
+GATHER_LANE_LATENCY = 1.0
+# Cost of each lane of a scatter.
+SCATTER_LANE_LATENCY = 2.0
+# Cost of blending the results of a masked If.
+MASK_LATENCY = 1
+
+"""
+Port pressure: by default the CPU cost of a loop body is the sum of the
+latencies of its ops. With PORT_MODEL set to 1, ops are costed by the execution
+ports they issue to instead, as on an out-of-order core: an iteration costs the
+larger of the critical path through the body's dataflow (the longest chain of
+dependent ops, by latency) and the cycles the busiest kind of port needs to
+issue its ops. Ops issue to the MUL ports (multiplications), DIV ports
+(divisions and Mod), VEC ports (other vectorized ops), ALU ports (other scalar
+ops) and lookups to the LOAD ports. A port count below 1 models a unit that
+isn't pipelined, e.g. DIV_PORTS = 1.0 / 20 for a divider that accepts an op
+every 20 cycles. Updates to global VecMergers keep their summed latencies.
+"""
+# 1 enables the port model.
+PORT_MODEL = 0
+# Number of ports of each kind.
+ALU_PORTS = 4
+MUL_PORTS = 1
+DIV_PORTS = 1
+VEC_PORTS = 3
+LOAD_PORTS = 2
+
 # Latency of an atomic add with no contention.
 ATOMICADD_LATENCY = 7.0
 # Penalty of contention for an atomic add.
 ATOMICADD_PENALTY = 8.5
+# Penalty of contention for an atomic add with a core on another socket.
+REMOTE_ATOMICADD_PENALTY = 20.0
 
 # Given a constant condition, The number of branches fall a certain way for the
 # branch predictor to predict it correctly subsequently.
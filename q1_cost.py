@@ -22,10 +22,14 @@ Things to model that are new:
     - Writes in VecMergers
 """
 
+import argparse
+import functools
+
 from expressions import *
 from cost_with_bandwidth import cost
-
-import params
+from explain import explain
+from machine import DEFAULT
+from sweep import grid, sweep
 
 # An ID referring to the struct at the current loop index.
 lineId = Id("line")
@@ -55,9 +59,12 @@ def print_result_parsable(name, value, b, p, iterations):
     s += str(p)
     print s
 
-def costForQuery(b, p, iterations, globalTable):
+def queryLoops(b, p, iterations, globalTable, profile):
+    # Returns the loops of the query with either a global or a local table, as
+    # [(loop, number of times it runs)]: the aggregation, then the merge of
+    # the per-thread tables into the result.
 
-    iterations = iterations / params.CORES
+    iterations = iterations / profile.CORES
 
     mergeExpr = StructLiteral([
             Add(GetField(lineId, 0), GetField(builderId, 0)),
@@ -69,7 +76,7 @@ def costForQuery(b, p, iterations, globalTable):
             ])
 
     # (line.4 > n)
-    vecMergerSize = b * params.CORES if not globalTable else b
+    vecMergerSize = b * profile.CORES if not globalTable else b
     condition = GreaterThan(GetField(lineId, 4), Literal())
     branch = If(condition, VecMergerMerge(Vector("B", vecMergerSize), mergeIndex, mergeExpr, BUCKET_SIZE, globalTable), Literal())
     # Set the selectivity of the branch.
@@ -77,41 +84,67 @@ def costForQuery(b, p, iterations, globalTable):
     loopVar = Id("i")
     # Construct the loop body - use Let statements to get the structs into variables.
     loopBody = Let(lineId, Lookup("V", loopVar, BUCKET_SIZE), branch)
-    expr = For(iterations, Id("i"), 1, loopBody)
-
-    c = cost(expr)
+    # Interning the loop shares its repeated subtrees, e.g. the GetFields of
+    # the merge expression.
+    expr = hashcons(For(iterations, Id("i"), 1, loopBody))
 
     if globalTable:
-        label = "Global"
-        result = FixedCostExpr(10000)
-        resCost = cost(result)
+        result = FixedCostExpr.make(10000)
+        return [(expr, 1), (result, 1)]
     else:
-        label = "Local"
         # TODO switch this to use VecMergerResult. This for loop represents the
         # merging of the global tables. This is also slightly broken because
         # the  fixed cost of merging the results isn't 1...it's much higher
         # than that.
         resBody = Let(lineId, Lookup("V", Id("r"), BUCKET_SIZE), mergeExpr)
-        result = For(b, Id("r"), 1, Add(Lookup("br", Id("r"), BUCKET_SIZE),
-            resBody))
-        resCost = cost(result) * (params.CORES)
-
-    print_result(label, c + resCost)
-    print_result_parsable(label, c + resCost, b, p, iterations * params.CORES)
-
-for b in [int(x) for x in [1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8]]:
-    print "----- {0} -----".format(b)
-    for p in [0.01, 1.0]:
-        print "n={0}, b={1}, p={2}".format(iterations, b, p)
-        # The merge expression loads the value in the builder for each struct field and
-        # adds it to a new value generated during this loop iteration.
-        #
-        # [
-        #   line.0 + b.0,
-        #   line.1 + b.1,
-        #   line.2 + b.2,
-        #   line.1 * ( n - line.2) + b.3,
-        #   (line.1 * (1 - line.2)) * (1 + line.3) + b.4
-        #   1 + b.5
-        costForQuery(b, p, iterations, True)
-        costForQuery(b, p, iterations, False)
+        result = hashcons(For(b, Id("r"), 1, Add(Lookup("br", Id("r"), BUCKET_SIZE),
+            resBody)))
+        return [(expr, 1), (result, profile.CORES)]
+
+def costForQuery(b, p, iterations, globalTable, profile):
+    # Returns the cost of the query with either a global or a local table.
+    (expr, _), (result, times) = queryLoops(b, p, iterations, globalTable, profile)
+    return cost(expr, profile) + cost(result, profile) * times
+
+def costs(b, p, n):
+    # The merge expression loads the value in the builder for each struct field and
+    # adds it to a new value generated during this loop iteration.
+    #
+    # [
+    #   line.0 + b.0,
+    #   line.1 + b.1,
+    #   line.2 + b.2,
+    #   line.1 * ( n - line.2) + b.3,
+    #   (line.1 * (1 - line.2)) * (1 + line.3) + b.4
+    #   1 + b.5
+    return [("Global", functools.partial(costForQuery, b, p, n, True)),
+            ("Local", functools.partial(costForQuery, b, p, n, False))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost Q1 over a grid of b and p")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-o", "--output", default=None,
+        help="File to write the results to, one row per point and plan")
+    parser.add_argument("--explain", action="store_true",
+        help="Break the cost of each plan down by node and term")
+    args = parser.parse_args()
+
+    points = grid([("b", [int(x) for x in [1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8]]),
+                   ("p", [0.01, 1.0]),
+                   ("n", [iterations])])
+    for point, results in sweep(costs, points, args.processes, output=args.output,
+                                columns=["b", "p", "n"]):
+        b, p, n = point["b"], point["p"], point["n"]
+        if p == 0.01:
+            print "----- {0} -----".format(b)
+        print "n={0}, b={1}, p={2}".format(n, b, p)
+        for label, c in results:
+            print_result(label, c)
+            print_result_parsable(label, c, b, p, n)
+        if args.explain:
+            for label, globalTable in (("Global", True), ("Local", False)):
+                for loop, times in queryLoops(b, p, n, globalTable, DEFAULT):
+                    if isinstance(loop, For):
+                        print "{0} (runs {1} times):".format(label, times)
+                        print explain(loop, DEFAULT)
@@ -20,6 +20,8 @@
 
 #include <omp.h>
 
+#include "perf_counters.h"
+
 // Value for the predicate to pass.
 #define PASS 100
 
@@ -320,13 +322,19 @@ int main(int argc, char **argv) {
 
     printf("n=%d, b=%d, p=%f\n", num_items, num_buckets, prob);
 
+    // Opened before any thread is created, so the counters follow them all.
+    struct perf_counters pc;
+    perf_counters_open(&pc);
+
     struct gen_data d = generate_data(num_items, num_orders, num_customers, num_buckets, prob);
     long sum;
     struct timeval start, end, diff;
 
+    perf_counters_start(&pc);
     gettimeofday(&start, 0);
     run_query_local_table(&d);
     gettimeofday(&end, 0);
+    perf_counters_stop(&pc);
     timersub(&end, &start, &diff);
     printf("Local: %ld.%06ld (result=%d)\n",
             (long) diff.tv_sec, (long) diff.tv_usec,
@@ -337,13 +345,16 @@ int main(int argc, char **argv) {
             d.buckets[0].revenue,
             (long) diff.tv_sec, (long) diff.tv_usec,
             num_items, num_buckets, prob);
+    perf_counters_print(&pc, "Local");
 
     // Reset the buckets.
     memset(d.buckets, 0, sizeof(struct q3_entry) * d.num_buckets);
 
+    perf_counters_start(&pc);
     gettimeofday(&start, 0);
     run_query_global_table(&d);
     gettimeofday(&end, 0);
+    perf_counters_stop(&pc);
     timersub(&end, &start, &diff);
     printf("Global: %ld.%06ld (result=%d)\n",
             (long) diff.tv_sec, (long) diff.tv_usec,
@@ -354,6 +365,7 @@ int main(int argc, char **argv) {
             d.buckets[0].revenue,
             (long) diff.tv_sec, (long) diff.tv_usec,
             num_items, num_buckets, prob);
+    perf_counters_print(&pc, "Global");
 
     return 0;
 }
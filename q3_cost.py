@@ -22,8 +22,14 @@ Things to model that are new:
     - Writes in VecMergers
 """
 
+import argparse
+import functools
+
 from expressions import *
 from cost_with_bandwidth import cost
+from sweep import grid, sweep
+
+import params
 
 CORES = 4
 
@@ -57,7 +63,8 @@ def print_result_parsable(name, value, b, p, iterations):
     s += str(p)
     print s
 
-def costForQuery(b, p, iterations, globalTable):
+def costForQuery(b, p, iterations, globalTable, profile):
+    # Returns the cost of the query with either a global or a local table.
     iterations = iterations / CORES
     loopVar = Id("i")
 
@@ -86,41 +93,54 @@ def costForQuery(b, p, iterations, globalTable):
     # Set the selectivity of the branch.
     branch.selectivity = p
     # Construct the loop body - use Let statements to get the structs into variables.
-    expr = For(iterations, loopVar, 1, loopBody)
+    expr = hashcons(For(iterations, loopVar, 1, loopBody))
 
-    c = cost(expr)
-    print c
+    c = cost(expr, profile)
 
     if globalTable:
-        label = "Global"
-        result = FixedCostExpr(10000)
-        resCost = cost(result)
+        result = FixedCostExpr.make(10000)
+        resCost = cost(result, profile)
     else:
-        label = "Local"
         # TODO switch this to use VecMergerResult. This for loop represents the
         # merging of the global tables. This is also slightly broken because
         # the  fixed cost of merging the results isn't 1...it's much higher
         # than that.
-        result = For(b, Id("r"), 1, Add(Lookup("br", Id("r"), BUCKET_SIZE), FixedCostExpr(2)))  # TODO: Check me
-        resCost = cost(result) * (CORES + 1)
-        print resCost
-
-    print_result(label, c + resCost)
-    print_result_parsable(label, c + resCost, b, p, iterations * params.CORES)
-
-for b in [10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000]:
-    print "----- {0} -----".format(b)
-    for p in [0.01, 0.1, 0.5, 0.75, 1.0]:
-        print "n={0}, b={1}, p={2}".format(iterations, b, p)
-        # The merge expression loads the value in the builder for each struct field and
-        # adds it to a new value generated during this loop iteration.
-        #
-        # [
-        #   line.0 + b.0,
-        #   line.1 + b.1,
-        #   line.2 + b.2,
-        #   line.1 * ( n - line.2) + b.3,
-        #   (line.1 * (1 - line.2)) * (1 + line.3) + b.4
-        #   1 + b.5
-        costForQuery(b, p, iterations, True)
-        costForQuery(b, p, iterations, False)
+        result = hashcons(For(b, Id("r"), 1, Add(Lookup("br", Id("r"), BUCKET_SIZE), FixedCostExpr(2))))  # TODO: Check me
+        resCost = cost(result, profile) * (CORES + 1)
+
+    return c + resCost
+
+def costs(b, p, n):
+    # The merge expression loads the value in the builder for each struct field and
+    # adds it to a new value generated during this loop iteration.
+    #
+    # [
+    #   line.0 + b.0,
+    #   line.1 + b.1,
+    #   line.2 + b.2,
+    #   line.1 * ( n - line.2) + b.3,
+    #   (line.1 * (1 - line.2)) * (1 + line.3) + b.4
+    #   1 + b.5
+    return [("Global", functools.partial(costForQuery, b, p, n, True)),
+            ("Local", functools.partial(costForQuery, b, p, n, False))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost Q3 over a grid of b and p")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-o", "--output", default=None,
+        help="File to write the results to, one row per point and plan")
+    args = parser.parse_args()
+
+    points = grid([("b", [10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000]),
+                   ("p", [0.01, 0.1, 0.5, 0.75, 1.0]),
+                   ("n", [iterations])])
+    for point, results in sweep(costs, points, args.processes, output=args.output,
+                                columns=["b", "p", "n"]):
+        b, p, n = point["b"], point["p"], point["n"]
+        if p == 0.01:
+            print "----- {0} -----".format(b)
+        print "n={0}, b={1}, p={2}".format(n, b, p)
+        for label, c in results:
+            print_result(label, c)
+            print_result_parsable(label, c, b, p, n / CORES * params.CORES)
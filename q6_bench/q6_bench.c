@@ -29,6 +29,8 @@
 #include <unistd.h>
 #include <sys/time.h>
 
+#include "perf_counters.h"
+
 #include <immintrin.h>
 
 #define PASS 200
@@ -195,36 +197,48 @@ int main(int argc, char **argv) {
 
     printf("vs=%d, sel=%f\n", vs, sel); 
 
+    struct perf_counters pc;
+    perf_counters_open(&pc);
+
     struct gen_data d = load_data(vs, n, sel);
     long sum;
     struct timeval start, end, diff;
 
+    perf_counters_start(&pc);
     gettimeofday(&start, 0);
     sum = branched_scalar_query(&d);
     gettimeofday(&end, 0);
+    perf_counters_stop(&pc);
     timersub(&end, &start, &diff);
     printf("Branched: %ld.%06ld (result=%ld)\n",
             (long) diff.tv_sec, (long) diff.tv_usec, sum);
 
     printf(">>> B(result=%ld):%ld.%06ld\t%d\t%d\t%f\n", sum,
             (long) diff.tv_sec, (long) diff.tv_usec, n, vs, sel);
+    perf_counters_print(&pc, "Branched");
 
+    perf_counters_start(&pc);
     gettimeofday(&start, 0);
     sum = nobranch_scalar_query(&d);
     gettimeofday(&end, 0);
+    perf_counters_stop(&pc);
     timersub(&end, &start, &diff);
     printf("No Branch: %ld.%06ld (result=%ld)\n",
             (long) diff.tv_sec, (long) diff.tv_usec, sum);
 
     printf(">>> NB(result=%ld):%ld.%06ld\t%d\t%d\t%f\n", sum,
             (long) diff.tv_sec, (long) diff.tv_usec, n, vs, sel);
+    perf_counters_print(&pc, "No Branch");
 
+    perf_counters_start(&pc);
     gettimeofday(&start, 0);
     sum = vector_pred_query(&d);
     gettimeofday(&end, 0);
+    perf_counters_stop(&pc);
     timersub(&end, &start, &diff);
     printf("Vector: %ld.%06ld (result=%ld)\n",
             (long) diff.tv_sec, (long) diff.tv_usec, sum);
+    perf_counters_print(&pc, "Vector");
 
     return 0;
 }
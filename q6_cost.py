@@ -18,8 +18,11 @@ cost of the first loop for "less-predictable" branches. For
 evaluate to true or false), the first loop should have lower cost
 """
 
+import argparse
+
 from expressions import *
 from cost_with_bandwidth import *
+from sweep import grid, sweep
 
 # Number of lookups
 num_lookups = 4
@@ -53,29 +56,41 @@ def print_result_parsable(name, value, vs, p, iterations):
     s += str(p)
     print s
 
-for v in [1, 10]:
-    print "----- {0} -----".format(v)
-    for s in [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]:
-        print "vs={0}, sel={1}".format(v, s)
-        lookups = get_summed_lookups(v)
-        condition = GreaterThan(Lookup("0", Id("i")), Literal())
-        branch_expr = If(condition, lookups, Literal())
-        branch_expr.selectivity = s
-        branched_loop = For(iterations, Id("i"), 1, branch_expr)
-        predicated_expr = For(iterations, Id("i"), 1, Multiply(condition, lookups))
+def costs(v, s, n):
+    # Returns the costs of the branched, predicated and vectorized loops.
+    lookups = get_summed_lookups(v)
+    condition = GreaterThan(Lookup("0", Id("i")), Literal())
+    branch_expr = If(condition, lookups, Literal())
+    branch_expr.selectivity = s
+    branched_loop = For(n, Id("i"), 1, branch_expr)
+    predicated_expr = For(n, Id("i"), 1, Multiply(condition, lookups))
 
+    vec_lookups = get_summed_lookups(v, 8)
+    vec_condition = GreaterThan(Lookup("0", Id("i")), Literal(), 8)
+    vector_expr = For(n, Id("i"), 8, Multiply(vec_condition, vec_lookups))
 
-        vec_lookups = get_summed_lookups(v, 8)
-        vec_condition = GreaterThan(Lookup("0", Id("i")), Literal(), 8)
-        vector_expr = For(iterations, Id("i"), 8, Multiply(vec_condition, vec_lookups))
+    return [("Branched", hashcons(branched_loop)),
+            ("No Branch", hashcons(predicated_expr)),
+            ("Vector", hashcons(vector_expr))]
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost branched and predicated loops over a grid of vs and sel")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-o", "--output", default=None,
+        help="File to write the results to, one row per point and plan")
+    args = parser.parse_args()
+
+    points = grid([("v", [1, 10]),
+                   ("s", [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]),
+                   ("n", [iterations])])
+    for point, results in sweep(costs, points, args.processes, output=args.output,
+                                columns=["v", "s", "n"]):
+        v, s, n = point["v"], point["s"], point["n"]
+        if s == 0.01:
+            print "----- {0} -----".format(v)
+        print "vs={0}, sel={1}".format(v, s)
         # Compute and Print Costs
-        c = cost(branched_loop)
-        print_result("Branched", c)
-        print_result_parsable("Branched", c, v, s, iterations)
-        c =  cost(predicated_expr)
-        print_result("No Branch", c)
-        print_result_parsable("NoBranch", c, v, s, iterations)
-        c =  cost(vector_expr)
-        print_result("Vector", c)
-        print_result_parsable("Vector", c, v, s, iterations)
+        for label, c in results:
+            print_result(label, c)
+            print_result_parsable(label.replace(" ", ""), c, v, s, n)
@@ -11,6 +11,8 @@
 #include <unistd.h>
 #include <sys/time.h>
 
+#include "perf_counters.h"
+
 struct gen_data {
     // Size of the randomly accessed array.
     size_t k;
@@ -76,16 +78,22 @@ int main(int argc, char **argv) {
     assert(n > 0);
     printf("k=%d, n=%d\n", k, n); 
 
+    struct perf_counters pc;
+    perf_counters_open(&pc);
+
     struct gen_data d = load_data(k, n);
     run_query(&d);
 
     struct timeval start, end, diff;
 
+    perf_counters_start(&pc);
     gettimeofday(&start, 0);
     run_query(&d);
     gettimeofday(&end, 0);
+    perf_counters_stop(&pc);
     timersub(&end, &start, &diff);
     printf("Result: %ld.%06ld (result=%d)\n", (long) diff.tv_sec, (long) diff.tv_usec, d.R[0]);
+    perf_counters_print(&pc, "Result");
 
     return 0;
 }
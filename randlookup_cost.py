@@ -1,15 +1,32 @@
+import argparse
+
 from expressions import *
 from cost_with_bandwidth import *
+from sweep import grid, sweep
 
 def print_result(name, value):
     print "{0}: {1}".format(name, value)
 
 n = 25000000
-for k in [100, 1000, 10000, 100000, 1000000, 10000000, 100000000]:
-  print "----- {0} -----".format(k)
-  print "k={0}, n={1}".format(k, n)
-  loop_body = Add(Lookup(Vector("R", k), Lookup("A", Id("i"))), Literal())
-  loop = For(n, Id("i"), 1, loop_body)
-
-  c = cost(loop)
-  print_result("Result", c)
+
+def costs(k, n):
+    # Returns the cost of n random lookups into a vector of k elements.
+    loop_body = Add(Lookup(Vector("R", k), Lookup("A", Id("i"))), Literal())
+    return [("Result", hashcons(For(n, Id("i"), 1, loop_body)))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost random lookups over a range of vector sizes")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-o", "--output", default=None,
+        help="File to write the results to, one row per point and plan")
+    args = parser.parse_args()
+
+    points = grid([("k", [100, 1000, 10000, 100000, 1000000, 10000000, 100000000]),
+                   ("n", [n])])
+    for point, results in sweep(costs, points, args.processes, output=args.output,
+                                columns=["k", "n"]):
+        print "----- {0} -----".format(point["k"])
+        print "k={0}, n={1}".format(point["k"], point["n"])
+        for label, c in results:
+            print_result(label, c)
@@ -0,0 +1,120 @@
+# Checks that the costs of a set of small plans don't change.
+"""
+Costs a handful of small plans, each built the way the drivers build them, and
+compares the costs with the ones recorded in a baseline file. Each plan is
+costed both as built and after hashcons, which must agree: interning shares
+equal subtrees but must not change what the model counts, e.g. two separately
+built Lookup("A", i) nodes read two different vectors and stay two lookups.
+
+    $ python regression.py --check data/baseline_costs.json
+
+The plans only use nodes and annotations the original model already had, so
+data/baseline_costs.json holds the costs it gave them. --save writes a new
+baseline file after an intended change to the model.
+"""
+
+import argparse
+import json
+import sys
+
+from cost_with_bandwidth import cost
+from expressions import *
+
+def repeated_lookup():
+    # Two lookups of A[i], each of its own vector.
+    i = Id("i")
+    return For(1e6, i, 1, Add(Lookup("A", i), Lookup("A", i)))
+
+def shared_vector():
+    # Two lookups of the same A[i].
+    i = Id("i")
+    a = Vector("A", 1e6)
+    return For(1e6, i, 1, Add(Lookup(a, i), Lookup(a, i)))
+
+def branch():
+    # A[i] read both outside and inside a branch.
+    i = Id("i")
+    a = Vector("A", 1e6)
+    e = If(GreaterThan(Lookup(a, i), Literal()), Lookup("A", i), Literal())
+    e.selectivity = 0.3
+    return For(1e7, i, 1, Add(Lookup("A", i), e))
+
+def q6():
+    # The TPC-H Q6 loop.
+    i = Id("i")
+    n = 1e7
+    shipdates, discounts = Vector("shipdates", n), Vector("discounts", n)
+    quantities, prices = Vector("quantities", n), Vector("prices", n)
+    condition = LogicalAnd(LogicalAnd(GreaterThan(Lookup(shipdates, i), Literal()),
+                                      GreaterThan(Lookup(discounts, i), Literal())),
+                           GreaterThan(Lookup(quantities, i), Literal()))
+    e = If(condition, Add(Literal(), Multiply(Lookup(prices, i), Lookup(discounts, i))), Literal())
+    e.selectivity = 0.1
+    return For(n, i, 1, e)
+
+def randlookup():
+    # R[A[i]] for a random A.
+    i = Id("i")
+    return For(1e7, i, 1, Add(Lookup(Vector("R", 1e6), Lookup("A", i)), Literal()))
+
+def matrix_multiplication():
+    # C = A * B, naively.
+    i, j, k = Id("i"), Id("j"), Id("k")
+    n = 1000
+    a, b = Vector("A", n * n), Vector("B", n * n)
+    return For(n, i, 1, For(n, j, 1, For(n, k, 1,
+        Multiply(Lookup(a, [i, k]), Lookup(b, [k, j])))))
+
+def swapped_loops():
+    # A column-major traversal of a row-major matrix.
+    i, j = Id("i"), Id("j")
+    a = Vector("A", 1e8)
+    return For(1e4, j, 1, For(1e4, i, 1, Add(Lookup(a, [i, j]), Literal())))
+
+PLANS = [
+    ("repeated_lookup", repeated_lookup),
+    ("shared_vector", shared_vector),
+    ("branch", branch),
+    ("q6", q6),
+    ("randlookup", randlookup),
+    ("matrix_multiplication", matrix_multiplication),
+    ("swapped_loops", swapped_loops),
+]
+
+def costs():
+    # Returns {plan: (cost as built, cost after hashcons)}.
+    return dict((name, (cost(build()), cost(hashcons(build())))) for name, build in PLANS)
+
+def regressions(result, baseline, tolerance=1e-9):
+    # Returns a message for each plan whose costs differ from the baseline or
+    # from each other.
+    messages = []
+    for name in sorted(result):
+        built, interned = result[name]
+        if abs(built - interned) > tolerance * abs(built):
+            messages.append("{0}: costs {1:.2f} as built but {2:.2f} after hashcons".format(name, built, interned))
+        if name in baseline and abs(built - baseline[name]) > tolerance * abs(baseline[name]):
+            messages.append("{0}: cost changed from {1:.2f} to {2:.2f}".format(name, baseline[name], built))
+    return messages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the costs of a set of small plans")
+    parser.add_argument("--save", default=None,
+        help="Write the costs to this baseline file")
+    parser.add_argument("--check", default=None,
+        help="Fail if the costs differ from the ones in this baseline file")
+    args = parser.parse_args()
+
+    result = costs()
+    for name, _ in PLANS:
+        print "{0:<24}{1:>20.2f}{2:>20.2f}".format(name, *result[name])
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(dict((name, c) for name, (c, _) in result.iteritems()), f, indent=2, sort_keys=True)
+    if args.check:
+        with open(args.check) as f:
+            messages = regressions(result, json.load(f))
+        for message in messages:
+            print >>sys.stderr, message
+        if messages:
+            sys.exit(1)
@@ -0,0 +1,149 @@
+# Append-only binary results files.
+"""
+Sweeps write one row per (point, plan): the point's parameters, the plan label
+and its cost. Rows are fixed-size little-endian records, described by a header
+at the start of the file:
+
+    CBORES1\n
+    <4 byte header length><JSON list of [column name, NumPy dtype]>
+    <rows>
+
+Writing only needs the struct module. Reading maps the file with NumPy, so the
+columns are views of the file with no parsing and no copy, and large files can
+be aggregated in fixed-size chunks. A file cut short by an interrupted sweep is
+still readable; a partly written last row is ignored. Opening an existing file
+with the same columns appends to it.
+
+String columns have a fixed width, so writing a longer value raises a
+ValueError rather than truncating it. Size them with column_type from every
+value the column will hold.
+"""
+
+import json
+import numbers
+import os
+import struct
+
+from arith import np
+
+MAGIC = "CBORES1\n"
+
+# Column types, as NumPy dtypes and struct formats.
+_FORMATS = {"<i8": "q", "<f8": "d"}
+
+def _struct_format(dtype):
+    if dtype.startswith("S"):
+        return dtype[1:] + "s"
+    return _FORMATS[dtype]
+
+def column_type(value, *others):
+    # Returns the dtype of a column holding value and others: integers if they
+    # are all integers, doubles if they are all numbers, and otherwise strings
+    # as wide as the longest of them (at least 16). Values that are neither
+    # numbers nor strings raise a ValueError.
+    values = (value,) + others
+    for v in values:
+        if not isinstance(v, (numbers.Real, basestring)):
+            raise ValueError("can't store {0!r} in a results column".format(v))
+    if all(isinstance(v, numbers.Integral) for v in values):
+        return "<i8"
+    if all(isinstance(v, numbers.Real) for v in values):
+        return "<f8"
+    return "S{0}".format(max([16] + [len(str(v)) for v in values]))
+
+def _header(columns):
+    spec = json.dumps([list(c) for c in columns])
+    return MAGIC + struct.pack("<I", len(spec)) + spec
+
+def _read_header(f):
+    # Returns the columns and the size of the header.
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("{0} is not a results file".format(f.name))
+    n, = struct.unpack("<I", f.read(4))
+    columns = [(str(name), str(dtype)) for name, dtype in json.loads(f.read(n))]
+    return columns, len(MAGIC) + 4 + n
+
+def is_results_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class ResultsWriter(object):
+    def __init__(self, path, columns, buffer_rows=1024):
+        # columns: a list of (name, dtype) pairs, see column_type.
+        self.columns = [(name, dtype) for name, dtype in columns]
+        self._row = struct.Struct("<" + "".join(_struct_format(d) for _, d in self.columns))
+        self._strings = [d.startswith("S") for _, d in self.columns]
+        self._widths = [int(d[1:]) if s else None for (_, d), s in zip(self.columns, self._strings)]
+        self._buffer = []
+        self.buffer_rows = buffer_rows
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                existing, header_size = _read_header(f)
+            if existing != self.columns:
+                raise ValueError("{0} has columns {1}, not {2}".format(path, existing, self.columns))
+            self._file = open(path, "ab")
+            # Drop a partly written row, so appended rows stay aligned.
+            size = os.path.getsize(path) - header_size
+            self._file.truncate(header_size + size - size % self._row.size)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(_header(self.columns))
+
+    def write(self, row):
+        # Appends a row, given as a sequence of values in column order.
+        values = [str(v) if s else v for v, s in zip(row, self._strings)]
+        for v, width, (name, dtype) in zip(values, self._widths, self.columns):
+            if width is not None and len(v) > width:
+                raise ValueError("{0!r} doesn't fit in column {1} ({2})".format(v, name, dtype))
+        self._buffer.append(self._row.pack(*values))
+        if len(self._buffer) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        self._file.write("".join(self._buffer))
+        self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_results(path):
+    # Returns the rows of a results file as a read-only NumPy structured array
+    # mapped onto the file; results["cost"] is the cost column.
+    with open(path, "rb") as f:
+        columns, header_size = _read_header(f)
+    dtype = np.dtype(columns)
+    rows = (os.path.getsize(path) - header_size) // dtype.itemsize
+    if rows == 0:
+        return np.zeros(0, dtype)
+    return np.memmap(path, dtype, mode="r", offset=header_size, shape=(rows,))
+
+def chunks(path, rows=1 << 16):
+    # Yields consecutive slices of at most rows rows of a results file.
+    results = read_results(path)
+    for start in xrange(0, len(results), rows):
+        yield results[start:start + rows]
+
+def mean_by(path, keys, value="cost", rows=1 << 16):
+    # Returns {key tuple: mean of value} over the rows of a results file
+    # grouped by the columns keys, aggregating one chunk at a time.
+    sums = {}
+    counts = {}
+    for chunk in chunks(path, rows):
+        groups, inverse = np.unique(chunk[keys], return_inverse=True)
+        chunk_sums = np.bincount(inverse, weights=chunk[value], minlength=len(groups))
+        chunk_counts = np.bincount(inverse, minlength=len(groups))
+        for group, s, c in zip(groups.tolist(), chunk_sums, chunk_counts):
+            sums[group] = sums.get(group, 0.0) + s
+            counts[group] = counts.get(group, 0) + c
+    return dict((k, sums[k] / counts[k]) for k in sums)
@@ -1,6 +1,14 @@
 # Computes reuse distances between two memory locations given
 # loop information.
 
+import bisect
+
+from arith import is_array, np, to_float, trunc
+from lru_cache import LRUCache
+
+# Reuse distances computed so far. See reuse_distance_key.
+_reuse_distance_cache = LRUCache(maxsize=4096)
+
 
 def contains(lookup_idxs, loop_idx):
     # Determines if any of the lookup indices (specified by lookup_idxs)
@@ -29,7 +37,7 @@ def iteration_distance(lookup, loops):
         iters, loop_idx = loop
         if contains(lookup_idxs, loop_idx):
             break
-        iterations *= iters
+        iterations = iterations * iters
     return iterations
 
 def get_is_sequential(seen_loops, lookup_idxs):
@@ -57,17 +65,17 @@ def reuse_distance_to_self(lookup_idxs, loops, num_elems_per_block, should_break
             if not contains(lookup_idxs, loop_idx):
                 break
             seen_loops.append(loop)
-            dist *= iters
+            dist = dist * iters
         else:
             if contains(lookup_idxs, loop_idx):
-                dist *= iters
+                dist = dist * iters
             seen_loops.append(loop)
 
     is_sequential = get_is_sequential(seen_loops, lookup_idxs)
     if is_sequential:
-        dist = int(dist / num_elems_per_block) + 1   # Figure out distance in terms of number of blocks.
+        dist = trunc(dist / num_elems_per_block) + 1   # Figure out distance in terms of number of blocks.
     else:
-        dist = int(dist)
+        dist = trunc(dist)
     return dist, seen_loops
 
 def reuse_distance_to_next(lookup_idxs, loops, num_elems_per_block, should_break=True):
@@ -85,17 +93,17 @@ def reuse_distance_to_next(lookup_idxs, loops, num_elems_per_block, should_break
                 break
             seen_loops.append(loop)
             if contains(lookup_idxs, loop_idx):
-                dist *= iters
+                dist = dist * iters
         else:
             if contains(lookup_idxs, loop_idx):
-                dist *= iters
+                dist = dist * iters
             seen_loops.append(loop)
 
     is_sequential = get_is_sequential(seen_loops, lookup_idxs)
     if is_sequential:
-        dist = int(dist / num_elems_per_block) + 1   # Figure out distance in terms of number of blocks.
+        dist = trunc(dist / num_elems_per_block) + 1   # Figure out distance in terms of number of blocks.
     else:
-        dist = int(dist)
+        dist = trunc(dist)
     return dist, seen_loops
 
 def reuse_distance(lookup, other_lookups, loops, block_size):
@@ -120,7 +128,15 @@ def reuse_distance(lookup, other_lookups, loops, block_size):
     all_other_lookup_idxs = [other_lookup.index for other_lookup in other_lookups
                              if other_lookup.index != lookup.index]
 
-    num_elems_per_block = float(block_size / lookup.elemSize)
+    num_elems_per_block = to_float(block_size / lookup.elemSize)
+
+    key = reuse_distance_key(lookup_idxs, all_other_lookup_idxs, loops, num_elems_per_block)
+    compute = lambda: _reuse_distance(lookup_idxs, all_other_lookup_idxs, loops, num_elems_per_block)
+    if key is None:
+        return compute()
+    return _reuse_distance_cache.lookup(key, compute)
+
+def _reuse_distance(lookup_idxs, all_other_lookup_idxs, loops, num_elems_per_block):
     # Determine number of accesses made to the same array before a particular
     # element is re-used.
     dist, seen_loops = reuse_distance_to_self(lookup_idxs, reversed(loops), num_elems_per_block)
@@ -130,7 +146,7 @@ def reuse_distance(lookup, other_lookups, loops, block_size):
     for other_lookup_idxs in all_other_lookup_idxs:
         other_dist, _ = reuse_distance_to_self(other_lookup_idxs, seen_loops,
                                                num_elems_per_block, should_break=False)
-        dist += other_dist
+        dist = dist + other_dist
 
     dist = dist / num_elems_per_block  # Divide by num_elems_per_block here, since only one
                                        # element in every cache line actually depends on the
@@ -142,11 +158,137 @@ def reuse_distance(lookup, other_lookups, loops, block_size):
     for other_lookup_idxs in all_other_lookup_idxs:
         other_dist_to_next, _ = reuse_distance_to_next(other_lookup_idxs, seen_loops,
                                                        num_elems_per_block, should_break=False)
-        dist_to_next += other_dist_to_next
+        dist_to_next = dist_to_next + other_dist_to_next
 
     # All but one element in each cache block depend on the number of distinct elements
     # accessed since the previous element in the _same_ cache line is accessed.
-    dist += (dist_to_next * ((num_elems_per_block - 1) / num_elems_per_block))
-    dist = int(dist)
+    dist = dist + (dist_to_next * ((num_elems_per_block - 1) / num_elems_per_block))
+    dist = trunc(dist)
 
     return dist
+
+def index_key(lookup_idxs, loops):
+    # A hashable key for a list of lookup indices within a loop nest. The
+    # reuse distance functions only ever compare lookup indices with loop
+    # index variables, so each lookup index is replaced by the positions of
+    # the loops whose index variable it is equal to. Keys are therefore also
+    # shared between loop nests that only differ in variable names.
+    return tuple(tuple(pos for pos, (_, loop_idx) in enumerate(loops) if lookup_idx == loop_idx)
+                 for lookup_idx in lookup_idxs)
+
+def reuse_distance_key(lookup_idxs, all_other_lookup_idxs, loops, num_elems_per_block):
+    # A hashable key which determines the result of _reuse_distance, or None
+    # if the loop nest has unhashable trip counts (e.g. arrays).
+    key = (tuple(iters for iters, _ in loops),
+           index_key(lookup_idxs, loops),
+           tuple(index_key(idxs, loops) for idxs in all_other_lookup_idxs),
+           num_elems_per_block)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def reuse_distance_cache_info():
+    # Returns the hits, misses, maximum size and current size of the reuse
+    # distance cache.
+    return _reuse_distance_cache.info()
+
+def clear_reuse_distance_cache(maxsize=None):
+    # Empties the reuse distance cache and resets its counters, optionally
+    # changing its maximum size.
+    if maxsize is not None:
+        _reuse_distance_cache.maxsize = maxsize
+    _reuse_distance_cache.clear()
+
+def stack_distances(trace):
+    # Returns the stack distance of each access in trace, a sequence of cache
+    # line numbers: the number of distinct other lines accessed since the
+    # previous access to the same line, or -1 for the first access to a line.
+    # An access hits in a fully associative LRU cache of C lines iff its stack
+    # distance is less than C.
+    #
+    # Olken's algorithm: a Fenwick tree over access times marks the most
+    # recent access to each line, so the distinct lines accessed between two
+    # times are the marks between them. O(n log n) for n accesses.
+    n = len(trace)
+    tree = [0] * (n + 1)
+    last = {}
+    distances = [-1] * n
+    for t, line in enumerate(trace):
+        p = last.get(line)
+        if p is not None:
+            # Marks in times (p, t) = prefix sum up to t - prefix sum up to p.
+            d = 0
+            i = t
+            while i > 0:
+                d += tree[i]
+                i -= i & -i
+            i = p + 1
+            while i > 0:
+                d -= tree[i]
+                i -= i & -i
+            distances[t] = d
+            # Unmark the previous access.
+            i = p + 1
+            while i <= n:
+                tree[i] -= 1
+                i += i & -i
+        i = t + 1
+        while i <= n:
+            tree[i] += 1
+            i += i & -i
+        last[line] = t
+    return distances
+
+class ReuseHistogram(object):
+    # The distribution of the reuse distances of a lookup, in cache lines.
+    # Accesses with no earlier access to their line (cold) miss every cache.
+    def __init__(self, distances, cold=0):
+        self.distances = sorted(distances)
+        self.cold = cold
+
+    @classmethod
+    def point(cls, distance):
+        # The histogram of a lookup whose accesses all have the same reuse
+        # distance, e.g. cost_with_bandwidth's scalar estimate.
+        return cls([distance])
+
+    def __len__(self):
+        return len(self.distances) + self.cold
+
+    def hit_fraction(self, size):
+        # The fraction of accesses that hit in an LRU cache of size lines.
+        # size may be an array.
+        if len(self) == 0:
+            return 0.0
+        if is_array(size):
+            return np.searchsorted(self.distances, size, side="left") / float(len(self))
+        return bisect.bisect_left(self.distances, size) / float(len(self))
+
+    def level_fractions(self, cache_sizes):
+        # The fraction of accesses served by each cache of cache_sizes (in
+        # lines, from L1) and by memory, assuming each level holds the most
+        # recently used lines.
+        fractions = []
+        prev = 0.0
+        for size in cache_sizes:
+            hit = self.hit_fraction(size)
+            fractions.append(hit - prev)
+            prev = hit
+        fractions.append(1.0 - prev)
+        return fractions
+
+    def scaled(self, factor):
+        # Returns the histogram with every distance multiplied by factor.
+        return ReuseHistogram([d * factor for d in self.distances], self.cold)
+
+    def buckets(self):
+        # Returns [(low, high, count)] counting the distances in [low, high),
+        # in powers of two, and (None, None, cold) for the cold accesses.
+        counts = {}
+        for d in self.distances:
+            b = (int(d) + 1).bit_length() - 1
+            counts[b] = counts.get(b, 0) + 1
+        return ([((1 << b) - 1, (1 << (b + 1)) - 1, counts[b]) for b in sorted(counts)] +
+                [(None, None, self.cold)])
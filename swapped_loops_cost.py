@@ -19,18 +19,18 @@ the more predictable branch.
 
 """
 
+import argparse
+
 from expressions import *
 from cost_with_bandwidth import *
+from sweep import grid, sweep
 
 def print_result(name, value):
     print "{0}: {1}".format(name, value)
 
-s = 0.01
-
-for k in [10000]:
-  print "----- {0} -----".format(k)
-  for n in [10000]:
-    print "k={0}, n={1}".format(k, n)
+def costs(k, n, s=0.01):
+    # Returns the costs of the original, interchanged and cached loops, with k
+    # outer and n inner iterations and a predicate of selectivity s.
 
     # DIM = 100
     compute_i  = For(100, Id("k"), 1, FixedCostExpr(1))
@@ -42,25 +42,44 @@ for k in [10000]:
     predicate.selectivity = s
     # The predicate is data dependent and unpredictable.
     inner_loop = For(n, Id("j"), 1, predicate)
-    outer_loop = For(k, Id("i"), 1, Let("z", compute_i, inner_loop))
-    c = (cost(outer_loop)) / 1e10
-    print_result("Original", c)
+    original = For(k, Id("i"), 1, Let("z", compute_i, inner_loop))
 
     # Interchange the loops.
     inner_loop_2 = For(k, Id("i"), 1, Let("z", compute_i, inner_expression))
     predicate = If(GreaterThan(Lookup("A", Id("j")), Literal()),
             inner_loop_2, Literal())
     predicate.selectivity = s
-    outer_loop_2 = For(n, Id("j"), 1, predicate)
-    c = (cost(outer_loop_2)) / 1e10
-    print_result("Interchanged", c)
+    interchanged = For(n, Id("j"), 1, predicate)
 
+    # Precompute compute_i once, outside of the loops.
     precomputed_expr = For(k, Id("m"), 1, compute_i);
     inner_loop_2 = For(k, Id("i"), 1, inner_expression)
     predicate = If(GreaterThan(Lookup("A", Id("j")), Literal()),
             inner_loop_2, Literal())
     predicate.selectivity = s
     outer_loop_2 = For(n, Id("j"), 1, predicate)
-    c = (cost(outer_loop_2)) / 1e10
-    c = (cost(outer_loop_2) + cost(precomputed_expr)) / 1e10
-    print_result("Cached", c)
+
+    # cost() only costs a single loop, so the cached plan is the sum of two.
+    outer_loop_2 = hashcons(outer_loop_2)
+    precomputed_expr = hashcons(precomputed_expr)
+    return [("Original", hashcons(original)),
+            ("Interchanged", hashcons(interchanged)),
+            ("Cached", lambda profile: cost(outer_loop_2, profile) + cost(precomputed_expr, profile))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost the original and interchanged loops")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-o", "--output", default=None,
+        help="File to write the results to, one row per point and plan")
+    args = parser.parse_args()
+
+    points = grid([("k", [10000]),
+                   ("n", [10000])])
+    for point, results in sweep(costs, points, args.processes, output=args.output,
+                                columns=["k", "n"]):
+        k, n = point["k"], point["n"]
+        print "----- {0} -----".format(k)
+        print "k={0}, n={1}".format(k, n)
+        for label, c in results:
+            print_result(label, c / 1e10)
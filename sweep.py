@@ -0,0 +1,97 @@
+# Runs a cost model over a grid of parameters.
+"""
+A sweep costs a plan builder at every point of a parameter grid. The builder is
+called with the point's parameters as keyword arguments and returns either
+
+    - an Expr, which is costed with cost_with_bandwidth.cost,
+    - a number, or a function of the machine profile returning one (the cost
+      of a plan made of several expressions), or
+    - a list of (label, Expr or number) pairs, one per plan variant.
+
+Points are costed in a multiprocessing pool, in chunks, and the results come
+back in grid order. The builder must be picklable, i.e. a module-level function.
+Results can be streamed to a binary results file (see results.py) with one row
+per (point, plan): the point's parameters, the plan label and its cost.
+"""
+
+import itertools
+import multiprocessing
+
+from cost_with_bandwidth import cost
+from expressions import Expr
+from machine import DEFAULT
+from results import ResultsWriter, column_type
+
+def grid(axes):
+    # Returns the points of a grid as a list of dicts. axes is a list of
+    # (name, values) pairs; the last axis varies fastest.
+    names = [name for name, _ in axes]
+    return [dict(zip(names, values))
+            for values in itertools.product(*[values for _, values in axes])]
+
+def plan_cost(value, profile):
+    # Returns the cost of a plan built by a builder (see above).
+    if isinstance(value, Expr):
+        return cost(value, profile)
+    if callable(value):
+        return value(DEFAULT if profile is None else profile)
+    return value
+
+def _run(task):
+    # Costs the plans built for a single point.
+    builder, point, profile = task
+    plans = builder(**point)
+    if not isinstance(plans, list):
+        plans = [(None, plans)]
+    return point, [(label, plan_cost(plan, profile)) for label, plan in plans]
+
+def sweep(builder, points, processes=None, chunksize=None, output=None, columns=None,
+          profile=None, labels=None):
+    # Yields (point, [(label, cost), ...]) for each point, in order.
+    #
+    # processes: the number of worker processes (defaults to the number of
+    #   CPUs). With 1, points are costed in this process.
+    # chunksize: the number of points sent to a worker at once.
+    # output: an optional path of a results file; rows are appended to it as
+    #   they arrive.
+    # columns: the point parameters written to output, in order (defaults to
+    #   the sorted parameter names).
+    # profile: the machine.MachineProfile Exprs are costed for.
+    # labels: the plan labels the builder returns, which the plan column of
+    #   output is sized for (defaults to those of the first point). Pass them
+    #   if the labels vary between points, since writing a longer label than
+    #   the column holds raises a ValueError.
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, len(points) / (4 * processes))
+
+    tasks = [(builder, point, profile) for point in points]
+    pool = None
+    if processes > 1 and len(points) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_run, tasks, chunksize)
+    else:
+        results = itertools.imap(_run, tasks)
+
+    out = None
+    try:
+        for point, costs in results:
+            if output is not None:
+                if out is None:
+                    if columns is None:
+                        columns = sorted(point)
+                    # String columns are sized for every point.
+                    types = [column_type(*[p[name] for p in points]) for name in columns]
+                    if labels is None:
+                        labels = [label for label, _ in costs]
+                    plan = column_type("", *[label or "" for label in labels])
+                    out = ResultsWriter(output, zip(columns + ["plan", "cost"], types + [plan, "<f8"]))
+                for label, c in costs:
+                    out.write([point[name] for name in columns] + [label or "", c])
+            yield point, costs
+    finally:
+        if out is not None:
+            out.close()
+        if pool is not None:
+            pool.terminate()